@@ -0,0 +1,198 @@
+# Conversão colunar dos resultados e exportação em streaming.
+# Os lotes de fetchmany são transpostos em colunas e convertidos em arrays tipados do Arrow
+# (pyarrow, quando instalado), gerando DataFrames com dtypes pd.ArrowDtype em vez de colunas 'object'.
+# A exportação (CSV ou Parquet) grava o resultado completo em um arquivo temporário, lote a lote,
+# sem montar o resultado inteiro em memória.
+# pandas e pyarrow são importados apenas quando um resultado é convertido ou exportado.
+import csv
+import importlib.util
+import os
+import tempfile
+from operator import itemgetter
+
+# pyarrow é opcional: sem ele, os DataFrames usam os dtypes padrão do pandas.
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+# Linhas lidas do cursor a cada lote da exportação.
+DEFAULT_EXPORT_CHUNK_ROWS = int(os.getenv("TEXT_TO_SQL_EXPORT_CHUNK_ROWS", "10000"))
+# Limite de linhas de um arquivo exportado (0 = sem limite).
+DEFAULT_EXPORT_MAX_ROWS = int(os.getenv("TEXT_TO_SQL_EXPORT_MAX_ROWS", "1000000"))
+# Diretório dos arquivos exportados (padrão: diretório temporário do sistema).
+EXPORT_DIR = os.getenv("TEXT_TO_SQL_EXPORT_DIR") or None
+
+# Formatos de exportação disponíveis: extensão e tipo MIME.
+EXPORT_FORMATS = {"csv": ("csv", "text/csv")}
+if ARROW_AVAILABLE:
+    EXPORT_FORMATS["parquet"] = ("parquet", "application/vnd.apache.parquet")
+
+
+def rows_to_columns(rows, n_columns):
+    """
+    Transpõe uma lista de linhas (tuplas do cursor) em uma lista de colunas.
+    """
+    # itemgetter por coluna evita zip(*rows), que desempacota todas as linhas como argumentos.
+    return [list(map(itemgetter(i), rows)) for i in range(n_columns)]
+
+
+def _column_array(values, arrow_type=None):
+    """
+    Array Arrow tipado de uma coluna. Valores que o Arrow não consegue tipar (ex: tipos mistos, UUID)
+    viram texto; colunas só com nulos também, para que lotes seguintes possam ter valores.
+    Com arrow_type, valores que não cabem no tipo (ex: texto em uma coluna de inteiros no SQLite)
+    também viram texto; cabe ao chamador ampliar o schema.
+    """
+    import pyarrow as pa
+    arrow_errors = (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, TypeError, ValueError)
+    try:
+        array = pa.array(values, type=arrow_type)
+    except arrow_errors:
+        if arrow_type is not None and not pa.types.is_string(arrow_type):
+            # Ex: decimais com precisão diferente da do primeiro lote; a conversão não pode perder dados.
+            try:
+                return pa.array(values).cast(arrow_type)
+            except arrow_errors:
+                pass
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    if arrow_type is None and pa.types.is_null(array.type):
+        return array.cast(pa.string())
+    return array
+
+
+def rows_to_arrow(columns, rows, schema=None):
+    """
+    Converte um lote de linhas em uma pyarrow.Table, coluna a coluna.
+    Com schema, os tipos são os do lote anterior (necessário para gravar um arquivo Parquet);
+    colunas cujos valores não cabem no tipo do schema saem como texto.
+    """
+    import pyarrow as pa
+    data = rows_to_columns(rows, len(columns))
+    arrays = [
+        _column_array(values, schema.field(i).type if schema is not None else None)
+        for i, values in enumerate(data)
+    ]
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def _file_schema(schema):
+    """
+    Schema do arquivo exportado a partir do primeiro lote: a precisão e a escala inferidas para
+    decimais valem apenas para esse lote, então são ampliadas para acomodar os lotes seguintes.
+    """
+    import pyarrow as pa
+    fields = [
+        field.with_type(pa.decimal128(38, max(field.type.scale, 18))) if pa.types.is_decimal(field.type) else field
+        for field in schema
+    ]
+    return pa.schema(fields)
+
+
+def _widen_parquet(writer, path, batch_schema):
+    """
+    Amplia para texto as colunas do Parquet em gravação cujos valores de um lote não couberam no tipo
+    inferido do primeiro lote. O arquivo parcial é regravado lote a lote com o novo schema.
+    Retorna o novo ParquetWriter.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        field if field.type == batch_field.type else field.with_type(pa.string())
+        for field, batch_field in zip(writer.schema, batch_schema)
+    ])
+    writer.close()
+    partial = f"{path}.partial"
+    os.replace(path, partial)
+    try:
+        writer = pq.ParquetWriter(path, schema)
+        try:
+            for batch in pq.ParquetFile(partial).iter_batches():
+                writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        except BaseException:
+            writer.close()
+            raise
+    finally:
+        os.remove(partial)
+    return writer
+
+
+def rows_to_dataframe(columns, rows):
+    """
+    Monta o DataFrame de exibição a partir das linhas do cursor.
+    Com pyarrow, as colunas são arrays Arrow tipados (pd.ArrowDtype), sem cópia para objetos Python;
+    sem pyarrow, o DataFrame é montado coluna a coluna com os dtypes inferidos pelo pandas.
+    """
+    import pandas as pd
+    columns = list(columns)
+    if ARROW_AVAILABLE:
+        return rows_to_arrow(columns, rows).to_pandas(types_mapper=pd.ArrowDtype)
+    df = pd.DataFrame(dict(enumerate(rows_to_columns(rows, len(columns)))), columns=range(len(columns)))
+    df.columns = columns
+    return df.infer_objects()
+
+
+def export_cursor(cursor, fmt, path=None, chunk_rows=DEFAULT_EXPORT_CHUNK_ROWS, max_rows=DEFAULT_EXPORT_MAX_ROWS):
+    """
+    Grava o resultado de um cursor já executado em um arquivo CSV ou Parquet, lote a lote.
+    Apenas um lote fica em memória por vez. Sem path, cria um arquivo temporário em EXPORT_DIR.
+    Retorna (caminho, linhas gravadas, truncado); truncado indica que max_rows foi atingido.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportação indisponível: {fmt}")
+    temporary = path is None
+    if temporary:
+        fd, path = tempfile.mkstemp(prefix="text_to_sql_export_", suffix=f".{EXPORT_FORMATS[fmt][0]}", dir=EXPORT_DIR)
+        os.close(fd)
+    try:
+        written, truncated = _write_export(cursor, fmt, path, chunk_rows, max_rows)
+    except BaseException:
+        # Não deixa arquivos temporários incompletos (erro ou cancelamento da consulta).
+        if temporary:
+            os.remove(path)
+        raise
+    return path, written, truncated
+
+
+def _write_export(cursor, fmt, path, chunk_rows, max_rows):
+    columns = [desc[0] for desc in cursor.description] if cursor.description else []
+    written = 0
+    truncated = False
+    writer = None
+    # O Parquet é gravado pelo caminho: ao ampliar o schema, o arquivo parcial é regravado.
+    f = open(path, "w", encoding="utf-8", newline="") if fmt == "csv" else None
+    try:
+        if fmt == "csv":
+            writer = csv.writer(f)
+        while True:
+            size = chunk_rows if not max_rows else min(chunk_rows, max_rows - written)
+            if size <= 0:
+                # Verifica se ainda havia linhas além do limite.
+                truncated = bool(cursor.fetchmany(1))
+                break
+            batch = cursor.fetchmany(size)
+            if not columns and cursor.description:
+                # Cursores nomeados do psycopg2 só preenchem description após o primeiro fetch.
+                columns = [desc[0] for desc in cursor.description]
+            if fmt == "csv":
+                if written == 0:
+                    writer.writerow(columns)
+                writer.writerows(batch)
+            elif batch or writer is None:
+                table = rows_to_arrow(columns, batch, schema=writer.schema if writer is not None else None)
+                if writer is None:
+                    schema = _file_schema(table.schema)
+                    table = table.cast(schema)
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(path, schema)
+                elif not table.schema.equals(writer.schema):
+                    # Ex: inteiros no primeiro lote e texto em um lote seguinte (tipagem dinâmica do SQLite).
+                    writer = _widen_parquet(writer, path, table.schema)
+                    table = table.cast(writer.schema)
+                writer.write_table(table)
+            written += len(batch)
+            if not batch:
+                break
+    finally:
+        if f is not None:
+            f.close()
+        elif writer is not None:
+            writer.close()
+    return written, truncated
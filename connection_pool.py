@@ -0,0 +1,159 @@
+# Pool de conexões compartilhado pelo processo, um por DSN.
+# Tanto o SQLDatabase da LangChain quanto a execução das consultas usam o mesmo Engine
+# do SQLAlchemy, com tamanho limitado, pre-ping e reciclagem de conexões antigas.
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+from schema_cache import redact_dsn
+
+# Conexões mantidas abertas por DSN e conexões extras permitidas em picos.
+DEFAULT_POOL_SIZE = int(os.getenv("TEXT_TO_SQL_POOL_SIZE", "5"))
+DEFAULT_MAX_OVERFLOW = int(os.getenv("TEXT_TO_SQL_POOL_MAX_OVERFLOW", "10"))
+# Tempo máximo (em segundos) de espera por uma conexão livre.
+DEFAULT_POOL_TIMEOUT = float(os.getenv("TEXT_TO_SQL_POOL_TIMEOUT", "30"))
+# Conexões mais antigas que isso (em segundos) são recriadas antes do uso.
+DEFAULT_POOL_RECYCLE = int(os.getenv("TEXT_TO_SQL_POOL_RECYCLE", "1800"))
+
+
+class PoolStats:
+    """
+    Contadores de uso de um pool: checkouts, conexões criadas e tempo de espera por conexão.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+
+def reset_session_timeout(dbapi_conn, record):
+    """
+    Devolve MAX_EXECUTION_TIME da sessão MySQL ao valor global quando a conexão volta ao pool,
+    para que o timeout de uma consulta não seja herdado pelo próximo usuário da conexão.
+    Se não for possível restaurá-lo, a conexão é descartada.
+    """
+    if dbapi_conn is None:
+        return
+    try:
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute("SET SESSION MAX_EXECUTION_TIME = DEFAULT")
+        finally:
+            cursor.close()
+    except Exception as e:
+        record.invalidate(e)
+
+
+_engines = {}  # URI completa -> Engine
+_stats = {}  # URI completa -> PoolStats
+_registry_lock = threading.Lock()
+
+
+def get_engine(db_uri):
+    """
+    Retorna o Engine compartilhado para a DSN, criando-o (com seu pool) na primeira chamada.
+    """
+    with _registry_lock:
+        engine = _engines.get(db_uri)
+        if engine is None:
+            backend = make_url(db_uri).get_backend_name()
+            pool_args = {"pool_pre_ping": True, "pool_recycle": DEFAULT_POOL_RECYCLE}
+            # O SQLite em memória usa um pool por thread, que não aceita limites de tamanho.
+            if backend != "sqlite":
+                pool_args.update(
+                    pool_size=DEFAULT_POOL_SIZE,
+                    max_overflow=DEFAULT_MAX_OVERFLOW,
+                    pool_timeout=DEFAULT_POOL_TIMEOUT,
+                )
+            engine = create_engine(db_uri, **pool_args)
+            stats = PoolStats()
+            event.listen(engine, "connect", lambda dbapi_conn, record: stats.record_connect())
+            if backend == "mysql":
+                event.listen(engine, "checkin", reset_session_timeout)
+            _engines[db_uri] = engine
+            _stats[db_uri] = stats
+        return engine
+
+
+def dispose_engine(db_uri):
+    """
+    Fecha as conexões ociosas do pool da DSN e o remove do registro.
+    Conexões emprestadas no momento são descartadas quando devolvidas.
+    """
+    with _registry_lock:
+        engine = _engines.pop(db_uri, None)
+        _stats.pop(db_uri, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def checkout_connection(db_uri):
+    """
+    Retira uma conexão DBAPI do pool da DSN, registrando o tempo de espera.
+    A conexão volta ao pool (com rollback) quando close() é chamado.
+    """
+    engine = get_engine(db_uri)
+    started = time.perf_counter()
+    conn = engine.raw_connection()
+    stats = _stats.get(db_uri)
+    if stats is not None:  # O pool pode ter sido descartado (dispose_engine) nesse intervalo.
+        stats.record_wait(time.perf_counter() - started)
+    return conn
+
+
+@contextmanager
+def pooled_connection(db_uri):
+    """
+    Gerenciador de contexto que empresta uma conexão do pool durante um bloco e a devolve ao final.
+    """
+    conn = checkout_connection(db_uri)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def pool_stats(db_uri):
+    """
+    Retorna a ocupação e as estatísticas de espera do pool da DSN.
+    """
+    engine = _engines.get(db_uri)
+    if engine is None:
+        return None
+    pool = engine.pool
+    stats = _stats[db_uri]
+
+    # Nem todas as classes de pool (ex: SQLite em memória) expõem os contadores de ocupação.
+    def occupancy(name):
+        method = getattr(pool, name, None)
+        return max(method(), 0) if method is not None else 0
+
+    with stats._lock:
+        return {
+            "dsn": redact_dsn(db_uri),
+            "size": occupancy("size"),
+            "checked_out": occupancy("checkedout"),
+            "idle": occupancy("checkedin"),
+            "overflow": occupancy("overflow"),
+            "checkouts": stats.checkouts,
+            "connects": stats.connects,
+            "avg_wait": (stats.total_wait / stats.checkouts) if stats.checkouts else 0.0,
+            "max_wait": stats.max_wait,
+        }
@@ -0,0 +1,86 @@
+# LLM local substituto do Gemini, para uso offline (modo headless, testes e benchmarks).
+# Responde com SQL pré-definido para cada pergunta, com latência configurável.
+import json
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from generation_cache import normalize_question
+
+# Divide a resposta em "tokens" (palavra + espaços seguintes) no streaming.
+TOKEN_PATTERN = re.compile(r"\S+\s*|\s+")
+# Extrai a pergunta do prompt montado a partir de PROMPT_TEMPLATE.
+QUESTION_PATTERN = re.compile(
+    r"\*\*Pergunta do Usuário:\*\*\s*(.*?)\s*(?:SQLQuery:|\*\*Consulta SQL:\*\*|$)", re.DOTALL
+)
+
+
+class CannedSQLLLM(LLM):
+    """
+    LLM determinístico que devolve o SQL associado à pergunta encontrada no prompt.
+    Perguntas desconhecidas recebem default_sql. latency simula o tempo até o primeiro token,
+    token_latency o intervalo entre tokens no streaming e trailing_text uma explicação que o
+    modelo acrescenta depois do SQL.
+    """
+
+    responses: Dict[str, str] = {}
+    default_sql: str = "SELECT 1"
+    latency: float = 0.0
+    token_latency: float = 0.0
+    trailing_text: str = ""
+
+    @property
+    def _llm_type(self) -> str:
+        return "canned-sql"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"default_sql": self.default_sql, "latency": self.latency, "token_latency": self.token_latency}
+
+    def lookup(self, prompt: str) -> str:
+        """
+        Retorna o SQL pré-definido para a pergunta contida no prompt.
+        """
+        match = QUESTION_PATTERN.search(prompt)
+        question = normalize_question(match.group(1) if match else prompt)
+        normalized = {normalize_question(q): sql for q, sql in self.responses.items()}
+        return normalized.get(question, self.default_sql)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        tokens = TOKEN_PATTERN.findall(self.lookup(prompt) + self.trailing_text)
+        if self.token_latency:
+            time.sleep(self.token_latency * len(tokens))
+        return "".join(tokens)
+
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        for i, token in enumerate(TOKEN_PATTERN.findall(self.lookup(prompt) + self.trailing_text)):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            chunk = GenerationChunk(text=token)
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        Carrega as respostas de um arquivo JSON ({pergunta: sql}) ou JSONL
+        (uma linha por objeto com os campos 'question' e 'sql').
+        """
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            data = [json.loads(line) for line in content.splitlines() if line.strip()]
+        if isinstance(data, list):
+            data = {item["question"]: item["sql"] for item in data}
+        return cls(responses=data, **kwargs)
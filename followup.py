@@ -0,0 +1,300 @@
+# Refinamento local de resultados anteriores da sessão.
+# Os últimos N resultados lidos por completo ficam em um SQLite em memória (no processo): o mais recente
+# na tabela 'ultimo_resultado' e os anteriores em 'resultado_<n>'. Perguntas de refinamento ("agora agrupe
+# por mês", "só os 10 maiores") geram SQL sobre essas tabelas, executado localmente em milissegundos,
+# sem acessar o banco de origem.
+import datetime
+import decimal
+import json
+import os
+import re
+import threading
+import time
+import weakref
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from generation_cache import schema_fingerprint
+from result_fetch import DEFAULT_MAX_ROWS, estimate_row_bytes, is_read_query
+
+# Número de resultados mantidos por sessão.
+DEFAULT_FOLLOWUP_RESULTS = int(os.getenv("TEXT_TO_SQL_FOLLOWUP_RESULTS", "5"))
+# Memória estimada máxima dos resultados de uma sessão e de todas as sessões do processo;
+# ao excedê-las, os resultados mais antigos são descartados.
+DEFAULT_FOLLOWUP_MAX_BYTES = int(os.getenv("TEXT_TO_SQL_FOLLOWUP_MAX_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_FOLLOWUP_TOTAL_BYTES = int(os.getenv("TEXT_TO_SQL_FOLLOWUP_TOTAL_BYTES", str(256 * 1024 * 1024)))
+# Tabela com o resultado mais recente.
+LAST_RESULT_TABLE = "ultimo_resultado"
+# Linhas de exemplo de cada resultado enviadas ao LLM.
+FOLLOWUP_SAMPLE_ROWS = 3
+
+
+def _column_names(columns):
+    """
+    Nomes de coluna válidos e únicos para o SQLite (ex: 'COUNT(*)' -> 'count', duplicados com sufixo).
+    """
+    names = []
+    for i, column in enumerate(columns):
+        name = re.sub(r"\W+", "_", str(column)).strip("_").lower() or f"coluna_{i + 1}"
+        if name[0].isdigit():
+            name = f"c_{name}"
+        base, suffix = name, 2
+        while name in names:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        names.append(name)
+    return names
+
+
+def _sqlite_value(value):
+    """
+    Converte valores do driver de origem em tipos aceitos pelo SQLite.
+    """
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+def _sqlite_type(values):
+    """
+    Tipo declarado da coluna a partir do primeiro valor não nulo.
+    """
+    sample = next((v for v in values if v is not None), None)
+    if isinstance(sample, int):
+        return "INTEGER"
+    if isinstance(sample, float):
+        return "REAL"
+    if isinstance(sample, bytes):
+        return "BLOB"
+    return "TEXT"
+
+
+class FollowupStore:
+    """
+    Últimos resultados de uma sessão em um SQLite em memória (uma conexão, compartilhada entre threads).
+    add_result guarda um resultado como 'ultimo_resultado' (renomeando o anterior para 'resultado_<n>')
+    e descarta os mais antigos além de max_results ou de max_bytes (memória estimada). O orçamento
+    compartilhado (get_followup_budget) limita também a soma de todas as sessões do processo.
+    sql_database expõe as tabelas à LangChain e execute roda consultas de leitura sobre elas.
+    """
+
+    def __init__(self, max_results=DEFAULT_FOLLOWUP_RESULTS, max_bytes=DEFAULT_FOLLOWUP_MAX_BYTES, budget=None):
+        self.engine = create_engine(
+            "sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False}
+        )
+        self.max_results = max_results
+        self.max_bytes = max_bytes
+        self.budget = budget if budget is not None else get_followup_budget()
+        self.results = []  # Do mais antigo ao mais recente: tabela, pergunta, SQL de origem e linhas.
+        self.version = 0  # Incrementada a cada resultado adicionado.
+        self._sequence = 0
+        self._lock = threading.RLock()
+        self._db = None
+        self._chain = None  # (versão, cadeia) da última cadeia construída.
+        self.budget.register(self)
+
+    def _execute(self, statement, params=None):
+        conn = self.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            if params is None:
+                cursor.execute(statement)
+            else:
+                cursor.executemany(statement, params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @property
+    def nbytes(self):
+        """
+        Memória estimada dos resultados guardados.
+        """
+        with self._lock:
+            return sum(result["bytes"] for result in self.results)
+
+    def oldest_added_at(self):
+        with self._lock:
+            return self.results[0]["added_at"] if self.results else None
+
+    def add_result(self, columns, rows, source_sql, question=None):
+        """
+        Guarda um resultado (colunas e linhas) como a tabela 'ultimo_resultado'.
+        Retorna False, sem guardá-lo, se o resultado sozinho exceder max_bytes.
+        """
+        names = _column_names(columns)
+        data = [[_sqlite_value(v) for v in row] for row in rows]
+        nbytes = sum(estimate_row_bytes(row) for row in data)
+        if nbytes > self.max_bytes:
+            return False
+        column_types = [_sqlite_type(row[i] for row in data) for i in range(len(names))]
+        with self._lock:
+            self._sequence += 1
+            if self.results:
+                previous = self.results[-1]
+                previous["table"] = f"resultado_{previous['sequence']}"
+                self._execute(f'ALTER TABLE "{LAST_RESULT_TABLE}" RENAME TO "{previous["table"]}"')
+            definition = ", ".join(f'"{name}" {column_type}' for name, column_type in zip(names, column_types))
+            self._execute(f'CREATE TABLE "{LAST_RESULT_TABLE}" ({definition})')
+            if data:
+                placeholders = ", ".join("?" for _ in names)
+                self._execute(f'INSERT INTO "{LAST_RESULT_TABLE}" VALUES ({placeholders})', data)
+            self.results.append({
+                "table": LAST_RESULT_TABLE, "sequence": self._sequence, "question": question,
+                "sql": source_sql, "rows": len(data), "bytes": nbytes, "added_at": time.monotonic(),
+            })
+            while len(self.results) > self.max_results or self.nbytes > self.max_bytes:
+                self._drop_oldest()
+            self.version += 1
+            self._db = None
+        # Fora do lock da sessão: o orçamento pode descartar resultados de outras sessões.
+        self.budget.enforce()
+        return True
+
+    def _drop_oldest(self):
+        # Deve ser chamado com o lock adquirido.
+        oldest = self.results.pop(0)
+        self._execute(f'DROP TABLE "{oldest["table"]}"')
+        return oldest["bytes"]
+
+    def drop_oldest(self):
+        """
+        Descarta o resultado mais antigo (chamado pelo orçamento do processo) e retorna os bytes liberados.
+        """
+        with self._lock:
+            if not self.results:
+                return 0
+            freed = self._drop_oldest()
+            self.version += 1
+            self._db = None
+            return freed
+
+    def sql_database(self):
+        """
+        SQLDatabase da LangChain sobre os resultados guardados. O table_info de cada tabela traz
+        a pergunta que a originou, ajudando o LLM a identificar a qual resultado o refinamento se refere.
+        """
+        from langchain_community.utilities import SQLDatabase
+
+        with self._lock:
+            if self._db is None and self.results:
+                plain = SQLDatabase(self.engine, sample_rows_in_table_info=FOLLOWUP_SAMPLE_ROWS)
+                custom_table_info = {
+                    result["table"]: (
+                        f"/* Resultado {'mais recente' if result['table'] == LAST_RESULT_TABLE else 'anterior'}"
+                        f" da pergunta: {result['question'] or result['sql']} */\n"
+                        + plain.get_table_info([result["table"]])
+                    )
+                    for result in self.results
+                }
+                self._db = SQLDatabase(self.engine, sample_rows_in_table_info=FOLLOWUP_SAMPLE_ROWS,
+                                       custom_table_info=custom_table_info)
+            return self._db
+
+    def schema_fingerprint(self):
+        """
+        Impressão digital das tabelas guardadas, usada na chave do cache de geração.
+        """
+        db = self.sql_database()
+        return schema_fingerprint(db.get_table_info()) if db is not None else None
+
+    def chain(self, build_chain):
+        """
+        Cadeia Text-to-SQL sobre os resultados guardados, reconstruída quando um resultado é adicionado.
+        build_chain(db) recebe o SQLDatabase e retorna a cadeia.
+        """
+        with self._lock:
+            if self._chain is None or self._chain[0] != self.version:
+                db = self.sql_database()
+                self._chain = (self.version, build_chain(db) if db is not None else None)
+            return self._chain[1]
+
+    def execute(self, sql_query, max_rows=DEFAULT_MAX_ROWS):
+        """
+        Executa uma consulta de leitura sobre os resultados guardados e retorna (colunas, linhas).
+        """
+        if not is_read_query(sql_query):
+            raise ValueError("Apenas consultas de leitura podem ser executadas sobre resultados anteriores.")
+        with self._lock:
+            conn = self.engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql_query)
+                columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                rows = cursor.fetchmany(max_rows) if cursor.description else []
+                cursor.close()
+                conn.rollback()
+            finally:
+                conn.close()
+        return columns, rows
+
+    def close(self):
+        with self._lock:
+            self.results = []
+            self._db = None
+            self._chain = None
+            self.engine.dispose()
+
+
+class FollowupBudget:
+    """
+    Orçamento de memória compartilhado pelos FollowupStore do processo (referências fracas).
+    Quando a soma estimada excede max_bytes, descarta os resultados mais antigos, de qualquer sessão.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_FOLLOWUP_TOTAL_BYTES):
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._stores = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def register(self, store):
+        with self._lock:
+            self._stores.add(store)
+
+    def nbytes(self):
+        with self._lock:
+            stores = list(self._stores)
+        return sum(store.nbytes for store in stores)
+
+    def enforce(self):
+        """
+        Descarta os resultados mais antigos até a memória estimada caber no orçamento. Retorna quantos foram descartados.
+        """
+        with self._lock:
+            stores = list(self._stores)
+        total = sum(store.nbytes for store in stores)
+        evicted = 0
+        while total > self.max_bytes:
+            candidates = [(store.oldest_added_at(), i) for i, store in enumerate(stores)]
+            candidates = [candidate for candidate in candidates if candidate[0] is not None]
+            if not candidates:
+                break
+            total -= stores[min(candidates)[1]].drop_oldest()
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+        return evicted
+
+
+# Instância única por processo.
+_budget_instance = None
+_budget_lock = threading.Lock()
+
+
+def get_followup_budget():
+    """
+    Retorna o orçamento de memória dos resultados de refinamento do processo, criando-o na primeira chamada.
+    """
+    global _budget_instance
+    with _budget_lock:
+        if _budget_instance is None:
+            _budget_instance = FollowupBudget()
+        return _budget_instance
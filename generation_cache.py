@@ -0,0 +1,200 @@
+# Cache de geração NL -> SQL, compartilhado entre sessões do Streamlit.
+# Possui duas camadas: uma LRU em memória com TTL e uma camada persistente em SQLite,
+# que sobrevive a reinicializações do processo.
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Caminho padrão do arquivo SQLite usado pela camada persistente.
+DEFAULT_CACHE_PATH = os.getenv("TEXT_TO_SQL_CACHE_PATH", "text_to_sql_cache.db")
+# Número máximo de entradas mantidas na camada em memória.
+DEFAULT_MEMORY_ENTRIES = int(os.getenv("TEXT_TO_SQL_CACHE_MEMORY_ENTRIES", "512"))
+# Tempo de vida (em segundos) das entradas em memória e em disco.
+DEFAULT_MEMORY_TTL = float(os.getenv("TEXT_TO_SQL_CACHE_MEMORY_TTL", "3600"))
+DEFAULT_DISK_TTL = float(os.getenv("TEXT_TO_SQL_CACHE_DISK_TTL", str(7 * 24 * 3600)))
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normaliza a pergunta do usuário para uso na chave do cache.
+    Aplica normalização Unicode (NFC) e colapsa espaços em branco, preservando
+    maiúsculas/minúsculas, pois literais da pergunta podem depender delas.
+    """
+    if not question:
+        return ""
+    question = unicodedata.normalize("NFC", question)
+    return re.sub(r"\s+", " ", question).strip()
+
+
+def schema_fingerprint(table_info: str) -> str:
+    """
+    Calcula uma impressão digital (SHA-256) do table_info entregue ao LLM.
+    Qualquer mudança no schema ou nas linhas de amostra gera uma chave diferente.
+    """
+    return hashlib.sha256((table_info or "").encode("utf-8")).hexdigest()
+
+
+def make_cache_key(question: str, dialect: str, top_k: int, schema_fp: str) -> str:
+    """
+    Monta a chave do cache combinando pergunta normalizada, dialeto, top_k
+    e a impressão digital do schema.
+    """
+    raw = "\x1f".join([normalize_question(question), dialect or "", str(top_k), schema_fp or ""])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class GenerationCache:
+    """
+    Cache de duas camadas para o SQL gerado pelo LLM.
+    A camada em memória é uma LRU limitada com TTL; a camada em disco é um arquivo
+    SQLite compartilhado por todas as sessões. Acertos em disco são promovidos à memória.
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MEMORY_ENTRIES,
+                 memory_ttl=DEFAULT_MEMORY_TTL, disk_ttl=DEFAULT_DISK_TTL):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.memory_ttl = memory_ttl
+        self.disk_ttl = disk_ttl
+        self._memory = OrderedDict()  # chave -> (sql, instante de expiração)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._init_disk()
+
+    @contextmanager
+    def _connect(self):
+        # Uma conexão por operação evita compartilhar objetos sqlite3 entre threads do Streamlit.
+        # "with conn" apenas confirma a transação; a conexão é fechada explicitamente.
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_disk(self):
+        """
+        Cria a tabela da camada persistente, se ainda não existir.
+        Sem db_path, ou em caso de falha (ex: diretório sem permissão), o cache segue apenas em memória.
+        """
+        if not self.db_path:
+            return
+        try:
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS generation_cache ("
+                    " cache_key TEXT PRIMARY KEY,"
+                    " sql_text TEXT NOT NULL,"
+                    " created_at REAL NOT NULL)"
+                )
+        except sqlite3.Error:
+            self.db_path = None
+
+    def get(self, key):
+        """
+        Busca o SQL associado à chave, primeiro em memória e depois em disco.
+        Retorna None em caso de ausência ou expiração.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                sql_text, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return sql_text
+                del self._memory[key]
+
+        sql_text = self._disk_get(key, now)
+        with self._lock:
+            if sql_text is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._memory_set(key, sql_text, now)
+        return sql_text
+
+    def set(self, key, sql_text):
+        """
+        Armazena o SQL gerado nas duas camadas. SQLs vazios não são armazenados.
+        """
+        if not sql_text:
+            return
+        now = time.time()
+        with self._lock:
+            self._memory_set(key, sql_text, now)
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO generation_cache (cache_key, sql_text, created_at) VALUES (?, ?, ?)",
+                        (key, sql_text, now),
+                    )
+            except sqlite3.Error:
+                pass
+
+    def _memory_set(self, key, sql_text, now):
+        # Deve ser chamado com o lock adquirido.
+        self._memory[key] = (sql_text, now + self.memory_ttl)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        if not self.db_path:
+            return None
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT sql_text, created_at FROM generation_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] + self.disk_ttl <= now:
+                    conn.execute("DELETE FROM generation_cache WHERE cache_key = ?", (key,))
+                    return None
+                return row[0]
+        except sqlite3.Error:
+            return None
+
+    def stats(self):
+        """
+        Retorna os contadores de acertos/faltas e o tamanho atual da camada em memória.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (hits / total) if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+# Instância única por processo. Fica neste módulo (e não em text_to_sql.py) porque o
+# Streamlit reexecuta o script principal a cada interação, mas mantém módulos importados.
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_generation_cache():
+    """
+    Retorna o cache de geração compartilhado pelo processo, criando-o na primeira chamada.
+    """
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = GenerationCache()
+        return _cache_instance
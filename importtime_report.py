@@ -0,0 +1,146 @@
+# Relatório do tempo de importação (partida a frio) dos pontos de entrada do Text-to-SQL.
+# Cada cenário roda em um interpretador novo com "python -X importtime"; o tempo próprio de cada
+# módulo é somado por pacote raiz, mostrando quanto cada dependência (Streamlit, SQLAlchemy, pandas,
+# LangChain, drivers...) custa na partida e quais delas foram carregadas.
+# Com --ref, os mesmos cenários são medidos em outra revisão do repositório (ex: antes da mudança).
+#
+# Exemplo:
+#   python importtime_report.py
+#   python importtime_report.py --ref HEAD~1 --output importtime.json
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+# Cenários medidos: nome -> código executado no interpretador novo.
+# Os pools são criados sem conectar, o que já importa o driver da DSN.
+SCENARIOS = {
+    "interface": "import text_to_sql",
+    "interface + pool PostgreSQL": (
+        "import text_to_sql; text_to_sql.get_engine('postgresql+psycopg2://usuario@localhost/banco')"
+    ),
+    "interface + pool MySQL": (
+        "import text_to_sql; text_to_sql.get_engine('mysql+mysqlconnector://usuario@localhost/banco')"
+    ),
+    "headless (batch)": "import batch",
+    "serviço HTTP": "import service",
+}
+
+# Pacotes pesados cuja presença é informada em cada cenário.
+WATCHED_PACKAGES = (
+    "streamlit", "sqlalchemy", "pandas", "pyarrow", "numpy", "psycopg2", "mysql", "langchain",
+    "langchain_core", "langchain_community", "langchain_google_genai", "aiohttp",
+)
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)\s*$")
+
+
+def parse_importtime(stderr):
+    """
+    Soma o tempo próprio (em segundos) dos módulos importados, no total e por pacote raiz.
+    """
+    total = 0
+    by_package = {}
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, module = int(match.group(1)), match.group(3)
+        package = module.split(".")[0]
+        total += self_us
+        by_package[package] = by_package.get(package, 0) + self_us
+    return total / 1e6, {package: us / 1e6 for package, us in by_package.items()}
+
+
+def measure(code, cwd, repeat):
+    """
+    Executa o cenário repeat vezes (após uma execução de aquecimento, que compila o bytecode) e retorna,
+    da execução mediana, o tempo total, o tempo por pacote e os pacotes vigiados carregados.
+    """
+    runs = []
+    for i in range(repeat + 1):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code], cwd=cwd, capture_output=True, text=True,
+            env={**os.environ, "PYTHONPATH": cwd},
+        )
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()
+            return {"error": error[-1] if error else f"código de saída {completed.returncode}"}
+        if i > 0:
+            runs.append(parse_importtime(completed.stderr))
+    runs.sort(key=lambda run: run[0])
+    total, by_package = runs[len(runs) // 2]
+    return {
+        "total_seconds": total,
+        "packages": dict(sorted(by_package.items(), key=lambda item: -item[1])),
+        "loaded": [package for package in WATCHED_PACKAGES if package in by_package],
+    }
+
+
+def checkout_ref(ref, root, workdir):
+    """
+    Extrai os arquivos da revisão ref (git archive) em workdir, sem alterar a árvore de trabalho.
+    """
+    archive = subprocess.run(["git", "archive", ref], cwd=root, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", workdir], input=archive, check=True)
+    return workdir
+
+
+def print_report(results, top):
+    has_ref = any("ref" in result for result in results.values())
+    for name, result in results.items():
+        current = result["atual"]
+        print(f"\n== {name}")
+        if "error" in current:
+            print(f"  erro: {current['error']}")
+            continue
+        line = f"  total: {current['total_seconds'] * 1000:.0f} ms"
+        if has_ref:
+            reference = result.get("ref", {})
+            if "total_seconds" in reference:
+                delta = current["total_seconds"] - reference["total_seconds"]
+                line += f"  (ref: {reference['total_seconds'] * 1000:.0f} ms, {delta * 1000:+.0f} ms)"
+            else:
+                line += f"  (ref: {reference.get('error', 'indisponível')})"
+        print(line)
+        print(f"  pacotes carregados: {', '.join(current['loaded']) or '-'}")
+        if has_ref and "loaded" in result.get("ref", {}):
+            print(f"  pacotes carregados (ref): {', '.join(result['ref']['loaded']) or '-'}")
+        for package, seconds in list(current["packages"].items())[:top]:
+            print(f"    {package:<28} {seconds * 1000:8.1f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mede o tempo de importação dos pontos de entrada do Text-to-SQL.")
+    parser.add_argument("--repeat", type=int, default=3, help="Execuções por cenário (usa a mediana).")
+    parser.add_argument("--top", type=int, default=10, help="Pacotes mais lentos listados por cenário.")
+    parser.add_argument("--ref", default=None, help="Revisão do git para comparação (ex: HEAD~1).")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Cenários medidos (padrão: todos).")
+    parser.add_argument("--output", default=None, help="Grava o relatório completo em JSON.")
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    names = args.scenario or list(SCENARIOS)
+    results = {name: {} for name in names}
+    with tempfile.TemporaryDirectory(prefix="text_to_sql_importtime_") as workdir:
+        if args.ref:
+            checkout_ref(args.ref, root, workdir)
+            for name in names:
+                print(f"Medindo '{name}' em {args.ref}...", file=sys.stderr)
+                results[name]["ref"] = measure(SCENARIOS[name], workdir, args.repeat)
+        for name in names:
+            print(f"Medindo '{name}'...", file=sys.stderr)
+            results[name]["atual"] = measure(SCENARIOS[name], root, args.repeat)
+
+    print_report(results, args.top)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "ref": args.ref, "scenarios": results}, f,
+                      indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+# Instrumentação de latência por etapa e exportação de métricas.
+# Cada requisição (geração ou execução) gera um RequestTrace com a duração de cada etapa;
+# o registro do processo agrega os traces em histogramas no formato texto do Prometheus
+# e grava cada trace em um log JSONL rotativo.
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Limites (em segundos) dos buckets dos histogramas.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Log JSONL de traces (vazio desativa) e tamanho máximo antes da rotação.
+DEFAULT_TRACE_LOG = os.getenv("TEXT_TO_SQL_TRACE_LOG", "text_to_sql_traces.jsonl")
+DEFAULT_TRACE_LOG_MAX_BYTES = int(os.getenv("TEXT_TO_SQL_TRACE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+# Amostras recentes mantidas por etapa para o cálculo de percentis exibido na interface.
+RECENT_SAMPLES = 1000
+# Caracteres por token usados para estimar o consumo quando o provedor não informa (streaming interrompido).
+CHARS_PER_TOKEN = 4
+
+
+class RequestTrace:
+    """
+    Registro das etapas de uma requisição. Cada etapa tem nome, duração em segundos e
+    atributos livres (linhas, bytes, tokens, tempo até o primeiro token etc.).
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **attrs):
+        """
+        Mede a duração do bloco como uma etapa. O dicionário retornado pode receber
+        atributos adicionais durante o bloco (ex: número de linhas).
+        """
+        record = dict(attrs)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add_stage(name, time.perf_counter() - started, **record)
+
+    def add_stage(self, name, seconds, **attrs):
+        self.stages.append({"stage": name, "seconds": seconds, **attrs})
+
+    def total_seconds(self):
+        return sum(stage["seconds"] for stage in self.stages)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "total_seconds": self.total_seconds(),
+            "stages": self.stages,
+        }
+
+
+def _define_llm_stage_callback():
+    # A LangChain só é importada quando o callback é usado (ao gerar SQL com uma cadeia já montada).
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMStageCallback(BaseCallbackHandler):
+        """
+        Callback da LangChain que registra no trace as etapas internas da cadeia Text-to-SQL:
+        montagem do table_info, renderização do prompt e chamada ao LLM (com tempo até o
+        primeiro token e contagem de tokens, quando o provedor informa).
+        """
+
+        def __init__(self, trace):
+            self.trace = trace
+            self._runs = {}  # run_id -> (etapa, início)
+            self._llm = {}  # run_id -> dados da chamada ao LLM
+
+        def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+            name = kwargs.get("name") or (serialized or {}).get("name") or ""
+            if name.startswith("RunnableAssign") and "table_info" in name:
+                self._runs[run_id] = ("table_info", time.perf_counter())
+            elif name == "PromptTemplate":
+                self._runs[run_id] = ("prompt", time.perf_counter())
+
+        def on_chain_end(self, outputs, *, run_id, **kwargs):
+            entry = self._runs.pop(run_id, None)
+            if entry is None:
+                return
+            stage, started = entry
+            attrs = {}
+            if stage == "table_info" and isinstance(outputs, dict):
+                attrs["chars"] = len(outputs.get("table_info") or "")
+            elif stage == "prompt":
+                attrs["chars"] = len(getattr(outputs, "text", None) or str(outputs))
+            self.trace.add_stage(stage, time.perf_counter() - started, **attrs)
+
+        def _llm_started(self, run_id, prompt_chars):
+            self._llm[run_id] = {"started": time.perf_counter(), "first_token": None, "prompt_chars": prompt_chars,
+                                 "streamed_chars": 0, "usage": None}
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self._llm_started(run_id, sum(len(p) for p in prompts))
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._llm_started(run_id, sum(len(str(m.content)) for batch in messages for m in batch))
+
+        def on_llm_new_token(self, token, *, run_id, **kwargs):
+            data = self._llm.get(run_id)
+            if data is None:
+                return
+            if data["first_token"] is None:
+                data["first_token"] = time.perf_counter()
+            data["streamed_chars"] += len(token)
+            # Uso informado nos chunks (somado, como em AIMessageChunk), quando o provedor envia durante o streaming.
+            chunk = kwargs.get("chunk")
+            usage = getattr(getattr(chunk, "message", None), "usage_metadata", None)
+            if usage:
+                total = data["usage"] or {"input_tokens": 0, "output_tokens": 0}
+                total["input_tokens"] += usage.get("input_tokens") or 0
+                total["output_tokens"] += usage.get("output_tokens") or 0
+                data["usage"] = total
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            data = self._llm.pop(run_id, None)
+            if data is None:
+                return
+            ended = time.perf_counter()
+            prompt_tokens = completion_tokens = None
+            text = ""
+            generations = response.generations[0] if response.generations else []
+            if generations:
+                text = generations[0].text or ""
+                usage = getattr(getattr(generations[0], "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens = usage.get("input_tokens")
+                    completion_tokens = usage.get("output_tokens")
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt_tokens = prompt_tokens if prompt_tokens is not None else token_usage.get("prompt_tokens")
+            completion_tokens = completion_tokens if completion_tokens is not None else token_usage.get("completion_tokens")
+            # Sem streaming, o primeiro token só é conhecido quando a resposta completa chega.
+            first_token = data["first_token"] or ended
+            self.trace.add_stage(
+                "llm", ended - data["started"],
+                ttft_seconds=first_token - data["started"],
+                prompt_chars=data["prompt_chars"], response_chars=len(text),
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            )
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            data = self._llm.pop(run_id, None)
+            if data is None:
+                return
+            ended = time.perf_counter()
+            if isinstance(error, GeneratorExit):
+                # Streaming interrompido pelo consumidor assim que o comando SQL ficou completo: o provedor
+                # não chega a informar o uso final, então vale o dos chunks recebidos ou uma estimativa.
+                usage = data["usage"] or {}
+                prompt_tokens = usage.get("input_tokens") or -(-data["prompt_chars"] // CHARS_PER_TOKEN)
+                completion_tokens = usage.get("output_tokens") or -(-data["streamed_chars"] // CHARS_PER_TOKEN)
+                estimated = not (usage.get("input_tokens") and usage.get("output_tokens"))
+                self.trace.add_stage(
+                    "llm", ended - data["started"],
+                    ttft_seconds=(data["first_token"] or ended) - data["started"],
+                    prompt_chars=data["prompt_chars"], response_chars=data["streamed_chars"],
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    tokens_estimated=estimated, stopped_early=True,
+                )
+            else:
+                self.trace.add_stage("llm", ended - data["started"], error=str(error))
+
+    return LLMStageCallback
+
+
+def __getattr__(name):
+    """
+    Define LLMStageCallback no primeiro acesso (from metrics import LLMStageCallback),
+    evitando importar a LangChain junto com o módulo de métricas.
+    """
+    if name == "LLMStageCallback":
+        globals()[name] = _define_llm_stage_callback()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class Histogram:
+    """
+    Histograma cumulativo no estilo Prometheus, com soma, contagem e amostras recentes para percentis.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class MetricsRegistry:
+    """
+    Agrega os traces do processo: histogramas de duração por (tipo, etapa), histograma do tempo
+    até o primeiro token, e contadores de linhas, bytes e tokens. Também grava cada trace no log JSONL.
+    """
+
+    def __init__(self, trace_log=DEFAULT_TRACE_LOG, trace_log_max_bytes=DEFAULT_TRACE_LOG_MAX_BYTES):
+        self.trace_log = trace_log
+        self.trace_log_max_bytes = trace_log_max_bytes
+        self._lock = threading.Lock()
+        self.durations = defaultdict(Histogram)  # (tipo, etapa) -> Histogram
+        self.ttft = Histogram()
+        self.rows = defaultdict(int)  # etapa -> linhas
+        self.bytes = defaultdict(int)  # etapa -> bytes
+        self.tokens = defaultdict(int)  # 'prompt' / 'completion' -> tokens
+        self.requests = defaultdict(int)  # tipo -> requisições
+
+    def observe(self, trace):
+        """
+        Registra um trace concluído nas métricas agregadas e no log JSONL.
+        """
+        with self._lock:
+            self.requests[trace.kind] += 1
+            self.durations[(trace.kind, "total")].observe(trace.total_seconds())
+            for stage in trace.stages:
+                name = stage["stage"]
+                self.durations[(trace.kind, name)].observe(stage["seconds"])
+                if stage.get("rows"):
+                    self.rows[name] += stage["rows"]
+                if stage.get("bytes"):
+                    self.bytes[name] += stage["bytes"]
+                if name == "llm":
+                    if stage.get("ttft_seconds") is not None:
+                        self.ttft.observe(stage["ttft_seconds"])
+                    self.tokens["prompt"] += stage.get("prompt_tokens") or 0
+                    self.tokens["completion"] += stage.get("completion_tokens") or 0
+            self._write_trace(trace)
+
+    def _write_trace(self, trace):
+        # Deve ser chamado com o lock adquirido. Mantém um arquivo de backup (.1) na rotação.
+        if not self.trace_log:
+            return
+        try:
+            if os.path.exists(self.trace_log) and os.path.getsize(self.trace_log) >= self.trace_log_max_bytes:
+                os.replace(self.trace_log, self.trace_log + ".1")
+            with open(self.trace_log, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + "\n")
+        except OSError:
+            pass
+
+    def summary(self):
+        """
+        Retorna, por (tipo, etapa), o número de amostras e os percentis p50/p95 em segundos.
+        """
+        with self._lock:
+            return [
+                {"kind": kind, "stage": stage, "count": h.count,
+                 "p50": h.percentile(0.5), "p95": h.percentile(0.95)}
+                for (kind, stage), h in sorted(self.durations.items())
+            ]
+
+    def to_prometheus(self):
+        """
+        Renderiza as métricas no formato texto de exposição do Prometheus.
+        """
+        lines = []
+
+        def histogram(name, labels, h):
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            prefix = f"{label_str}," if label_str else ""
+            for bound, count in zip(h.buckets, h.counts):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {h.count}')
+            lines.append(f"{name}_sum{{{label_str}}} {h.sum}")
+            lines.append(f"{name}_count{{{label_str}}} {h.count}")
+
+        with self._lock:
+            lines.append("# HELP text_to_sql_stage_duration_seconds Duração de cada etapa da requisição.")
+            lines.append("# TYPE text_to_sql_stage_duration_seconds histogram")
+            for (kind, stage), h in sorted(self.durations.items()):
+                histogram("text_to_sql_stage_duration_seconds", {"kind": kind, "stage": stage}, h)
+            lines.append("# HELP text_to_sql_llm_time_to_first_token_seconds Tempo até o primeiro token do LLM.")
+            lines.append("# TYPE text_to_sql_llm_time_to_first_token_seconds histogram")
+            histogram("text_to_sql_llm_time_to_first_token_seconds", {}, self.ttft)
+            lines.append("# HELP text_to_sql_requests_total Requisições instrumentadas por tipo.")
+            lines.append("# TYPE text_to_sql_requests_total counter")
+            for kind, value in sorted(self.requests.items()):
+                lines.append(f'text_to_sql_requests_total{{kind="{kind}"}} {value}')
+            lines.append("# HELP text_to_sql_rows_total Linhas retornadas por etapa.")
+            lines.append("# TYPE text_to_sql_rows_total counter")
+            for stage, value in sorted(self.rows.items()):
+                lines.append(f'text_to_sql_rows_total{{stage="{stage}"}} {value}')
+            lines.append("# HELP text_to_sql_bytes_total Bytes retornados por etapa.")
+            lines.append("# TYPE text_to_sql_bytes_total counter")
+            for stage, value in sorted(self.bytes.items()):
+                lines.append(f'text_to_sql_bytes_total{{stage="{stage}"}} {value}')
+            lines.append("# HELP text_to_sql_llm_tokens_total Tokens consumidos pelo LLM.")
+            lines.append("# TYPE text_to_sql_llm_tokens_total counter")
+            for token_type, value in sorted(self.tokens.items()):
+                lines.append(f'text_to_sql_llm_tokens_total{{type="{token_type}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+# Instância única por processo (o Streamlit reexecuta o script principal, mas mantém este módulo).
+_registry = None
+_registry_lock = threading.Lock()
+_server = None
+
+
+def get_metrics_registry():
+    """
+    Retorna o registro de métricas compartilhado pelo processo, criando-o na primeira chamada.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+def start_metrics_server(port):
+    """
+    Inicia (uma única vez por processo) um servidor HTTP em segundo plano que expõe /metrics
+    no formato do Prometheus.
+    """
+    global _server
+    with _registry_lock:
+        if _server is not None:
+            return _server
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = get_metrics_registry().to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        _server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
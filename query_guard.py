@@ -0,0 +1,397 @@
+# Proteções para a execução do SQL gerado pelo LLM:
+# - estimativa de custo via EXPLAIN (PostgreSQL: EXPLAIN (FORMAT JSON); MySQL: EXPLAIN FORMAT=JSON),
+#   com rejeição ou reescrita com um LIMIT menor quando um limite configurado é ultrapassado;
+# - timeout de execução no servidor (statement_timeout / MAX_EXECUTION_TIME);
+# - registro das consultas em andamento, permitindo cancelá-las (cancel() / KILL QUERY).
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from connection_pool import pooled_connection
+from result_fetch import is_read_query
+
+# Custo estimado máximo (unidades do otimizador do banco) e linhas estimadas máximas.
+DEFAULT_MAX_COST = float(os.getenv("TEXT_TO_SQL_MAX_COST", "1000000"))
+DEFAULT_MAX_ESTIMATED_ROWS = float(os.getenv("TEXT_TO_SQL_MAX_ESTIMATED_ROWS", "1000000"))
+# Ação quando um limite é ultrapassado: 'limit' (reescreve com LIMIT) ou 'reject'.
+DEFAULT_GUARD_ACTION = os.getenv("TEXT_TO_SQL_GUARD_ACTION", "limit")
+# LIMIT aplicado às consultas reescritas.
+DEFAULT_GUARD_LIMIT = int(os.getenv("TEXT_TO_SQL_GUARD_LIMIT", "1000"))
+# Decisões de custo memorizadas por sessão na interface (por SQL e limites).
+QUERY_GUARD_MEMO_SIZE = 16
+# Timeout de execução no servidor, em segundos (0 desativa).
+DEFAULT_STATEMENT_TIMEOUT = float(os.getenv("TEXT_TO_SQL_STATEMENT_TIMEOUT", "30"))
+
+# Comandos que aceitam EXPLAIN sem serem executados.
+EXPLAINABLE_KEYWORDS = {"SELECT", "WITH", "VALUES", "TABLE", "INSERT", "UPDATE", "DELETE", "REPLACE"}
+# Comandos de leitura que podem ser reescritos com LIMIT.
+LIMITABLE_KEYWORDS = {"SELECT", "WITH", "VALUES", "TABLE"}
+# Cláusulas de limite do nível externo: 'LIMIT n', 'LIMIT m, n' (MySQL), 'LIMIT ALL' e 'FETCH FIRST n ROWS ONLY'.
+OUTER_LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(?:\d+\s*,\s*)?(\d+|ALL)\b", re.IGNORECASE)
+OUTER_FETCH_PATTERN = re.compile(r"\bFETCH\s+(?:FIRST|NEXT)\s+(\d+)?\s*ROWS?\s+(?:ONLY|WITH\s+TIES)\b", re.IGNORECASE)
+# Cláusulas que precisam vir depois do LIMIT acrescentado.
+AFTER_LIMIT_PATTERN = re.compile(
+    r"\b(?:OFFSET|FOR\s+(?:UPDATE|SHARE|NO\s+KEY\s+UPDATE|KEY\s+SHARE)|LOCK\s+IN\s+SHARE\s+MODE)\b", re.IGNORECASE
+)
+# INTO no nível externo (SELECT ... INTO): a posição do LIMIT depende do dialeto, então a consulta não é reescrita.
+OUTER_INTO_PATTERN = re.compile(r"\bINTO\b", re.IGNORECASE)
+
+
+def db_type_from_uri(db_uri):
+    """
+    Tipo do banco ('postgres', 'mysql', 'sqlite'...) a partir da URI do SQLAlchemy.
+    """
+    backend = db_uri.split(":", 1)[0].split("+", 1)[0].lower()
+    return "postgres" if backend.startswith("postgres") else backend
+
+
+def _first_keyword(sql_query):
+    stripped = re.sub(r"^(\s|\(|--[^\n]*\n|/\*.*?\*/)+", "", sql_query or "", flags=re.DOTALL)
+    match = re.match(r"[A-Za-z]+", stripped)
+    return match.group(0).upper() if match else ""
+
+
+def _outer_level(sql_query):
+    """
+    Cópia de sql_query, com o mesmo comprimento, em que comentários, literais, identificadores entre aspas
+    e o conteúdo entre parênteses viram espaços: restam só as cláusulas do nível externo, nas mesmas posições.
+    """
+    masked = list(sql_query)
+    length = len(sql_query)
+    depth = 0
+    i = 0
+    while i < length:
+        ch = sql_query[i]
+        if sql_query.startswith("--", i) or sql_query.startswith("/*", i):
+            closing = "\n" if ch == "-" else "*/"
+            end = sql_query.find(closing, i + 2)
+            end = length if end < 0 else end + len(closing)
+        elif ch in "'\"`":
+            end = i + 1
+            while end < length:
+                if sql_query[end] == ch:
+                    if sql_query.startswith(ch * 2, end):
+                        end += 2  # Aspas duplicadas dentro do literal.
+                        continue
+                    break
+                end += 1
+            end = min(end + 1, length)
+        else:
+            if ch == "(":
+                depth += 1
+            if depth > 0:
+                masked[i] = " "
+            if ch == ")":
+                depth = max(depth - 1, 0)
+            i += 1
+            continue
+        masked[i:end] = " " * (end - i)
+        i = end
+    return "".join(masked)
+
+
+def rewrite_with_limit(sql_query, limit):
+    """
+    Reescreve a consulta para retornar no máximo limit linhas, mexendo só no nível externo:
+    reduz o LIMIT (ou FETCH FIRST) existente quando é maior, ou acrescenta LIMIT n antes de
+    OFFSET/FOR UPDATE (ou no fim). A consulta não é envolvida em SELECT * FROM (...), que falha
+    com nomes de colunas repetidos. Retorna None quando não há como limitá-la com segurança.
+    """
+    sql = sql_query.strip().rstrip(";").rstrip()
+    outer = _outer_level(sql)
+    for pattern in (OUTER_LIMIT_PATTERN, OUTER_FETCH_PATTERN):
+        match = pattern.search(outer)
+        if match:
+            current = match.group(1)
+            if current is None or (current.isdigit() and int(current) <= limit):
+                return sql  # FETCH FIRST ROW ONLY ou limite já menor.
+            return sql[:match.start(1)] + str(limit) + sql[match.end(1):]
+    if OUTER_INTO_PATTERN.search(outer):
+        return None
+    clause = AFTER_LIMIT_PATTERN.search(outer)
+    # Sem cláusula posterior, o LIMIT vai depois do último token (antes de comentários finais).
+    position = clause.start() if clause else len(outer.rstrip())
+    return f"{sql[:position].rstrip()} LIMIT {limit} {sql[position:].lstrip()}".rstrip()
+
+
+class CostEstimate:
+    """
+    Custo e linhas estimados pelo otimizador para a consulta, e o plano JSON original.
+    """
+
+    def __init__(self, total_cost, rows, plan):
+        self.total_cost = total_cost
+        self.rows = rows
+        self.plan = plan
+
+    def to_dict(self):
+        return {"total_cost": self.total_cost, "rows": self.rows}
+
+
+def _collect_values(node, key, found):
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                found.append(v)
+            _collect_values(v, key, found)
+    elif isinstance(node, list):
+        for item in node:
+            _collect_values(item, key, found)
+    return found
+
+
+def parse_postgres_plan(plan):
+    """
+    Lê custo total e linhas estimadas do nó raiz de EXPLAIN (FORMAT JSON) do PostgreSQL.
+    """
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    return CostEstimate(float(root["Total Cost"]), float(root["Plan Rows"]), plan)
+
+
+def parse_mysql_plan(plan):
+    """
+    Lê o custo da consulta e a maior estimativa de linhas produzidas de EXPLAIN FORMAT=JSON do MySQL.
+    Em junções aninhadas, rows_produced_per_join de cada tabela já acumula as anteriores.
+    """
+    if isinstance(plan, (str, bytes)):
+        plan = json.loads(plan)
+    cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost")
+    rows = _collect_values(plan, "rows_produced_per_join", []) or _collect_values(plan, "rows_examined_per_scan", [])
+    return CostEstimate(
+        float(cost) if cost is not None else None,
+        max(float(r) for r in rows) if rows else None,
+        plan,
+    )
+
+
+def explain_query(conn, db_type, sql_query):
+    """
+    Executa o EXPLAIN do dialeto (sem executar a consulta) e retorna um CostEstimate,
+    ou None quando o banco não fornece estimativa de custo (ex: SQLite).
+    A transação aberta pelo EXPLAIN é revertida.
+    """
+    if db_type == "postgres":
+        explain_sql, parse = f"EXPLAIN (FORMAT JSON) {sql_query}", parse_postgres_plan
+    elif db_type == "mysql":
+        explain_sql, parse = f"EXPLAIN FORMAT=JSON {sql_query}", parse_mysql_plan
+    else:
+        return None
+    cursor = conn.cursor()
+    try:
+        cursor.execute(explain_sql)
+        row = cursor.fetchone()
+        return parse(row[0])
+    finally:
+        cursor.close()
+        conn.rollback()
+
+
+class GuardDecision:
+    """
+    Resultado da verificação de custo:
+    action é 'allow', 'rewrite' (sql reescrito com LIMIT), 'reject' ou 'skip' (sem estimativa).
+    """
+
+    def __init__(self, action, sql, estimate=None, rewritten_estimate=None, reason=None):
+        self.action = action
+        self.sql = sql
+        self.estimate = estimate
+        self.rewritten_estimate = rewritten_estimate
+        self.reason = reason
+
+    def to_dict(self):
+        return {
+            "action": self.action,
+            "sql": self.sql,
+            "estimate": self.estimate.to_dict() if self.estimate else None,
+            "rewritten_estimate": self.rewritten_estimate.to_dict() if self.rewritten_estimate else None,
+            "reason": self.reason,
+        }
+
+
+def _exceeded(estimate, max_cost, max_rows):
+    reasons = []
+    if max_cost and estimate.total_cost is not None and estimate.total_cost > max_cost:
+        reasons.append(f"custo estimado {estimate.total_cost:,.0f} > {max_cost:,.0f}")
+    if max_rows and estimate.rows is not None and estimate.rows > max_rows:
+        reasons.append(f"linhas estimadas {estimate.rows:,.0f} > {max_rows:,.0f}")
+    return "; ".join(reasons)
+
+
+def guard_query(conn, db_type, sql_query, max_cost=DEFAULT_MAX_COST, max_rows=DEFAULT_MAX_ESTIMATED_ROWS,
+                action=DEFAULT_GUARD_ACTION, limit=DEFAULT_GUARD_LIMIT):
+    """
+    Estima o custo da consulta e decide se ela pode ser executada como está, se deve ser
+    reescrita com LIMIT (apenas leituras; a reescrita é estimada de novo) ou rejeitada.
+    Falhas no EXPLAIN não bloqueiam a execução: o erro real aparece ao executar.
+    """
+    sql_query = sql_query.strip().rstrip(";").rstrip()
+    keyword = _first_keyword(sql_query)
+    if keyword not in EXPLAINABLE_KEYWORDS:
+        return GuardDecision("skip", sql_query, reason="Comando sem estimativa de custo.")
+    try:
+        estimate = explain_query(conn, db_type, sql_query)
+    except Exception as e:
+        return GuardDecision("skip", sql_query, reason=f"EXPLAIN falhou: {e}")
+    if estimate is None:
+        return GuardDecision("skip", sql_query, reason=f"Estimativa de custo indisponível para {db_type}.")
+
+    reason = _exceeded(estimate, max_cost, max_rows)
+    if not reason:
+        return GuardDecision("allow", sql_query, estimate)
+    if action != "limit" or keyword not in LIMITABLE_KEYWORDS or not is_read_query(sql_query):
+        return GuardDecision("reject", sql_query, estimate, reason=reason)
+
+    rewritten = rewrite_with_limit(sql_query, limit)
+    if rewritten is None:
+        return GuardDecision("reject", sql_query, estimate, reason=f"{reason}; não foi possível aplicar LIMIT {limit}")
+    try:
+        rewritten_estimate = explain_query(conn, db_type, rewritten)
+    except Exception as e:
+        return GuardDecision("reject", sql_query, estimate, reason=f"{reason}; reescrita com LIMIT falhou: {e}")
+    still_exceeded = _exceeded(rewritten_estimate, max_cost, max_rows) if rewritten_estimate else ""
+    if still_exceeded:
+        return GuardDecision("reject", sql_query, estimate, rewritten_estimate,
+                             reason=f"{reason}; mesmo com LIMIT {limit}: {still_exceeded}")
+    return GuardDecision("rewrite", rewritten, estimate, rewritten_estimate, reason=reason)
+
+
+def set_statement_timeout(conn, db_type, seconds):
+    """
+    Aplica um timeout de execução no servidor à próxima consulta da conexão.
+    PostgreSQL: SET LOCAL statement_timeout (vale até o fim da transação, sem afetar o pool).
+    MySQL: MAX_EXECUTION_TIME da sessão (vale para SELECTs), definido sempre (0 desativa um valor anterior)
+    e restaurado quando a conexão volta ao pool (ver connection_pool.reset_session_timeout).
+    Outros bancos são ignorados.
+    """
+    if db_type not in ("postgres", "mysql") or (db_type == "postgres" and not seconds):
+        return
+    milliseconds = int((seconds or 0) * 1000)
+    cursor = conn.cursor()
+    try:
+        if db_type == "postgres":
+            cursor.execute(f"SET LOCAL statement_timeout = {milliseconds}")
+        else:
+            cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {milliseconds}")
+    finally:
+        cursor.close()
+
+
+class QueryCancelled(Exception):
+    """
+    A consulta foi interrompida por um pedido de cancelamento.
+    """
+
+
+class ActiveQueryRegistry:
+    """
+    Consultas em execução no processo, indexadas por um identificador, com o necessário para cancelá-las:
+    cancel() da conexão no PostgreSQL, KILL QUERY (em outra conexão do pool) no MySQL
+    e interrupt() no SQLite.
+    """
+
+    def __init__(self):
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def register(self, conn, db_type, db_uri, sql_query):
+        query_id = uuid.uuid4().hex
+        with self._lock:
+            self._queries[query_id] = {
+                "conn": conn, "db_type": db_type, "db_uri": db_uri, "sql": sql_query,
+                "started": time.time(), "cancelled": False,
+            }
+        return query_id
+
+    def unregister(self, query_id):
+        with self._lock:
+            self._queries.pop(query_id, None)
+
+    def was_cancelled(self, query_id):
+        with self._lock:
+            entry = self._queries.get(query_id)
+            return bool(entry and entry["cancelled"])
+
+    def cancel(self, query_id):
+        """
+        Pede ao servidor que interrompa a consulta. Retorna False se ela já terminou.
+        """
+        with self._lock:
+            entry = self._queries.get(query_id)
+            if entry is None or entry["cancelled"]:
+                return False
+            entry["cancelled"] = True
+        conn, db_type = entry["conn"], entry["db_type"]
+        if db_type == "postgres":
+            conn.cancel()
+        elif db_type == "mysql":
+            thread_id = int(conn.connection_id)
+            with pooled_connection(entry["db_uri"]) as killer:
+                cursor = killer.cursor()
+                try:
+                    cursor.execute(f"KILL QUERY {thread_id}")
+                finally:
+                    cursor.close()
+        elif hasattr(conn, "interrupt"):
+            conn.interrupt()
+        return True
+
+    def active(self):
+        """
+        Lista (identificador, SQL, segundos em execução) das consultas em andamento.
+        """
+        now = time.time()
+        with self._lock:
+            return [(qid, e["sql"], now - e["started"]) for qid, e in self._queries.items()]
+
+
+def run_cancellable(registry, query_id, run, on_wait=None, poll_interval=0.2):
+    """
+    Executa run() em uma thread separada, permitindo que a consulta registrada em query_id
+    seja cancelada enquanto isso. on_wait(segundos) é chamado periodicamente durante a espera.
+    Se a espera for interrompida (ex: reexecução do script do Streamlit), a consulta é cancelada
+    antes de a exceção seguir. Levanta QueryCancelled quando run() falha por cancelamento.
+    """
+    outcome = {}
+
+    def target():
+        try:
+            outcome["value"] = run()
+        except BaseException as e:
+            outcome["error"] = e
+
+    worker = threading.Thread(target=target, name=f"query-{query_id[:8]}", daemon=True)
+    started = time.perf_counter()
+    worker.start()
+    try:
+        while True:
+            worker.join(poll_interval)
+            if not worker.is_alive():
+                break
+            if on_wait is not None:
+                on_wait(time.perf_counter() - started)
+    except BaseException:
+        registry.cancel(query_id)
+        worker.join()
+        raise
+    if "error" in outcome:
+        if registry.was_cancelled(query_id):
+            raise QueryCancelled("Consulta cancelada.") from outcome["error"]
+        raise outcome["error"]
+    return outcome.get("value")
+
+
+# Registro único por processo (o Streamlit reexecuta o script principal, mas mantém módulos importados).
+_registry = ActiveQueryRegistry()
+
+
+def get_active_queries():
+    """
+    Retorna o registro de consultas em execução do processo.
+    """
+    return _registry
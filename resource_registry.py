@@ -0,0 +1,234 @@
+# Registro de recursos compartilhados entre sessões (cadeia Text-to-SQL, SQLDatabase, índice do schema e pool).
+# Substitui o st.cache_resource global: cada recurso é indexado pela DSN sem senha (mais um hash das
+# credenciais, para que usuários diferentes do banco não compartilhem conexões) e pelo hash da API key.
+# Cada sessão mantém uma referência ao recurso; desconectar libera apenas a referência da sessão.
+# Recursos sem referências são descartados após um tempo ocioso ou quando a memória estimada excede o limite.
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from schema_cache import redact_dsn
+
+# Tempo (em segundos) que um recurso sem referências permanece disponível para reaproveitamento.
+DEFAULT_RESOURCE_IDLE_TTL = float(os.getenv("TEXT_TO_SQL_RESOURCE_IDLE_TTL", "900"))
+# Memória estimada máxima dos recursos mantidos (os que ainda têm referências nunca são descartados).
+DEFAULT_RESOURCE_MAX_BYTES = int(os.getenv("TEXT_TO_SQL_RESOURCE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Referências não renovadas por esse tempo (ex: aba do navegador fechada sem desconectar) expiram.
+DEFAULT_RESOURCE_LEASE = float(os.getenv("TEXT_TO_SQL_RESOURCE_LEASE", "3600"))
+# Intervalo (em segundos) da varredura periódica que descarta recursos ociosos mesmo sem novas sessões (0 desativa).
+DEFAULT_RESOURCE_SWEEP_INTERVAL = float(os.getenv("TEXT_TO_SQL_RESOURCE_SWEEP_INTERVAL", "60"))
+
+
+def _short_hash(value):
+    return hashlib.sha256((value or "").encode("utf-8")).hexdigest()[:16]
+
+
+def resource_key(db_uri, api_key):
+    """
+    Chave de um recurso: DSN sem senha, hash da DSN completa (credenciais) e hash da API key.
+    Nenhum segredo aparece em claro na chave.
+    """
+    return (redact_dsn(db_uri), _short_hash(db_uri), _short_hash(api_key))
+
+
+class _Entry:
+    def __init__(self, value, size, group, on_group_evicted):
+        self.value = value
+        self.size = size
+        self.group = group
+        self.on_group_evicted = on_group_evicted
+        self.owners = {}  # Sessão -> instante da última renovação da referência.
+        self.last_used = time.monotonic()
+
+
+class ResourceRegistry:
+    """
+    Recursos compartilhados com contagem de referências por sessão (dona).
+    acquire cria o recurso na primeira chamada (uma única vez, mesmo com sessões concorrentes)
+    e registra a sessão como dona; release remove a referência. Recursos sem donas são descartados
+    após idle_ttl segundos ou, em ordem LRU, quando a memória estimada excede max_bytes.
+    Quando o último recurso de um grupo (ex: a DSN) é descartado, on_group_evicted é chamado
+    (ex: para fechar o pool de conexões).
+    """
+
+    def __init__(self, idle_ttl=DEFAULT_RESOURCE_IDLE_TTL, max_bytes=DEFAULT_RESOURCE_MAX_BYTES,
+                 lease=DEFAULT_RESOURCE_LEASE):
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.lease = lease
+        self._entries = OrderedDict()  # Chave -> _Entry, do menos para o mais recentemente usado.
+        self._lock = threading.Lock()
+        self._build_locks = {}  # Chave -> Lock, evita construir o mesmo recurso duas vezes.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sweeper = None
+
+    def acquire(self, key, owner, factory, size_of=None, group=None, on_group_evicted=None):
+        """
+        Retorna o recurso da chave, criando-o com factory() se necessário, e registra owner como dona.
+        size_of(valor) estima a memória do recurso, usada no limite de memória.
+        """
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.hits += 1
+                    self._reference(key, entry, owner)
+                    return entry.value
+            value = factory()
+            size = int(size_of(value)) if size_of is not None else 0
+            with self._lock:
+                self.misses += 1
+                entry = _Entry(value, size, group, on_group_evicted)
+                self._entries[key] = entry
+                self._reference(key, entry, owner)
+        self.evict()
+        return value
+
+    def _reference(self, key, entry, owner):
+        entry.owners[owner] = time.monotonic()
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(key)
+
+    def release(self, owner, key=None):
+        """
+        Remove as referências da sessão (em todas as chaves, se key for None) e descarta
+        os recursos que excederem os limites.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for entry_key, entry in self._entries.items():
+                if (key is None or entry_key == key) and entry.owners.pop(owner, None) is not None:
+                    entry.last_used = now
+        self.evict()
+
+    def touch(self, owner):
+        """
+        Renova as referências da sessão (chamado a cada execução do script) e descarta os recursos
+        que excederam os limites.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for entry in self._entries.values():
+                if owner in entry.owners:
+                    entry.owners[owner] = now
+        self.evict()
+
+    def start_sweeper(self, interval=DEFAULT_RESOURCE_SWEEP_INTERVAL):
+        """
+        Inicia (uma única vez) uma thread daemon que chama evict() a cada interval segundos,
+        para que recursos ociosos sejam descartados mesmo em um processo sem atividade.
+        """
+        if not interval or interval <= 0:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Event()
+            stopped = self._sweeper
+
+        def sweep():
+            while not stopped.wait(interval):
+                self.evict()
+
+        threading.Thread(target=sweep, name="resource-registry-sweeper", daemon=True).start()
+
+    def stop_sweeper(self):
+        """
+        Interrompe a varredura periódica iniciada por start_sweeper.
+        """
+        with self._lock:
+            stopped, self._sweeper = self._sweeper, None
+        if stopped is not None:
+            stopped.set()
+
+    def evict(self):
+        """
+        Expira referências não renovadas e descarta recursos sem donas ociosos há mais de idle_ttl
+        e, se a memória estimada exceder max_bytes, os menos usados recentemente. Retorna as chaves descartadas.
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for entry in self._entries.values():
+                for owner, renewed in list(entry.owners.items()):
+                    if self.lease and now - renewed > self.lease:
+                        del entry.owners[owner]
+                        entry.last_used = max(entry.last_used, renewed + self.lease)
+            for key, entry in list(self._entries.items()):
+                if not entry.owners and now - entry.last_used > self.idle_ttl:
+                    evicted.append((key, self._entries.pop(key)))
+            total = sum(entry.size for entry in self._entries.values())
+            for key, entry in list(self._entries.items()):
+                if total <= self.max_bytes:
+                    break
+                if not entry.owners:
+                    total -= entry.size
+                    evicted.append((key, self._entries.pop(key)))
+            for key, _ in evicted:
+                self._build_locks.pop(key, None)
+            self.evictions += len(evicted)
+            remaining_groups = {entry.group for entry in self._entries.values()}
+        # Os callbacks (ex: fechar um pool) rodam fora do lock.
+        released_groups = set()
+        for _, entry in evicted:
+            if entry.group is not None and entry.group not in remaining_groups and entry.group not in released_groups:
+                released_groups.add(entry.group)
+                if entry.on_group_evicted is not None:
+                    entry.on_group_evicted()
+        return [key for key, _ in evicted]
+
+    def clear(self):
+        """
+        Descarta todos os recursos, inclusive os que ainda têm referências.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                entry.owners.clear()
+                entry.last_used = float("-inf")
+        self.evict()
+
+    def stats(self):
+        """
+        Resumo dos recursos mantidos: DSN sem senha, referências, memória estimada e tempo ocioso.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": sum(entry.size for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "resources": [
+                    {
+                        "dsn": key[0] if isinstance(key, tuple) else str(key),
+                        "refs": len(entry.owners),
+                        "bytes": entry.size,
+                        "idle_seconds": 0.0 if entry.owners else now - entry.last_used,
+                    }
+                    for key, entry in self._entries.items()
+                ],
+            }
+
+
+# Instância única por processo (o Streamlit reexecuta o script principal, mas mantém módulos importados).
+_registry_instance = None
+_registry_lock = threading.Lock()
+
+
+def get_resource_registry():
+    """
+    Retorna o registro de recursos compartilhado pelo processo, criando-o na primeira chamada.
+    """
+    global _registry_instance
+    with _registry_lock:
+        if _registry_instance is None:
+            _registry_instance = ResourceRegistry()
+            _registry_instance.start_sweeper()
+        return _registry_instance
@@ -0,0 +1,405 @@
+# Cache de resultados de consultas de leitura, compartilhado entre sessões do Streamlit.
+# As entradas são indexadas pelo SQL normalizado e pela DSN, ficam em uma LRU limitada por
+# memória (bytes estimados) com TTL por entrada, e são invalidadas quando um comando que
+# modifica uma das tabelas lidas é confirmado (commit) pela aplicação.
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from result_fetch import estimate_row_bytes
+
+# Orçamento de memória (bytes estimados) de todas as entradas.
+DEFAULT_RESULT_CACHE_BYTES = int(os.getenv("TEXT_TO_SQL_RESULT_CACHE_BYTES", str(256 * 1024 * 1024)))
+# Tamanho máximo de um único resultado mantido no cache; resultados maiores não são armazenados.
+DEFAULT_RESULT_CACHE_ENTRY_BYTES = int(os.getenv("TEXT_TO_SQL_RESULT_CACHE_ENTRY_BYTES", str(16 * 1024 * 1024)))
+# Tempo de vida (em segundos) de cada entrada. Também limita a defasagem diante de escritas
+# feitas fora da aplicação, que não passam pela invalidação.
+DEFAULT_RESULT_CACHE_TTL = float(os.getenv("TEXT_TO_SQL_RESULT_CACHE_TTL", "300"))
+
+# Comandos de sessão/transação que não alteram dados.
+NON_MODIFYING_KEYWORDS = {"SET", "USE", "BEGIN", "START", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE"}
+
+# Literais de string, identificadores entre aspas e comentários, na ordem em que são reconhecidos.
+LEXICAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|--[^\n]*|/\*.*?\*/|\s+", re.DOTALL)
+# Nome de tabela, possivelmente qualificado (esquema.tabela) e entre aspas; o grupo captura o último nome.
+TABLE_NAME = r"(?:(?:\"[^\"]+\"|`[^`]+`|\[[^\]]+\]|[\w$]+)\s*\.\s*)*(\"[^\"]+\"|`[^`]+`|\[[^\]]+\]|[\w$]+)"
+# Palavras-chave que introduzem uma tabela lida ou escrita.
+TABLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN|INTO|UPDATE|TABLE|USING)\s+(?:ONLY\s+|IF\s+(?:NOT\s+)?EXISTS\s+)?" + TABLE_NAME, re.IGNORECASE
+)
+# Tabelas adicionais de uma lista separada por vírgulas no FROM (FROM a x, b y).
+FROM_LIST_PATTERN = re.compile(
+    r"\bFROM\s+(.*?)(?=\b(?:WHERE|GROUP|ORDER|LIMIT|HAVING|UNION|INTERSECT|EXCEPT|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|"
+    r"NATURAL|WINDOW|FETCH|OFFSET|FOR|RETURNING|ON)\b|[();]|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+# Alvo de comandos de escrita.
+WRITE_TARGET_PATTERN = re.compile(
+    r"^\s*(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|MERGE\s+INTO|UPDATE(?:\s+ONLY)?|DELETE\s+FROM|DELETE|"
+    r"TRUNCATE(?:\s+TABLE)?|(?:CREATE|DROP|ALTER)\s+(?:(?:TEMPORARY|TEMP|UNLOGGED|OR\s+REPLACE)\s+)*"
+    r"(?:TABLE|VIEW|MATERIALIZED\s+VIEW|INDEX\s+.*?\s+ON)(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+" + TABLE_NAME,
+    re.IGNORECASE | re.DOTALL,
+)
+
+# EXPLAIN que executa o comando (EXPLAIN ANALYZE ... / EXPLAIN (ANALYZE[, ...]) ...).
+EXPLAIN_ANALYZE_PATTERN = re.compile(
+    r"^\s*EXPLAIN\s+(?:ANALY[SZ]E\b(?:\s+VERBOSE\b)?|\((?=[^)]*\bANALY[SZ]E\b(?!\s+(?:FALSE|OFF|0)\b))[^)]*\))\s*",
+    re.IGNORECASE,
+)
+# SELECT ... INTO tabela (PostgreSQL/SQL Server), que cria uma tabela com o resultado. INTO @var / :var
+# (variáveis no MySQL e em SQL embutido) não escreve dados; INTO OUTFILE/DUMPFILE escreve um arquivo no servidor.
+SELECT_INTO_PATTERN = re.compile(
+    r"\bINTO\s+(?![@:])(?:(?:TEMPORARY|TEMP|UNLOGGED)\s+)?(?:TABLE\s+)?" + TABLE_NAME, re.IGNORECASE
+)
+# Funções e valores que mudam a cada execução (data/hora, aleatórios, sequências): resultados não são armazenados.
+VOLATILE_PATTERN = re.compile(
+    r"\b(?:now|random|rand|uuid|uuid_short|gen_random_uuid|newid|sysdate|curdate|curtime|utc_date|utc_time|"
+    r"utc_timestamp|unix_timestamp|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday|"
+    r"nextval|currval|lastval|last_insert_id|randomblob|connection_id)\s*\(|"
+    r"\b(?:current_date|current_time|current_timestamp|localtime|localtimestamp)\b",
+    re.IGNORECASE,
+)
+# Literal 'now' (date('now') no SQLite, 'now'::timestamp no PostgreSQL).
+NOW_LITERAL_PATTERN = re.compile(r"'now'", re.IGNORECASE)
+# Comando de escrita dentro de uma CTE (WITH x AS (DELETE ... RETURNING ...)).
+CTE_WRITE_PATTERN = re.compile(r"\(\s*(?=(?:INSERT|UPDATE|DELETE|MERGE)\b)", re.IGNORECASE)
+
+
+def _strip_lexical(sql_query, keep_literals):
+    """
+    Remove comentários e colapsa espaços. Literais de string são mantidos (keep_literals=True)
+    ou trocados por '' para que seu conteúdo não seja confundido com nomes de tabelas.
+    """
+    def replace(match):
+        token = match.group(0)
+        if token.startswith("--") or token.startswith("/*") or token.isspace():
+            return " "
+        if token.startswith("'") and not keep_literals:
+            return "''"
+        return token
+
+    return LEXICAL_PATTERN.sub(replace, sql_query or "").strip()
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Normaliza o SQL para uso na chave do cache: remove comentários, colapsa espaços fora
+    de literais e o ponto e vírgula final. Maiúsculas/minúsculas são preservadas.
+    """
+    return _strip_lexical(sql_query, keep_literals=True).rstrip(";").strip()
+
+
+def _table_key(name):
+    return name.strip("\"`[]").lower()
+
+
+def referenced_tables(sql_query: str) -> set:
+    """
+    Conjunto (em minúsculas, sem esquema) das tabelas referenciadas pela consulta.
+    """
+    sql = _strip_lexical(sql_query, keep_literals=False)
+    tables = {_table_key(m.group(1)) for m in TABLE_REFERENCE_PATTERN.finditer(sql)}
+    for clause in FROM_LIST_PATTERN.finditer(sql):
+        for item in clause.group(1).split(",")[1:]:
+            match = re.match(r"\s*" + TABLE_NAME, item)
+            if match:
+                tables.add(_table_key(match.group(1)))
+    return tables
+
+
+def _top_level(sql):
+    """
+    Remove o conteúdo entre parênteses (subconsultas, listas de valores), mantendo só o nível externo.
+    """
+    previous = None
+    while previous != sql:
+        previous, sql = sql, re.sub(r"\([^()]*\)", " ", sql)
+    return sql
+
+
+def _enclosed(sql, start):
+    """
+    Trecho de sql a partir de start até o parêntese que fecha o nível atual (ou até o fim).
+    """
+    depth = 0
+    for i in range(start, len(sql)):
+        if sql[i] == "(":
+            depth += 1
+        elif sql[i] == ")":
+            if depth == 0:
+                return sql[start:i]
+            depth -= 1
+    return sql[start:]
+
+
+def _write_statements(sql):
+    """
+    Comandos de escrita contidos em um comando já sem comentários e literais: o comando principal,
+    os das CTEs de escrita e o comando executado por EXPLAIN ANALYZE.
+    """
+    explain = EXPLAIN_ANALYZE_PATTERN.match(sql)
+    if explain:
+        return _write_statements(sql[explain.end():])
+    statements = []
+    if WRITE_TARGET_PATTERN.match(sql):
+        statements.append(sql)
+    keyword = re.match(r"[A-Za-z]+", sql.lstrip())
+    # Comandos iniciados por WITH: escritas nas CTEs e no comando após a última CTE.
+    if keyword and keyword.group(0).upper() == "WITH":
+        for cte in CTE_WRITE_PATTERN.finditer(sql):
+            statements.append(_enclosed(sql, cte.end()))
+        match = re.search(r"\)\s*((?:INSERT|UPDATE|DELETE|MERGE)\b.*)$", sql, re.IGNORECASE | re.DOTALL)
+        if match:
+            statements.append(match.group(1))
+    # SELECT ... INTO no nível externo (fora de subconsultas e CTEs).
+    top = _top_level(sql)
+    if (keyword and keyword.group(0).upper() in ("SELECT", "WITH") and SELECT_INTO_PATTERN.search(top)
+            and not re.search(r"\b(?:INSERT|REPLACE|MERGE)\b", top, re.IGNORECASE)):
+        statements.append(sql)
+    return statements
+
+
+def _statement_target(statement):
+    """
+    Tabela escrita por um comando de escrita, ou None quando ele pode escrever em mais de uma tabela:
+    UPDATE/DELETE com JOIN, lista de alvos separada por vírgulas (UPDATE t1, t2 / DELETE t1, t2 FROM ...)
+    ou FROM/USING com mais de uma tabela.
+    """
+    target = WRITE_TARGET_PATTERN.match(statement)
+    top = _top_level(statement)
+    if target is None:
+        select_into = SELECT_INTO_PATTERN.search(top)
+        if select_into is None or select_into.group(1).upper() in ("OUTFILE", "DUMPFILE"):
+            return None
+        return _table_key(select_into.group(1))
+    keyword = re.match(r"\s*([A-Za-z]+)", top).group(1).upper()
+    if keyword == "UPDATE":
+        head = re.split(r"\bSET\b", top, maxsplit=1, flags=re.IGNORECASE)[0]
+        if re.search(r"\bJOIN\b", head, re.IGNORECASE) or "," in head:
+            return None
+    elif keyword == "DELETE":
+        head = re.split(r"\b(?:WHERE|RETURNING|ORDER|LIMIT)\b", top, maxsplit=1, flags=re.IGNORECASE)[0]
+        if re.search(r"\bJOIN\b", head, re.IGNORECASE) or "," in head:
+            return None
+        # Sintaxe multi-tabela do MySQL (DELETE t1 FROM t1 ...): o alvo aparece antes do FROM.
+        if re.match(r"\s*DELETE\s+(?!FROM\b)\S+.*\bFROM\b", head, re.IGNORECASE | re.DOTALL):
+            return None
+    return _table_key(target.group(1))
+
+
+def writes_data(sql_query: str) -> bool:
+    """
+    Indica se o comando escreve dados, inclusive em CTEs (WITH x AS (DELETE ...) SELECT) e EXPLAIN ANALYZE.
+    """
+    return bool(_write_statements(_strip_lexical(sql_query, keep_literals=False)))
+
+
+def is_volatile(sql_query: str) -> bool:
+    """
+    Indica se a consulta usa funções cujo valor muda a cada execução (now(), random(), current_date...).
+    """
+    return bool(VOLATILE_PATTERN.search(_strip_lexical(sql_query, keep_literals=False))
+                or NOW_LITERAL_PATTERN.search(_strip_lexical(sql_query, keep_literals=True)))
+
+
+def modified_tables(sql_query: str):
+    """
+    Tabelas alteradas por um comando de escrita (inclusive em CTEs e EXPLAIN ANALYZE).
+    Retorna um conjunto vazio para comandos de sessão/transação e None quando o alvo não pode
+    ser determinado (ex: CALL, UPDATE/DELETE com várias tabelas), caso em que todas as entradas
+    da DSN devem ser invalidadas.
+    """
+    sql = _strip_lexical(sql_query, keep_literals=False)
+    keyword = re.match(r"[A-Za-z]+", sql)
+    if keyword and keyword.group(0).upper() in NON_MODIFYING_KEYWORDS:
+        return set()
+    targets = {_statement_target(statement) for statement in _write_statements(sql)}
+    if not targets or None in targets:
+        return None
+    return targets
+
+
+def make_result_key(db_uri: str, sql_query: str) -> str:
+    """
+    Chave do cache: SHA-256 da DSN e do SQL normalizado.
+    """
+    raw = f"{db_uri}\x1f{normalize_sql(sql_query)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CachedResult:
+    """
+    Resultado completo de uma consulta de leitura, com as tabelas lidas e o tamanho estimado.
+    """
+
+    def __init__(self, columns, rows, tables, nbytes):
+        self.columns = list(columns)
+        self.rows = rows
+        self.tables = tables
+        self.nbytes = nbytes
+        self.created_at = time.time()
+
+
+class CachedRowsCursor:
+    """
+    Cursor somente leitura sobre as linhas de um CachedResult, compatível com o uso que
+    ResultStream faz de um cursor DB-API (description, fetchmany e close).
+    """
+
+    def __init__(self, result):
+        self.description = [(name, None, None, None, None, None, None) for name in result.columns]
+        self._rows = result.rows
+        self._position = 0
+
+    def fetchmany(self, size):
+        batch = self._rows[self._position:self._position + size]
+        self._position += len(batch)
+        return batch
+
+    def close(self):
+        self._rows = []
+
+
+class ResultCache:
+    """
+    LRU de resultados limitada por bytes estimados, com TTL por entrada.
+    Mantém, por DSN, um índice tabela -> chaves para invalidar as entradas que leem
+    uma tabela quando um comando de escrita nela é confirmado.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_RESULT_CACHE_BYTES, max_entry_bytes=DEFAULT_RESULT_CACHE_ENTRY_BYTES,
+                 ttl=DEFAULT_RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.ttl = ttl
+        self._entries = OrderedDict()  # chave -> (DSN, CachedResult)
+        self._by_table = {}  # (DSN, tabela) -> conjunto de chaves
+        self._bytes = 0
+        self._epochs = {}  # DSN -> número de invalidações (detecta escritas durante uma leitura)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, key):
+        db_uri, result = self._entries.pop(key)
+        self._bytes -= result.nbytes
+        for table in result.tables:
+            keys = self._by_table.get((db_uri, table))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[(db_uri, table)]
+
+    def get(self, db_uri, sql_query):
+        """
+        Retorna o CachedResult da consulta, ou None se ausente ou expirado.
+        """
+        key = make_result_key(db_uri, sql_query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1].created_at > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def epoch(self, db_uri):
+        """
+        Contador de invalidações da DSN, a ser lido antes de executar a consulta e repassado a put().
+        """
+        with self._lock:
+            return self._epochs.get(db_uri, 0)
+
+    def put(self, db_uri, sql_query, columns, rows, epoch=None):
+        """
+        Armazena o resultado completo de uma consulta de leitura, removendo as entradas
+        menos usadas até caber no orçamento. Resultados maiores que max_entry_bytes são ignorados,
+        assim como os de consultas voláteis (is_volatile) e os lidos enquanto uma escrita na DSN
+        era confirmada (epoch desatualizado).
+        """
+        if is_volatile(sql_query):
+            return False
+        nbytes = sum(estimate_row_bytes(row) for row in rows)
+        if nbytes > self.max_entry_bytes:
+            return False
+        key = make_result_key(db_uri, sql_query)
+        result = CachedResult(columns, list(rows), referenced_tables(sql_query), nbytes)
+        with self._lock:
+            if epoch is not None and epoch != self._epochs.get(db_uri, 0):
+                return False
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self._bytes + nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (db_uri, result)
+            self._bytes += nbytes
+            for table in result.tables:
+                self._by_table.setdefault((db_uri, table), set()).add(key)
+        return True
+
+    def invalidate_tables(self, db_uri, tables):
+        """
+        Remove as entradas da DSN que leem alguma das tabelas. tables=None remove todas as entradas da DSN.
+        Retorna o número de entradas removidas.
+        """
+        with self._lock:
+            if tables is None:
+                keys = {key for key, (uri, _) in self._entries.items() if uri == db_uri}
+            else:
+                keys = set()
+                for table in tables:
+                    keys |= self._by_table.get((db_uri, _table_key(table)), set())
+            for key in keys:
+                self._remove(key)
+            self._epochs[db_uri] = self._epochs.get(db_uri, 0) + 1
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Retorna contadores de acertos, faltas, remoções e ocupação do cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Instância única por processo (o Streamlit reexecuta o script principal, mas mantém módulos importados).
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Retorna o cache de resultados compartilhado pelo processo, criando-o na primeira chamada.
+    """
+    global _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = ResultCache()
+        return _cache_instance
@@ -0,0 +1,289 @@
+# Busca de resultados em streaming, com memória limitada.
+# Consultas de leitura usam cursores do lado do servidor (psycopg2) ou não bufferizados
+# (mysql.connector) e são lidas em lotes com fetchmany, uma página por vez.
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
+
+# Linhas exibidas por página.
+DEFAULT_PAGE_SIZE = int(os.getenv("TEXT_TO_SQL_PAGE_SIZE", "500"))
+# Linhas lidas do cursor a cada chamada de fetchmany.
+DEFAULT_FETCH_BATCH = int(os.getenv("TEXT_TO_SQL_FETCH_BATCH", "200"))
+# Orçamento total de linhas lidas de um mesmo resultado (somando todas as páginas).
+DEFAULT_MAX_ROWS = int(os.getenv("TEXT_TO_SQL_MAX_ROWS", "100000"))
+# Orçamento aproximado de bytes de uma página mantida em memória.
+DEFAULT_MAX_BYTES = int(os.getenv("TEXT_TO_SQL_MAX_BYTES", str(32 * 1024 * 1024)))
+# Tempo (em segundos) sem leitura após o qual um resultado paginado é fechado e sua conexão volta ao pool (0 desativa).
+DEFAULT_RESULT_IDLE_TIMEOUT = float(os.getenv("TEXT_TO_SQL_RESULT_IDLE_TIMEOUT", "300"))
+
+# Palavras-chave iniciais de comandos que apenas leem dados.
+READ_KEYWORDS = ("SELECT", "WITH", "SHOW", "EXPLAIN", "DESCRIBE", "DESC", "VALUES", "TABLE")
+# Comandos aceitos por cursores do lado do servidor (DECLARE ... CURSOR FOR no PostgreSQL);
+# SHOW, EXPLAIN e DESCRIBE usam um cursor comum.
+STREAMING_KEYWORDS = ("SELECT", "WITH", "VALUES", "TABLE")
+
+
+def first_keyword(sql_query: str) -> str:
+    """
+    Primeira palavra-chave da consulta, em maiúsculas (ignorando comentários e parênteses iniciais).
+    """
+    stripped = re.sub(r"^(\s|\(|--[^\n]*\n|/\*.*?\*/)+", "", sql_query or "", flags=re.DOTALL)
+    match = re.match(r"[A-Za-z]+", stripped)
+    return match.group(0).upper() if match else ""
+
+
+def is_read_query(sql_query: str) -> bool:
+    """
+    Indica se a consulta é somente leitura: a primeira palavra-chave é de leitura e nenhum alvo
+    de escrita é encontrado (ex: WITH x AS (DELETE ... RETURNING ...) SELECT, EXPLAIN ANALYZE DELETE).
+    """
+    if first_keyword(sql_query) not in READ_KEYWORDS:
+        return False
+    # Importado aqui: result_cache depende deste módulo.
+    from result_cache import writes_data
+    return not writes_data(sql_query)
+
+
+def estimate_row_bytes(row) -> int:
+    """
+    Estima o tamanho em memória de uma linha: comprimento de textos/binários e 8 bytes por valor escalar.
+    """
+    return sum(len(v) if isinstance(v, (str, bytes, bytearray)) else 8 for v in row)
+
+
+def open_streaming_cursor(conn, db_type, sql_query=None):
+    """
+    Abre um cursor adequado para leitura em streaming:
+    cursor nomeado (do lado do servidor) no PostgreSQL e cursor não bufferizado no MySQL.
+    Para outros drivers, ou comandos que não são SELECT/VALUES/TABLE (ex: SHOW, EXPLAIN), retorna um cursor comum.
+    """
+    if sql_query is not None and first_keyword(sql_query) not in STREAMING_KEYWORDS:
+        return conn.cursor()
+    if db_type == "postgres":
+        cursor = conn.cursor(name=f"text_to_sql_{uuid.uuid4().hex}")
+        cursor.itersize = DEFAULT_FETCH_BATCH
+        return cursor
+    if db_type == "mysql":
+        return conn.cursor(buffered=False)
+    return conn.cursor()
+
+
+class ResultStream:
+    """
+    Resultado de uma consulta de leitura consumido página a página.
+    Apenas a página atual fica em memória; páginas seguintes são buscadas sob demanda.
+    O cursor é fechado ao esgotar o resultado ou ao atingir o orçamento de linhas.
+    Com owns_connection=True, a conexão (emprestada de um pool) é devolvida junto com o cursor.
+    Com capture_bytes > 0, as linhas lidas são acumuladas enquanto couberem nesse orçamento e,
+    se o resultado for lido por completo, entregues a on_complete(columns, rows) (ex: para cache).
+    from_cache indica que o cursor percorre um resultado já armazenado em memória.
+    Resultados que mantêm uma conexão do pool e ficam sem leitura por idle_timeout segundos
+    (ex: aba abandonada) são fechados pela varredura de get_result_stream_reaper(); expired fica True.
+    """
+
+    def __init__(self, conn, cursor, sql_query, page_size=DEFAULT_PAGE_SIZE,
+                 max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES, fetch_batch=DEFAULT_FETCH_BATCH,
+                 owns_connection=False, capture_bytes=0, on_complete=None, from_cache=False,
+                 idle_timeout=DEFAULT_RESULT_IDLE_TIMEOUT):
+        self.conn = conn
+        self.owns_connection = owns_connection
+        self.from_cache = from_cache
+        self.cursor = cursor
+        self.sql_query = sql_query
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.fetch_batch = fetch_batch
+        self.columns = []
+        self.page_rows = []
+        self.page_number = 0
+        self.page_start = 0  # Índice (base 0) da primeira linha da página atual.
+        self.rows_fetched = 0
+        self.page_bytes = 0  # Bytes estimados da página atual.
+        self.exhausted = False
+        self.truncated = False  # True quando o orçamento de linhas interrompeu a leitura.
+        self.on_complete = on_complete
+        self.capture_bytes = capture_bytes
+        self._captured = [] if capture_bytes > 0 and on_complete is not None else None
+        self._captured_bytes = 0
+        self.idle_timeout = idle_timeout
+        self.last_used = time.monotonic()
+        self.expired = False
+        self._lock = threading.Lock()  # Leitura de página x fechamento pela varredura de ociosidade.
+        if owns_connection and idle_timeout and idle_timeout > 0:
+            get_result_stream_reaper().track(self)
+
+    @property
+    def closed(self):
+        return self.cursor is None
+
+    def execute(self, sql_query):
+        """
+        Executa a consulta no cursor do resultado (sem que a varredura de ociosidade o feche no meio).
+        """
+        with self._lock:
+            try:
+                self.cursor.execute(sql_query)
+            finally:
+                self.last_used = time.monotonic()
+
+    def fetch_page(self, on_first_batch=None):
+        """
+        Descarta a página atual e lê a próxima em lotes de fetchmany.
+        A página termina ao atingir page_size linhas, o orçamento de bytes da página
+        ou o orçamento total de linhas. on_first_batch(columns, rows) é chamado assim
+        que o primeiro lote chega, permitindo renderização progressiva.
+        """
+        with self._lock:
+            try:
+                return self._fetch_page(on_first_batch)
+            finally:
+                self.last_used = time.monotonic()
+
+    def _fetch_page(self, on_first_batch):
+        if self.closed:
+            return self.page_rows
+        self.page_start = self.rows_fetched
+        self.page_rows = []
+        self.page_bytes = 0
+        while len(self.page_rows) < self.page_size:
+            remaining_budget = self.max_rows - self.rows_fetched
+            if remaining_budget <= 0:
+                self.truncated = True
+                break
+            batch = self.cursor.fetchmany(min(self.fetch_batch, self.page_size - len(self.page_rows), remaining_budget))
+            if not self.columns and self.cursor.description:
+                # Cursores nomeados do psycopg2 só preenchem description após o primeiro fetch.
+                self.columns = [desc[0] for desc in self.cursor.description]
+            if not batch:
+                self.exhausted = True
+                break
+            self.page_rows.extend(batch)
+            self.rows_fetched += len(batch)
+            batch_bytes = sum(estimate_row_bytes(row) for row in batch)
+            self.page_bytes += batch_bytes
+            if self._captured is not None:
+                self._captured_bytes += batch_bytes
+                if self._captured_bytes > self.capture_bytes:
+                    self._captured = None  # Resultado grande demais: deixa de acumular.
+                else:
+                    self._captured.extend(batch)
+            if on_first_batch is not None and len(self.page_rows) == len(batch):
+                on_first_batch(self.columns, self.page_rows)
+            if self.page_bytes >= self.max_bytes:
+                break
+        self.page_number += 1
+        if self.exhausted and self._captured is not None:
+            self.on_complete(self.columns, self._captured)
+            self._captured = None
+        if self.exhausted or self.truncated:
+            self.close()
+        return self.page_rows
+
+    @property
+    def has_more(self):
+        return not self.closed
+
+    def close(self):
+        """
+        Fecha o cursor, descartando no servidor as linhas ainda não lidas,
+        e devolve a conexão ao pool quando ela pertence ao resultado.
+        """
+        # Retira o cursor antes de fechá-lo: fechamentos concorrentes (varredura de ociosidade) não se repetem.
+        cursor, self.cursor = self.cursor, None
+        if cursor is None:
+            return
+        try:
+            # Cursores não bufferizados do MySQL exigem consumir o restante antes de fechar.
+            consume_results = getattr(self.conn, "consume_results", None)
+            if consume_results is not None and not self.exhausted:
+                consume_results()
+            cursor.close()
+        except Exception:
+            pass
+        finally:
+            if self.owns_connection:
+                try:
+                    self.conn.close()
+                except Exception:
+                    pass
+
+    def close_if_idle(self, now=None):
+        """
+        Fecha o resultado se estiver aberto e sem leitura há mais de idle_timeout segundos.
+        Uma leitura em andamento nunca é interrompida. Retorna True se o resultado foi fechado.
+        """
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            now = time.monotonic() if now is None else now
+            if self.closed or now - self.last_used <= self.idle_timeout:
+                return False
+            self.expired = True
+            self.close()
+            return True
+        finally:
+            self._lock.release()
+
+
+class ResultStreamReaper:
+    """
+    Resultados paginados abertos no processo (referências fracas) e uma varredura periódica que fecha
+    os ociosos, devolvendo as conexões ao pool mesmo que a sessão nunca volte a usá-los.
+    """
+
+    def __init__(self):
+        self._streams = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.expired = 0
+
+    def track(self, stream):
+        with self._lock:
+            self._streams.add(stream)
+            if self._sweeper is None:
+                # Intervalo derivado do timeout do primeiro resultado registrado (em geral, o padrão).
+                interval = max(min(stream.idle_timeout / 4, 30.0), 0.01)
+                self._sweeper = threading.Thread(target=self._run, args=(interval,),
+                                                 name="result-stream-reaper", daemon=True)
+                self._sweeper.start()
+
+    def sweep(self, now=None):
+        """
+        Fecha os resultados ociosos e retorna quantos foram fechados.
+        """
+        with self._lock:
+            streams = [stream for stream in self._streams if not stream.closed]
+            self._streams = weakref.WeakSet(streams)
+        closed = sum(1 for stream in streams if stream.close_if_idle(now))
+        with self._lock:
+            self.expired += closed
+        return closed
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.sweep()
+
+    def open_streams(self):
+        with self._lock:
+            return sum(1 for stream in self._streams if not stream.closed)
+
+
+# Instância única por processo.
+_reaper_instance = None
+_reaper_lock = threading.Lock()
+
+
+def get_result_stream_reaper():
+    """
+    Retorna a varredura de resultados ociosos do processo, criando-a na primeira chamada.
+    """
+    global _reaper_instance
+    with _reaper_lock:
+        if _reaper_instance is None:
+            _reaper_instance = ResultStreamReaper()
+        return _reaper_instance
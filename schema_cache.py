@@ -0,0 +1,207 @@
+# Cache persistente da introspecção do schema.
+# Guarda em disco os metadados refletidos pelo SQLAlchemy e o table_info renderizado de cada tabela,
+# indexados pela DSN sem senha. Na conexão, uma consulta barata ao information_schema decide
+# entre reaproveitar o snapshot e refletir novamente apenas as tabelas que mudaram.
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+from collections import defaultdict
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import URL, make_url
+
+# Diretório onde os snapshots são gravados.
+DEFAULT_CACHE_DIR = os.getenv("TEXT_TO_SQL_SCHEMA_CACHE_DIR", ".schema_cache")
+# Idade máxima de um snapshot (em segundos). Depois disso as linhas de amostra são renovadas.
+DEFAULT_MAX_AGE = float(os.getenv("TEXT_TO_SQL_SCHEMA_CACHE_TTL", str(24 * 3600)))
+# Versão do formato do snapshot; alterá-la invalida snapshots antigos.
+SNAPSHOT_VERSION = 1
+
+# Consultas de impressão digital por dialeto. Cada uma retorna (tabela, atributos...) e é
+# agregada por tabela em Python, evitando limites de funções como GROUP_CONCAT.
+FINGERPRINT_QUERIES = {
+    "postgresql": [
+        "SELECT table_name, column_name, data_type, is_nullable, column_default, ordinal_position "
+        "FROM information_schema.columns WHERE table_schema = current_schema()",
+        "SELECT table_name, constraint_name, constraint_type "
+        "FROM information_schema.table_constraints WHERE table_schema = current_schema()",
+    ],
+    "mysql": [
+        "SELECT table_name, column_name, column_type, is_nullable, column_default, ordinal_position "
+        "FROM information_schema.columns WHERE table_schema = DATABASE()",
+        "SELECT table_name, constraint_name, constraint_type "
+        "FROM information_schema.table_constraints WHERE table_schema = DATABASE()",
+        # CREATE_TIME muda quando um ALTER TABLE reconstrói a tabela (último DDL).
+        "SELECT table_name, create_time FROM information_schema.tables WHERE table_schema = DATABASE()",
+    ],
+    "sqlite": [
+        "SELECT name, sql FROM sqlite_master WHERE type IN ('table', 'index') AND name NOT LIKE 'sqlite_%'",
+    ],
+}
+
+
+def redact_dsn(db_uri) -> str:
+    """
+    Retorna a DSN sem a senha, adequada para uso como chave de cache e em logs.
+    """
+    url = make_url(db_uri)
+    # URL.set(password=None) mantém a senha original, por isso a URL é recriada sem ela.
+    redacted = URL.create(
+        url.drivername, username=url.username, host=url.host,
+        port=url.port, database=url.database, query=url.query,
+    )
+    return redacted.render_as_string(hide_password=False)
+
+
+def fetch_schema_fingerprints(engine):
+    """
+    Calcula uma impressão digital por tabela a partir do information_schema (ou sqlite_master).
+    Retorna um dicionário {tabela: hash} ou None se o dialeto não for suportado.
+    """
+    queries = FINGERPRINT_QUERIES.get(engine.dialect.name)
+    if not queries:
+        return None
+    rows_by_table = defaultdict(list)
+    with engine.connect() as conn:
+        for query in queries:
+            for row in conn.execute(text(query)):
+                if row[0] is None:
+                    continue
+                rows_by_table[str(row[0])].append("|".join("" if v is None else str(v) for v in row[1:]))
+    return {
+        table: hashlib.sha256("\n".join(sorted(rows)).encode("utf-8")).hexdigest()
+        for table, rows in rows_by_table.items()
+    }
+
+
+class SchemaSnapshotStore:
+    """
+    Armazena snapshots do schema em arquivos pickle, um por DSN (sem senha).
+    A gravação é atômica (arquivo temporário + rename) para tolerar sessões concorrentes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _path(self, dsn_key):
+        digest = hashlib.sha256(dsn_key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.pkl")
+
+    def load(self, dsn_key):
+        """
+        Retorna o snapshot da DSN, ou None se ele não existir, estiver corrompido ou for de outra versão.
+        """
+        try:
+            with open(self._path(dsn_key), "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            # Arquivo ausente, truncado ou corrompido (o unpickling pode falhar com vários tipos de erro).
+            return None
+        if not isinstance(snapshot, dict):
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("dsn") != dsn_key:
+            return None
+        return snapshot
+
+    def save(self, dsn_key, snapshot):
+        """
+        Grava o snapshot; falhas (disco, metadados que não podem ser serializados) apenas deixam de gravá-lo.
+        """
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(dsn_key))
+        except Exception:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def load_sql_database(db_uri, sample_rows_in_table_info=5, engine=None, store=None, max_age=DEFAULT_MAX_AGE):
+    """
+    Cria o SQLDatabase da LangChain reaproveitando o snapshot em disco sempre que possível.
+    Retorna (db, table_info_by_table, info), onde info descreve a origem do schema
+    ('snapshot', 'incremental' ou 'full'), as tabelas re-refletidas e o tempo gasto.
+    O SQLDatabase retornado usa o table_info do snapshot (custom_table_info), de modo que
+    a cadeia não consulta linhas de amostra a cada pergunta.
+    """
+    # Importada apenas aqui: redact_dsn e o snapshot são usados sem carregar a LangChain.
+    from langchain_community.utilities import SQLDatabase
+
+    started = time.perf_counter()
+    engine = engine if engine is not None else create_engine(db_uri)
+    store = store or SchemaSnapshotStore()
+    dsn_key = redact_dsn(db_uri)
+
+    try:
+        fingerprints = fetch_schema_fingerprints(engine)
+    except Exception:
+        fingerprints = None
+    snapshot = store.load(dsn_key) if fingerprints is not None else None
+    if snapshot and time.time() - snapshot["created_at"] > max_age:
+        snapshot = None
+
+    if snapshot is None:
+        # Sem snapshot válido: reflexão completa, como em SQLDatabase.from_uri.
+        db = SQLDatabase(engine, sample_rows_in_table_info=sample_rows_in_table_info)
+        usable_tables = db.get_usable_table_names()
+        table_info_by_table = {table: db.get_table_info([table]) for table in usable_tables}
+        refreshed = list(usable_tables)
+        source = "full"
+        created_at = time.time()
+    else:
+        metadata = snapshot["metadata"]
+        old_fingerprints = snapshot["fingerprints"]
+        changed = {t for t, fp in fingerprints.items() if old_fingerprints.get(t) != fp}
+        removed = set(old_fingerprints) - set(fingerprints)
+        # Tabelas com FK para tabelas alteradas também são re-refletidas, para não
+        # manterem referências a objetos Table antigos.
+        stale = set(changed | removed)
+        for table in metadata.sorted_tables:
+            if any(fk.target_fullname.split(".")[-2] in stale for fk in table.foreign_keys):
+                stale.add(table.name)
+        for table in list(metadata.sorted_tables):
+            if table.name in stale:
+                metadata.remove(table)
+
+        db = SQLDatabase(
+            engine,
+            metadata=metadata,
+            sample_rows_in_table_info=sample_rows_in_table_info,
+            lazy_table_reflection=True,
+        )
+        usable_tables = db.get_usable_table_names()
+        table_info_by_table = {
+            t: info for t, info in snapshot["table_info_by_table"].items()
+            if t in usable_tables and t not in stale
+        }
+        refreshed = [t for t in usable_tables if t not in table_info_by_table]
+        for table in refreshed:
+            # get_table_info reflete sob demanda apenas as tabelas ausentes dos metadados.
+            table_info_by_table[table] = db.get_table_info([table])
+        source = "incremental" if refreshed or removed else "snapshot"
+        created_at = snapshot["created_at"] if source == "snapshot" else time.time()
+
+    # Faz o SQLDatabase servir o table_info já renderizado, sem consultar amostras novamente.
+    db._custom_table_info = dict(table_info_by_table)
+
+    if fingerprints is not None and source != "snapshot":
+        store.save(dsn_key, {
+            "version": SNAPSHOT_VERSION,
+            "dsn": dsn_key,
+            "created_at": created_at,
+            "fingerprints": fingerprints,
+            "metadata": db._metadata,
+            "table_info_by_table": table_info_by_table,
+        })
+
+    info = {
+        "source": source,
+        "refreshed_tables": refreshed,
+        "elapsed": time.perf_counter() - started,
+    }
+    return db, table_info_by_table, info
@@ -0,0 +1,152 @@
+# Índice léxico do schema, usado para enviar ao LLM apenas as tabelas relevantes para a pergunta.
+# A pontuação é BM25 vetorizada sobre matrizes NumPy, construída uma única vez na inicialização.
+# O NumPy é importado apenas ao construir ou consultar o índice (após a conexão).
+import os
+import re
+import unicodedata
+
+# Número padrão de tabelas mais relevantes enviadas ao LLM (0 desativa a poda).
+DEFAULT_TOP_N = int(os.getenv("TEXT_TO_SQL_SCHEMA_TOP_N", "8"))
+
+# Parâmetros clássicos do BM25.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list:
+    """
+    Quebra um texto (pergunta, nome de tabela/coluna ou comentário) em termos normalizados.
+    Separa snake_case e camelCase, remove acentos, converte para minúsculas e
+    aplica um radical simples de plural (ex: 'clientes' -> 'client', 'cliente' -> 'client').
+    """
+    if not text:
+        return []
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text):
+        if len(token) > 4 and token.endswith("es"):
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith("s"):
+            token = token[:-1]
+        if len(token) > 3 and token.endswith("e"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class SchemaIndex:
+    """
+    Índice BM25 sobre as tabelas do banco. Cada tabela é um documento formado por
+    seu nome, nomes e comentários das colunas, comentário da tabela e tabelas ligadas
+    por chave estrangeira. Também guarda o table_info renderizado de cada tabela,
+    permitindo medir o tamanho do prompt para qualquer subconjunto de tabelas.
+    """
+
+    def __init__(self, documents: dict, neighbours: dict, table_info_by_table: dict):
+        import numpy as np
+
+        self.tables = sorted(documents)
+        self.neighbours = {table: set(neighbours.get(table, ())) for table in self.tables}
+        self.table_info_by_table = dict(table_info_by_table)
+
+        tokenized = [tokenize(documents[table]) for table in self.tables]
+        vocabulary = sorted({token for tokens in tokenized for token in tokens})
+        self.vocabulary = {token: i for i, token in enumerate(vocabulary)}
+
+        # Matriz termo-documento (tabelas x vocabulário) com as frequências dos termos.
+        tf = np.zeros((len(self.tables), len(vocabulary)), dtype=np.float32)
+        for row, tokens in enumerate(tokenized):
+            for token in tokens:
+                tf[row, self.vocabulary[token]] += 1.0
+
+        # Pré-calcula os pesos BM25: a pontuação de uma pergunta vira uma soma de colunas.
+        n_docs = max(len(self.tables), 1)
+        doc_len = tf.sum(axis=1, keepdims=True)
+        avg_len = float(doc_len.mean()) if doc_len.size else 1.0
+        df = (tf > 0).sum(axis=0)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len / max(avg_len, 1e-9))
+        self.weights = idf * (tf * (BM25_K1 + 1.0)) / (tf + norm)
+
+    @classmethod
+    def from_sql_database(cls, db, table_info_by_table: dict):
+        """
+        Constrói o índice a partir do SQLDatabase da LangChain, usando os metadados já
+        refletidos pelo SQLAlchemy (colunas, comentários e chaves estrangeiras).
+        """
+        usable = set(db.get_usable_table_names())
+        documents = {table: table for table in usable}
+        neighbours = {table: set() for table in usable}
+        for table in db._metadata.sorted_tables:
+            if table.name not in usable:
+                continue
+            parts = [table.name, table.comment or ""]
+            for column in table.columns:
+                parts.append(column.name)
+                if column.comment:
+                    parts.append(column.comment)
+            for fk in table.foreign_keys:
+                referred = fk.column.table.name
+                parts.append(referred)
+                if referred in usable and referred != table.name:
+                    neighbours[table.name].add(referred)
+                    neighbours[referred].add(table.name)
+            documents[table.name] = " ".join(parts)
+        return cls(documents, neighbours, table_info_by_table)
+
+    def score(self, question: str) -> "np.ndarray":
+        """
+        Retorna a pontuação BM25 de cada tabela (na ordem de self.tables) para a pergunta.
+        """
+        import numpy as np
+        term_ids = [self.vocabulary[t] for t in tokenize(question) if t in self.vocabulary]
+        if not term_ids:
+            return np.zeros(len(self.tables), dtype=np.float32)
+        return self.weights[:, term_ids].sum(axis=1)
+
+    def select_tables(self, question: str, top_n: int = DEFAULT_TOP_N, include_neighbours: bool = True):
+        """
+        Seleciona as top_n tabelas mais relevantes e, opcionalmente, suas vizinhas por FK.
+        Retorna None quando a poda não se aplica (top_n desativado, banco pequeno ou
+        nenhuma tabela com pontuação positiva), indicando que o schema completo deve ser usado.
+        """
+        if not top_n or top_n <= 0 or len(self.tables) <= top_n:
+            return None
+        import numpy as np
+        scores = self.score(question)
+        if not np.any(scores > 0):
+            return None
+        candidates = np.argsort(-scores, kind="stable")[:top_n]
+        selected = {self.tables[i] for i in candidates if scores[i] > 0}
+        if include_neighbours:
+            for table in list(selected):
+                selected |= self.neighbours.get(table, set())
+        return sorted(selected)
+
+    def render_table_info(self, table_names=None) -> str:
+        """
+        Monta o table_info para o subconjunto de tabelas (ou todas, se None), no mesmo
+        formato produzido por SQLDatabase.get_table_info.
+        """
+        names = self.tables if table_names is None else table_names
+        chunks = sorted(self.table_info_by_table[t] for t in names if t in self.table_info_by_table)
+        return "\n\n".join(chunks)
+
+    def estimated_bytes(self) -> int:
+        """
+        Estimativa aproximada da memória ocupada pelos pesos BM25 e pelos blocos de table_info.
+        """
+        return int(self.weights.nbytes) + sum(len(info) for info in self.table_info_by_table.values())
+
+    def prompt_reduction(self, table_names) -> dict:
+        """
+        Compara o tamanho (em caracteres) do table_info das tabelas escolhidas com o do schema completo.
+        """
+        full_chars = len(self.render_table_info())
+        selected_chars = len(self.render_table_info(table_names)) if table_names is not None else full_chars
+        return {
+            "full_chars": full_chars,
+            "selected_chars": selected_chars,
+            "reduction": (1.0 - selected_chars / full_chars) if full_chars else 0.0,
+        }
@@ -0,0 +1,427 @@
+# Serviço HTTP assíncrono (aiohttp) do pipeline Text-to-SQL, independente do Streamlit.
+# O motor (cadeia, SQLDatabase, índice do schema) é montado uma vez na inicialização e compartilhado
+# entre as requisições. Chamadas bloqueantes (LLM e drivers do banco) rodam em um pool de threads,
+# nunca no loop de eventos, e um semáforo limita as requisições processadas ao mesmo tempo.
+#
+# Endpoints:
+#   POST /generate  {"question": ...}                      -> SQL gerado
+#   POST /execute   {"sql": ...} ou {"question": ...}      -> resultado em JSON ou NDJSON (lotes de linhas)
+#   GET  /schema    [?tables=a,b]                          -> tabelas e table_info
+#   GET  /health                                           -> estado do serviço e do banco
+#   GET  /metrics                                          -> métricas no formato do Prometheus
+#
+# Exemplo (offline, com LLM substituto e SQLite):
+#   python service.py --db-uri "sqlite:///banco.db" --llm fake:respostas.json --port 8080
+import argparse
+import asyncio
+import datetime
+import decimal
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+from batch import load_llm
+from connection_pool import checkout_connection, pool_stats, pooled_connection
+from generation_cache import get_generation_cache
+from metrics import RequestTrace, get_metrics_registry
+from query_guard import DEFAULT_STATEMENT_TIMEOUT, db_type_from_uri, guard_query, set_statement_timeout
+from result_fetch import DEFAULT_FETCH_BATCH, is_read_query, open_streaming_cursor
+from schema_cache import redact_dsn
+from schema_index import DEFAULT_TOP_N
+from text_to_sql_engine import build_text_to_sql_engine, generate_sql
+
+# Requisições de geração/execução processadas ao mesmo tempo (as demais aguardam na fila).
+DEFAULT_SERVICE_CONCURRENCY = int(os.getenv("TEXT_TO_SQL_SERVICE_CONCURRENCY", "8"))
+# Threads do pool que executam as chamadas bloqueantes (LLM e drivers).
+DEFAULT_SERVICE_WORKERS = int(os.getenv("TEXT_TO_SQL_SERVICE_WORKERS", "16"))
+# Tempo máximo (em segundos) de espera na fila antes de responder 503.
+DEFAULT_SERVICE_QUEUE_TIMEOUT = float(os.getenv("TEXT_TO_SQL_SERVICE_QUEUE_TIMEOUT", "30"))
+# Limite de linhas de uma execução (o cliente pode pedir menos com max_rows).
+DEFAULT_SERVICE_MAX_ROWS = int(os.getenv("TEXT_TO_SQL_SERVICE_MAX_ROWS", "10000"))
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+# Chaves do estado da aplicação.
+CONFIG = web.AppKey("config", dict)
+ENGINE = web.AppKey("engine", dict)
+EXECUTOR = web.AppKey("executor", ThreadPoolExecutor)
+LIMITER = web.AppKey("limiter", object)
+
+
+class ConcurrencyLimiter:
+    """
+    Limita as requisições processadas ao mesmo tempo. Quem não obtém uma vaga em queue_timeout
+    segundos recebe 503, em vez de acumular trabalho no pool de threads.
+    """
+
+    def __init__(self, limit, queue_timeout):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise _error(503, "Serviço ocupado: limite de requisições simultâneas atingido.")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+
+def _error(status, message, **extra):
+    """
+    Exceção HTTP com corpo JSON ({"error": ...}).
+    """
+    body = json.dumps({"error": message, **extra}, ensure_ascii=False)
+    return _ERRORS[status](text=body, content_type="application/json")
+
+
+_ERRORS = {
+    400: web.HTTPBadRequest,
+    403: web.HTTPForbidden,
+    404: web.HTTPNotFound,
+    422: web.HTTPUnprocessableEntity,
+    500: web.HTTPInternalServerError,
+    503: web.HTTPServiceUnavailable,
+}
+
+
+def _json_value(value):
+    """
+    Converte valores do driver que o json não serializa (decimais, datas, binários).
+    """
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def _dumps(data):
+    return json.dumps(data, default=_json_value, ensure_ascii=False)
+
+
+async def run_blocking(app, func, *args, **kwargs):
+    """
+    Executa uma chamada bloqueante no pool de threads do serviço, sem travar o loop de eventos.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(app[EXECUTOR], functools.partial(func, *args, **kwargs))
+
+
+async def _read_json(request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise _error(400, "Corpo da requisição não é um JSON válido.")
+    if not isinstance(body, dict):
+        raise _error(400, "O corpo da requisição deve ser um objeto JSON.")
+    return body
+
+
+def _positive_int(body, name, default, maximum=None):
+    value = body.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise _error(400, f"'{name}' deve ser um inteiro não negativo.")
+    return min(value, maximum) if maximum else value
+
+
+# Funções executadas no pool de threads
+
+def _generate(engine, config, question, top_n):
+    trace = RequestTrace("generation")
+    started = time.perf_counter()
+    try:
+        generated = generate_sql(
+            engine["chain"], question, engine["db"].dialect, schema_index=engine["schema_index"],
+            schema_top_n=top_n, schema_fp=engine["schema_fp"], generation_cache=config["generation_cache"],
+            trace=trace,
+        )
+    finally:
+        get_metrics_registry().observe(trace)
+    generated["generation_ms"] = (time.perf_counter() - started) * 1000
+    generated["stages"] = trace.stages
+    return generated
+
+
+class _OpenQuery:
+    """
+    Consulta de leitura em execução: conexão emprestada do pool e cursor de streaming.
+    Os métodos são bloqueantes e rodam no pool de threads, um de cada vez.
+    """
+
+    def __init__(self, db_uri, db_type, sql_query):
+        self.conn = checkout_connection(db_uri)
+        self.cursor = None
+        self.columns = []
+        try:
+            self.decision = guard_query(self.conn, db_type, sql_query)
+            if self.decision.action != "reject":
+                set_statement_timeout(self.conn, db_type, DEFAULT_STATEMENT_TIMEOUT)
+                self.cursor = open_streaming_cursor(self.conn, db_type, self.decision.sql)
+                self.cursor.execute(self.decision.sql)
+        except BaseException:
+            self.close()
+            raise
+
+    def fetch(self, size):
+        rows = self.cursor.fetchmany(size)
+        if not self.columns and self.cursor.description:
+            # Cursores nomeados do psycopg2 só preenchem description após o primeiro fetch.
+            self.columns = [desc[0] for desc in self.cursor.description]
+        return [list(row) for row in rows]
+
+    def close(self):
+        try:
+            if self.cursor is not None:
+                # Cursores não bufferizados do MySQL exigem consumir as linhas não lidas antes de fechar
+                # (resultado truncado por max_rows ou cliente desconectado).
+                consume_results = getattr(self.conn, "consume_results", None)
+                if consume_results is not None:
+                    consume_results()
+                self.cursor.close()
+        except Exception:
+            pass
+        finally:
+            self.conn.close() # Devolve a conexão ao pool (com rollback).
+
+
+def _ping(db_uri):
+    with pooled_connection(db_uri) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+# Handlers
+
+async def generate(request):
+    app = request.app
+    body = await _read_json(request)
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise _error(400, "Informe a pergunta no campo 'question'.")
+    top_n = _positive_int(body, "top_n", DEFAULT_TOP_N)
+    async with app[LIMITER].slot():
+        try:
+            generated = await run_blocking(app, _generate, app[ENGINE], app[CONFIG], question, top_n)
+        except Exception as e:
+            raise _error(500, f"Erro ao gerar o SQL: {e}", stage="generation")
+    return web.Response(text=_dumps(generated), content_type="application/json")
+
+
+async def execute(request):
+    """
+    Executa uma consulta de leitura ('sql' ou o SQL gerado para 'question').
+    Com "format": "ndjson" (ou Accept: application/x-ndjson), o resultado é transmitido em lotes:
+    uma linha com as colunas, uma por lote de linhas e uma final com o total.
+    """
+    app = request.app
+    config = app[CONFIG]
+    body = await _read_json(request)
+    sql_query, question = body.get("sql"), body.get("question")
+    if not (isinstance(sql_query, str) and sql_query.strip()) and not (isinstance(question, str) and question.strip()):
+        raise _error(400, "Informe o SQL no campo 'sql' ou a pergunta no campo 'question'.")
+    max_rows = _positive_int(body, "max_rows", config["max_rows"], maximum=config["max_rows"]) or config["max_rows"]
+    batch_rows = _positive_int(body, "batch_rows", DEFAULT_FETCH_BATCH) or DEFAULT_FETCH_BATCH
+    fmt = body.get("format") or ("ndjson" if NDJSON_CONTENT_TYPE in request.headers.get("Accept", "") else "json")
+    if fmt not in ("json", "ndjson"):
+        raise _error(400, "Formato inválido: use 'json' ou 'ndjson'.")
+
+    async with app[LIMITER].slot():
+        generated = None
+        if not (isinstance(sql_query, str) and sql_query.strip()):
+            try:
+                generated = await run_blocking(app, _generate, app[ENGINE], config, question, DEFAULT_TOP_N)
+            except Exception as e:
+                raise _error(500, f"Erro ao gerar o SQL: {e}", stage="generation")
+            sql_query = generated["sql"]
+        if not is_read_query(sql_query):
+            raise _error(403, "Apenas consultas de leitura são executadas pelo serviço.", sql=sql_query)
+        try:
+            query = await run_blocking(app, _OpenQuery, config["db_uri"], config["db_type"], sql_query)
+        except Exception as e:
+            raise _error(422, f"Erro ao executar a consulta: {e}", stage="execution", sql=sql_query)
+        try:
+            decision = query.decision
+            if decision.action == "reject":
+                raise _error(422, f"Execução bloqueada pelos limites de custo: {decision.reason}",
+                             stage="guard", sql=sql_query)
+            header = {"sql": decision.sql, "guard": decision.action}
+            if generated is not None:
+                header["generated"] = {k: generated[k] for k in ("selected_tables", "from_cache", "generation_ms")}
+            if fmt == "ndjson":
+                return await _stream_ndjson(request, query, header, max_rows, batch_rows)
+            rows = []
+            try:
+                while len(rows) < max_rows:
+                    batch = await run_blocking(app, query.fetch, min(batch_rows, max_rows - len(rows)))
+                    if not batch:
+                        break
+                    rows.extend(batch)
+                truncated = len(rows) >= max_rows and bool(await run_blocking(app, query.fetch, 1))
+            except Exception as e:
+                raise _error(422, f"Erro ao ler o resultado: {e}", stage="execution", sql=decision.sql)
+            result = {**header, "columns": query.columns, "rows": rows, "row_count": len(rows), "truncated": truncated}
+            return web.Response(text=_dumps(result), content_type="application/json")
+        finally:
+            await run_blocking(app, query.close)
+
+
+async def _stream_ndjson(request, query, header, max_rows, batch_rows):
+    """
+    Transmite o resultado em NDJSON, um lote por vez: apenas um lote fica em memória e a conexão
+    do banco é mantida apenas enquanto o cliente consome o resultado.
+    """
+    app = request.app
+    response = web.StreamResponse(headers={"Content-Type": f"{NDJSON_CONTENT_TYPE}; charset=utf-8"})
+    await response.prepare(request)
+    written = 0
+    try:
+        batch = await run_blocking(app, query.fetch, min(batch_rows, max_rows))
+        await response.write((_dumps({**header, "columns": query.columns}) + "\n").encode("utf-8"))
+        while batch:
+            await response.write((_dumps({"rows": batch}) + "\n").encode("utf-8"))
+            written += len(batch)
+            if written >= max_rows:
+                break
+            batch = await run_blocking(app, query.fetch, min(batch_rows, max_rows - written))
+        truncated = written >= max_rows and bool(await run_blocking(app, query.fetch, 1))
+        await response.write((_dumps({"done": True, "row_count": written, "truncated": truncated}) + "\n").encode("utf-8"))
+    except ConnectionResetError:
+        # Cliente desconectado: a consulta é encerrada no finally de execute.
+        return response
+    except Exception as e:
+        # O status 200 já foi enviado; o erro vai na última linha.
+        await response.write((_dumps({"error": f"Erro ao ler o resultado: {e}", "row_count": written}) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def schema(request):
+    engine = request.app[ENGINE]
+    tables = [t for t in request.query.get("tables", "").split(",") if t.strip()]
+    unknown = sorted(set(tables) - set(engine["usable_tables"]))
+    if unknown:
+        raise _error(404, f"Tabelas não encontradas: {', '.join(unknown)}")
+    return web.Response(text=_dumps({
+        "dialect": engine["db"].dialect,
+        "tables": engine["usable_tables"],
+        "schema_fingerprint": engine["schema_fp"],
+        "table_info": engine["schema_index"].render_table_info(tables or None),
+    }), content_type="application/json")
+
+
+async def health(request):
+    """
+    Estado do serviço: conectividade com o banco (SELECT 1), ocupação do pool e da fila de requisições.
+    Não usa as vagas do limitador, para responder mesmo com o serviço ocupado.
+    """
+    app = request.app
+    config = app[CONFIG]
+    limiter = app[LIMITER]
+    try:
+        await asyncio.wait_for(run_blocking(app, _ping, config["db_uri"]), DEFAULT_SERVICE_QUEUE_TIMEOUT)
+        database, status = "ok", 200
+    except Exception as e:
+        database, status = f"erro: {e or type(e).__name__}", 503
+    return web.Response(text=_dumps({
+        "status": "ok" if status == 200 else "degraded",
+        "database": database,
+        "dsn": redact_dsn(config["db_uri"]),
+        "requests": {"active": limiter.active, "waiting": limiter.waiting, "rejected": limiter.rejected,
+                     "limit": limiter.limit},
+        "pool": pool_stats(config["db_uri"]),
+    }), status=status, content_type="application/json")
+
+
+async def metrics(request):
+    return web.Response(text=get_metrics_registry().to_prometheus(),
+                        content_type="text/plain", charset="utf-8")
+
+
+async def _build_engine(app):
+    config = app[CONFIG]
+    chain, db, usable_tables, schema_fp, schema_index, _ = await run_blocking(
+        app, build_text_to_sql_engine, config["db_uri"], config["llm"]
+    )
+    app[ENGINE] = {"chain": chain, "db": db, "usable_tables": usable_tables, "schema_fp": schema_fp,
+                   "schema_index": schema_index}
+
+
+async def _shutdown_executor(app):
+    app[EXECUTOR].shutdown(wait=False, cancel_futures=True)
+
+
+def create_app(db_uri, llm, concurrency=DEFAULT_SERVICE_CONCURRENCY, workers=DEFAULT_SERVICE_WORKERS,
+               queue_timeout=DEFAULT_SERVICE_QUEUE_TIMEOUT, max_rows=DEFAULT_SERVICE_MAX_ROWS,
+               generation_cache=None):
+    """
+    Cria a aplicação aiohttp para uma DSN e um LLM. O motor Text-to-SQL é montado na inicialização
+    (em uma thread do pool). generation_cache (ex: get_generation_cache()) é opcional.
+    """
+    app = web.Application()
+    app[CONFIG] = {"db_uri": db_uri, "db_type": db_type_from_uri(db_uri), "llm": llm, "max_rows": max_rows,
+                   "generation_cache": generation_cache}
+    app[EXECUTOR] = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="text_to_sql")
+    app[LIMITER] = ConcurrencyLimiter(max(1, concurrency), queue_timeout)
+    app.on_startup.append(_build_engine)
+    app.on_cleanup.append(_shutdown_executor)
+    app.router.add_post("/generate", generate)
+    app.router.add_post("/execute", execute)
+    app.router.add_get("/schema", schema)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP assíncrono do pipeline Text-to-SQL.")
+    parser.add_argument("--db-uri", required=True, help="URI SQLAlchemy do banco de dados.")
+    parser.add_argument("--llm", default="gemini", help="'gemini', 'fake:<arquivo>' ou 'modulo:fabrica'.")
+    parser.add_argument("--host", default="127.0.0.1", help="Endereço de escuta.")
+    parser.add_argument("--port", type=int, default=8080, help="Porta de escuta.")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_SERVICE_CONCURRENCY,
+                        help="Requisições de geração/execução processadas ao mesmo tempo.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_SERVICE_WORKERS,
+                        help="Threads para as chamadas bloqueantes (LLM e banco).")
+    parser.add_argument("--queue-timeout", type=float, default=DEFAULT_SERVICE_QUEUE_TIMEOUT,
+                        help="Espera máxima (s) por uma vaga antes de responder 503.")
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_SERVICE_MAX_ROWS, help="Linhas por execução.")
+    parser.add_argument("--no-cache", action="store_true", help="Não usa o cache de geração (sempre desativado com LLMs substitutos).")
+    args = parser.parse_args(argv)
+
+    # O cache de geração é compartilhado com a interface; respostas de LLMs substitutos não devem entrar nele.
+    use_cache = not args.no_cache and args.llm == "gemini"
+    app = create_app(
+        args.db_uri, load_llm(args.llm), concurrency=args.concurrency, workers=args.workers,
+        queue_timeout=args.queue_timeout, max_rows=args.max_rows,
+        generation_cache=get_generation_cache() if use_cache else None,
+    )
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
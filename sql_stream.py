@@ -0,0 +1,275 @@
+# Extração incremental do SQL a partir da saída do LLM em streaming.
+# Detecta quando um comando SQL completo já foi emitido (cerca ``` de fechamento, ';' fora de
+# strings e comentários, ou uma leitura balanceada seguida de uma linha em prosa), permitindo
+# interromper a geração e não pagar pelos tokens de explicação que o modelo acrescenta depois.
+import re
+
+# Palavras-chave que iniciam um comando SQL.
+SQL_START_KEYWORDS = {
+    "SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "CREATE", "ALTER", "DROP", "SHOW", "EXPLAIN",
+    "DESCRIBE", "DESC", "REPLACE", "MERGE", "TRUNCATE", "VALUES", "TABLE", "GRANT", "REVOKE",
+}
+# Palavras-chave que podem continuar um comando após uma linha em branco.
+SQL_CONTINUATION_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "ON", "USING",
+    "AND", "OR", "NOT", "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "FETCH", "UNION", "INTERSECT",
+    "EXCEPT", "WINDOW", "AS", "CASE", "WHEN", "THEN", "ELSE", "END", "SET", "VALUES", "RETURNING",
+    "INTO", "FOR", "ASC", "DESC", "BY", "IN", "IS", "LIKE", "BETWEEN", "EXISTS", "ALL", "ANY", "DISTINCT",
+}
+# Palavras-chave que não podem encerrar um comando: se o texto antes de uma linha em branco termina
+# com uma delas, o comando continua (ex: "SELECT a FROM\n\nt").
+TRAILING_CONTINUATION_KEYWORDS = (SQL_START_KEYWORDS | SQL_CONTINUATION_KEYWORDS) - {"END", "ASC", "DESC"}
+# Comandos que podem ser encerrados por uma linha em branco seguida de prosa; comandos de escrita
+# (DML/DDL) só terminam por ';', cerca ou fim da geração, para nunca serem executados cortados.
+BALANCED_STOP_KEYWORDS = {"SELECT", "WITH", "SHOW", "EXPLAIN", "DESCRIBE", "DESC", "VALUES", "TABLE", "("}
+WRITE_KEYWORD_PATTERN = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE|MERGE|REPLACE|CREATE|ALTER|DROP|TRUNCATE|GRANT|REVOKE|CALL)\b", re.IGNORECASE
+)
+# Linha de prosa: duas palavras (ou uma seguida de ':'), opcionalmente após marcação Markdown de lista,
+# ênfase ou citação. As palavras que forem palavras-chave SQL são verificadas à parte.
+PROSE_LINE_PATTERN = re.compile(r"(?:\*+|_+|>\s*|[-+]\s+|\d+[.)]\s+)?([^\W\d_]+)(?:\s+([^\W\d_]+)\b|\s*:)")
+# Operadores e separadores que exigem um operando depois.
+TRAILING_CONTINUATION_CHARS = set(",(+-*/%=<>!|&^~.")
+# Tokens de mais de um caractere que podem chegar divididos entre dois trechos.
+MULTI_CHAR_TOKENS = ("```", "--", "/*")
+BLANK_LINE_PATTERN = re.compile(r"\n[ \t]*\r?\n\s*")
+PARTIAL_BLANK_LINE_PATTERN = re.compile(r"\n[ \t\r]*\Z")
+WORD_PATTERN = re.compile(r"[A-Za-z_]+|\S")
+SQL_KEYWORDS = SQL_START_KEYWORDS | SQL_CONTINUATION_KEYWORDS
+LAST_TOKEN_PATTERN = re.compile(r"[A-Za-z_0-9]+\Z|\S\Z")
+
+
+class SQLStatementExtractor:
+    """
+    Recebe a saída do LLM trecho a trecho (feed) e indica quando o comando SQL está completo.
+    Ignora uma cerca Markdown de abertura (```sql) e texto introdutório antes dela.
+    'sql' contém o comando extraído (sem cercas) e 'reason' o critério que o encerrou:
+    'fence', 'semicolon', 'balanced' ou 'end' (fim da geração).
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.complete = False
+        self.reason = None
+        self._start = None  # Índice onde o comando começa (após a cerca de abertura).
+        self._end = None  # Índice onde o comando termina.
+        self._pos = 0  # Próximo caractere a examinar.
+        self._fenced = False
+        self._quote = None  # Caractere de aspas da string ou identificador aberto.
+        self._comment = None  # '--' ou '/*' quando dentro de um comentário.
+        self._depth = 0  # Profundidade de parênteses.
+        self._last_end = None  # Fim do último caractere significativo (fora de comentários).
+
+    @property
+    def sql(self):
+        """
+        Comando extraído até o momento (parcial enquanto a geração não termina).
+        """
+        if self._start is None:
+            return ""
+        end = self._end if self._end is not None else len(self.buffer)
+        return self.buffer[self._start:end].rstrip("`").strip()
+
+    def feed(self, chunk):
+        """
+        Acrescenta um trecho da saída do LLM. Retorna True quando o comando está completo.
+        """
+        if not self.complete and chunk:
+            self.buffer += chunk
+            self._scan()
+        return self.complete
+
+    def finish(self):
+        """
+        Encerra a extração ao fim da geração e retorna o comando extraído.
+        """
+        if not self.complete:
+            self.complete = True
+            self.reason = "end"
+            if self._start is None and self.buffer.strip():
+                self._start = len(self.buffer) - len(self.buffer.lstrip())
+        return self.sql
+
+    def _stop(self, end, reason):
+        self._end = end
+        self.complete = True
+        self.reason = reason
+
+    def _expects_continuation(self):
+        """
+        Indica se o texto examinado até agora termina com um token que exige continuação
+        (vírgula, parêntese aberto, operador ou palavra-chave), ignorando comentários.
+        """
+        if self._last_end is None:
+            return True
+        token = LAST_TOKEN_PATTERN.search(self.buffer, self._start, self._last_end)
+        if token is None:
+            return True
+        token = token.group()
+        return token.upper() in TRAILING_CONTINUATION_KEYWORDS or token in TRAILING_CONTINUATION_CHARS
+
+    def _may_stop_balanced(self, end):
+        """
+        Indica se o comando em buffer[_start:end] pode ser encerrado por uma linha em branco:
+        apenas leituras (sem palavras-chave de escrita) que não terminam pedindo continuação.
+        """
+        statement = self.buffer[self._start:end]
+        first = WORD_PATTERN.search(statement)
+        if first is None or first.group().upper() not in BALANCED_STOP_KEYWORDS:
+            return False
+        return not WRITE_KEYWORD_PATTERN.search(statement) and not self._expects_continuation()
+
+    def _next_content_line(self, pos):
+        """
+        Primeira linha com conteúdo a partir de pos, ignorando espaços e comentários ('--', '/* */'
+        e '#' do MySQL), e se ela já terminou. Retorna None enquanto nenhum conteúdo chegou ou um comentário
+        está incompleto.
+        """
+        buf = self.buffer
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos >= len(buf) or buf[pos:pos + 2] in ("-", "/"):
+                return None
+            if buf.startswith("--", pos) or buf[pos] == "#":
+                newline = buf.find("\n", pos)
+                if newline == -1:
+                    return None
+                pos = newline + 1
+            elif buf.startswith("/*", pos):
+                close = buf.find("*/", pos + 2)
+                if close == -1:
+                    return None
+                pos = close + 2
+            else:
+                newline = buf.find("\n", pos)
+                return (buf[pos:], False) if newline == -1 else (buf[pos:newline], True)
+
+    @staticmethod
+    def _is_prose(line, complete):
+        """
+        Indica se a linha é prosa (True), SQL (False) ou se ainda não dá para decidir (None).
+        """
+        match = PROSE_LINE_PATTERN.match(line)
+        if match is not None and (complete or match.end() < len(line)):
+            return all(word is None or word.upper() not in SQL_KEYWORDS for word in match.groups())
+        if complete:
+            return False
+        first = WORD_PATTERN.match(line)
+        if first.end() < len(line) and first.group().upper() in SQL_KEYWORDS:
+            return False  # Linha ainda incompleta, mas já começa com uma palavra-chave.
+        if not (first.group().isalpha() or first.group() in "*_>-+" or first.group().isdigit()):
+            return False
+        return None
+
+    def _open_fence(self, fence_at):
+        """
+        Inicia o comando na linha seguinte à cerca ``` de abertura encontrada em fence_at.
+        Retorna False se a linha da cerca ainda não terminou.
+        """
+        newline = self.buffer.find("\n", fence_at)
+        if newline == -1:
+            return False
+        self._fenced = True
+        self._start = self._pos = newline + 1
+        return True
+
+    def _scan(self):
+        buf = self.buffer
+        if self._start is None:
+            stripped = buf.lstrip()
+            offset = len(buf) - len(stripped)
+            if not stripped or "```".startswith(stripped):
+                return
+            if stripped.startswith("```"):
+                if not self._open_fence(offset):
+                    return
+            else:
+                word = WORD_PATTERN.match(stripped)
+                if word.end() >= len(stripped) and word.group().isalpha():
+                    return  # Aguarda a primeira palavra completa.
+                if word.group().upper() in SQL_START_KEYWORDS or word.group() == "(":
+                    self._start = self._pos = offset
+                else:
+                    # Texto introdutório: o comando começa após a próxima cerca ```.
+                    fence_at = buf.find("```", offset)
+                    if fence_at == -1 or not self._open_fence(fence_at):
+                        return
+
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._comment == "--":
+                if ch == "\n":
+                    self._comment = None
+                i += 1
+                continue
+            if self._comment == "/*":
+                if ch == "*" and i + 1 >= len(buf):
+                    break
+                if buf.startswith("*/", i):
+                    self._comment = None
+                    i += 2
+                else:
+                    i += 1
+                continue
+            if self._quote:
+                if ch == "\\" and self._quote != "`":
+                    if i + 1 >= len(buf):
+                        break
+                    i += 2
+                    continue
+                if ch == self._quote:
+                    if i + 1 >= len(buf):
+                        break  # Pode ser uma aspa duplicada (escape) dividida entre trechos.
+                    if buf[i + 1] == self._quote:
+                        i += 2
+                        continue
+                    self._quote = None
+                    self._last_end = i + 1
+                i += 1
+                continue
+
+            rest = buf[i:i + 3]
+            if any(len(rest) < len(token) and token.startswith(rest) for token in MULTI_CHAR_TOKENS):
+                break  # Aguarda o próximo trecho para decidir.
+            if rest == "```":
+                self._stop(i, "fence")
+                return
+            if rest.startswith("--") or rest.startswith("/*"):
+                self._comment = rest[:2]
+                i += 2
+                continue
+            if ch == "#" and not buf[buf.rfind("\n", 0, i) + 1:i].strip():
+                self._comment = "--"  # Comentário '#' do MySQL no início da linha, até o fim dela.
+                i += 1
+                continue
+            if not ch.isspace():
+                self._last_end = i + 1
+            if ch in "'\"`":
+                self._quote = ch
+            elif ch == "(":
+                self._depth += 1
+            elif ch == ")":
+                self._depth = max(0, self._depth - 1)
+            elif ch == ";":
+                self._stop(i + 1, "semicolon")
+                return
+            elif ch == "\n" and not self._fenced and self._depth == 0:
+                blank = BLANK_LINE_PATTERN.match(buf, i)
+                if blank is None:
+                    if PARTIAL_BLANK_LINE_PATTERN.match(buf, i):
+                        break
+                else:
+                    # Encerra apenas quando a próxima linha com conteúdo (após comentários) é prosa.
+                    line = self._next_content_line(blank.end())
+                    prose = None if line is None else self._is_prose(*line)
+                    if prose is None:
+                        break  # Aguarda mais texto da linha seguinte.
+                    if prose and self._may_stop_balanced(i):
+                        self._stop(i, "balanced")
+                        return
+                    i = blank.end()
+                    continue
+            i += 1
+        self._pos = i
@@ -0,0 +1,126 @@
+# Gerador de bancos de dados sintéticos para benchmarks offline.
+# Cria N tabelas com M colunas (encadeadas por chave estrangeira) e R linhas por tabela,
+# além de uma tabela de fatos grande, de forma determinística (mesma semente, mesmos dados).
+import datetime
+import random
+
+from sqlalchemy import Column, Date, Float, ForeignKey, Integer, MetaData, String, Table, create_engine, insert
+
+# Tamanho dos lotes de inserção.
+INSERT_CHUNK = 5000
+# Categorias usadas na tabela de fatos.
+CATEGORIAS = ("alimentos", "eletronicos", "roupas", "livros", "moveis")
+DATA_BASE = datetime.date(2020, 1, 1)
+
+# Tipos das colunas sintéticas (usados em rodízio) e o gerador de valores de cada um.
+COLUMN_KINDS = {
+    "inteiro": (Integer, lambda rng, row_id: rng.randint(0, 10_000)),
+    "decimal": (Float, lambda rng, row_id: round(rng.uniform(0, 10_000), 2)),
+    "texto": (lambda: String(40), lambda rng, row_id: f"valor_{row_id}_{rng.randint(0, 999)}"),
+    "data": (Date, lambda rng, row_id: DATA_BASE + datetime.timedelta(days=rng.randint(0, 1500))),
+}
+
+
+def table_name(index):
+    return f"tabela_{index:03d}"
+
+
+def column_kind(index):
+    return list(COLUMN_KINDS)[index % len(COLUMN_KINDS)]
+
+
+def build_metadata(n_tables, n_columns):
+    """
+    Define as tabelas sintéticas: cada tabela tem id, uma FK para a tabela anterior e
+    n_columns colunas de tipos variados. A tabela 'fatos' referencia a primeira tabela.
+    """
+    metadata = MetaData()
+    for t in range(n_tables):
+        columns = [Column("id", Integer, primary_key=True)]
+        if t > 0:
+            columns.append(Column(f"{table_name(t - 1)}_id", Integer, ForeignKey(f"{table_name(t - 1)}.id")))
+        for c in range(n_columns):
+            kind = column_kind(c)
+            column_type = COLUMN_KINDS[kind][0]
+            columns.append(Column(f"{kind}_{c:02d}", column_type() if kind == "texto" else column_type))
+        Table(table_name(t), metadata, *columns)
+    Table(
+        "fatos", metadata,
+        Column("id", Integer, primary_key=True),
+        Column(f"{table_name(0)}_id", Integer, ForeignKey(f"{table_name(0)}.id")),
+        Column("categoria", String(20)),
+        Column("quantidade", Integer),
+        Column("valor", Float),
+        Column("data_evento", Date),
+    )
+    return metadata
+
+
+def _insert_chunks(conn, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK:
+            conn.execute(insert(table), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(insert(table), chunk)
+
+
+def _table_rows(t, n_columns, n_rows, rng):
+    for row_id in range(1, n_rows + 1):
+        row = {"id": row_id}
+        if t > 0:
+            row[f"{table_name(t - 1)}_id"] = rng.randint(1, n_rows)
+        for c in range(n_columns):
+            kind = column_kind(c)
+            row[f"{kind}_{c:02d}"] = COLUMN_KINDS[kind][1](rng, row_id)
+        yield row
+
+
+def _fact_rows(start, end, n_rows, rng):
+    for row_id in range(start + 1, end + 1):
+        yield {
+            "id": row_id,
+            f"{table_name(0)}_id": rng.randint(1, max(n_rows, 1)),
+            "categoria": CATEGORIAS[row_id % len(CATEGORIAS)],
+            "quantidade": rng.randint(1, 50),
+            "valor": round(rng.uniform(1, 5000), 2),
+            "data_evento": DATA_BASE + datetime.timedelta(days=row_id % 1500),
+        }
+
+
+def create_synthetic_database(db_uri, n_tables=10, n_columns=8, n_rows=100, fact_rows=10_000, seed=42):
+    """
+    Cria (recriando, se já existirem) as tabelas sintéticas em db_uri e as popula.
+    Funciona com SQLite ou PostgreSQL local. Retorna o MetaData das tabelas criadas.
+    """
+    rng = random.Random(seed)
+    metadata = build_metadata(n_tables, n_columns)
+    engine = create_engine(db_uri)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        for t in range(n_tables):
+            _insert_chunks(conn, metadata.tables[table_name(t)], _table_rows(t, n_columns, n_rows, rng))
+        _insert_chunks(conn, metadata.tables["fatos"], _fact_rows(0, fact_rows, n_rows, rng))
+    engine.dispose()
+    return metadata
+
+
+def canned_questions(n_tables, dialect="sqlite"):
+    """
+    Perguntas sintéticas e o SQL pré-definido correspondente, para uso com o LLM substituto.
+    """
+    month = "strftime('%Y-%m', data_evento)" if dialect == "sqlite" else "to_char(data_evento, 'YYYY-MM')"
+    questions = {
+        "Quantos eventos existem por categoria?":
+            "SELECT categoria, COUNT(*) AS total FROM fatos GROUP BY categoria ORDER BY total DESC LIMIT 100;",
+        "Qual o valor total vendido por mês?":
+            f"SELECT {month} AS mes, SUM(valor) AS total FROM fatos GROUP BY mes ORDER BY mes LIMIT 100;",
+        "Quais os 10 maiores eventos por valor?":
+            "SELECT id, categoria, valor FROM fatos ORDER BY valor DESC LIMIT 10;",
+    }
+    for t in range(min(n_tables, 20)):
+        questions[f"Liste os registros da {table_name(t)}"] = f"SELECT * FROM {table_name(t)} LIMIT 100;"
+    return questions
@@ -0,0 +1,13 @@
+# Configuração dos testes: os módulos ficam na raiz do repositório e os caches em disco
+# (snapshot do schema, cache de geração e log de traces) são desviados para um diretório temporário.
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_cache_dir = tempfile.mkdtemp(prefix="text_to_sql_tests_")
+os.environ.setdefault("TEXT_TO_SQL_SCHEMA_CACHE_DIR", os.path.join(_cache_dir, "schema_cache"))
+os.environ.setdefault("TEXT_TO_SQL_CACHE_PATH", os.path.join(_cache_dir, "generation_cache.db"))
+os.environ.setdefault("TEXT_TO_SQL_TRACE_LOG", "")
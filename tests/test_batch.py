@@ -0,0 +1,105 @@
+import csv
+import json
+import sqlite3
+
+import pytest
+
+import batch
+from text_to_sql_engine import format_sql_with_regex
+
+RESPONSES = {
+    "Quais são os clientes?": "SELECT nome FROM clientes ORDER BY id",
+    "Quantos pedidos existem?": "SELECT COUNT(*) AS total FROM pedidos",
+    "Apague os clientes": "DELETE FROM clientes",
+    "Consulte a tabela inexistente": "SELECT * FROM inexistente",
+}
+QUESTIONS = list(RESPONSES) * 3
+
+
+@pytest.fixture
+def db_uri(tmp_path):
+    path = tmp_path / "loja.db"
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE clientes (id INTEGER PRIMARY KEY, nome TEXT);
+        CREATE TABLE pedidos (id INTEGER PRIMARY KEY, cliente_id INTEGER REFERENCES clientes(id), valor REAL);
+        INSERT INTO clientes VALUES (1, 'Ana'), (2, 'Bruno');
+        INSERT INTO pedidos VALUES (1, 1, 10.0), (2, 2, 20.0), (3, 1, 5.5);
+    """)
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{path}"
+
+
+@pytest.fixture
+def llm_spec(tmp_path):
+    path = tmp_path / "respostas.json"
+    path.write_text(json.dumps(RESPONSES, ensure_ascii=False), encoding="utf-8")
+    return f"fake:{path}"
+
+
+def run_main(db_uri, llm_spec, input_path, output_path):
+    return batch.main(["--db-uri", db_uri, "--input", str(input_path), "--output", str(output_path),
+                       "--llm", llm_spec, "--execute", "--concurrency", "4"])
+
+
+def read_jsonl(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def check_results(results, db_uri):
+    assert [r["id"] for r in results] == list(range(1, len(QUESTIONS) + 1))
+    assert [r["question"] for r in results] == QUESTIONS
+    for result in results:
+        assert result["sql"] == format_sql_with_regex(RESPONSES[result["question"]])
+        if result["question"] == "Quais são os clientes?":
+            assert result["error"] is None and result["rows"] == [["Ana"], ["Bruno"]]
+        elif result["question"] == "Quantos pedidos existem?":
+            assert result["columns"] == ["total"] and result["rows"] == [[3]]
+        else:
+            assert result["error_stage"] == "execution" and "rows" not in result
+    # O DELETE gerado não foi executado.
+    assert batch.execute_read_query(db_uri, "SELECT COUNT(*) FROM clientes")[1] == [[2]]
+
+
+def test_main_jsonl_input(tmp_path, db_uri, llm_spec):
+    input_path, output_path = tmp_path / "perguntas.jsonl", tmp_path / "respostas.jsonl"
+    input_path.write_text("".join(json.dumps({"question": q}, ensure_ascii=False) + "\n" for q in QUESTIONS),
+                          encoding="utf-8")
+    assert run_main(db_uri, llm_spec, input_path, output_path) == 1  # Há perguntas com erro.
+    check_results(read_jsonl(output_path), db_uri)
+
+
+def test_main_csv_input(tmp_path, db_uri, llm_spec):
+    input_path, output_path = tmp_path / "perguntas.csv", tmp_path / "respostas.jsonl"
+    with open(input_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["pergunta"])
+        writer.writerows([q] for q in QUESTIONS)
+    run_main(db_uri, llm_spec, input_path, output_path)
+    check_results(read_jsonl(output_path), db_uri)
+
+
+@pytest.mark.parametrize("sql_query", [
+    "DELETE FROM clientes",
+    "UPDATE clientes SET nome = 'x'",
+    "INSERT INTO clientes (nome) VALUES ('x')",
+    "WITH x AS (DELETE FROM clientes RETURNING *) SELECT * FROM x",
+])
+def test_execute_read_query_refuses_writes(db_uri, sql_query):
+    with pytest.raises(ValueError):
+        batch.execute_read_query(db_uri, sql_query)
+    assert batch.execute_read_query(db_uri, "SELECT COUNT(*) FROM clientes")[1] == [[2]]
+
+
+def test_generation_error_stage(db_uri):
+    class FailingChain:
+        steps = []
+
+        def stream(self, chain_input, config=None):
+            raise RuntimeError("cota excedida")
+
+    results = batch.run_batch([{"id": 1, "question": "Quais são os clientes?"}], FailingChain(), "sqlite",
+                              db_uri=db_uri, execute=True)
+    assert results[0]["error_stage"] == "generation" and "cota excedida" in results[0]["error"]
+    assert results[0]["sql"] is None and "execution_ms" not in results[0]
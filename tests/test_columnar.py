@@ -0,0 +1,98 @@
+import csv
+import datetime
+import decimal
+import os
+import sqlite3
+
+import pytest
+
+from columnar import export_cursor, rows_to_dataframe
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+class ListCursor:
+    """Cursor DB-API mínimo sobre uma lista de linhas."""
+
+    def __init__(self, columns, rows):
+        self.description = [(name,) + (None,) * 6 for name in columns]
+        self._rows = list(rows)
+
+    def fetchmany(self, size):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+
+COLUMNS = ["id", "valor", "nome", "criado_em"]
+ROWS = [
+    (1, decimal.Decimal("10.50"), "Ana", datetime.date(2024, 1, 2)),
+    (2, None, None, None),
+    (3, decimal.Decimal("123456.789"), "Bruno", datetime.date(2024, 3, 4)),
+    (None, decimal.Decimal("-0.001"), "Carla", None),
+]
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 2, 10])
+def test_csv_round_trip(tmp_path, chunk_rows):
+    path = str(tmp_path / "r.csv")
+    assert export_cursor(ListCursor(COLUMNS, ROWS), "csv", path, chunk_rows=chunk_rows) == (path, 4, False)
+    lines = read_csv(path)
+    assert lines[0] == COLUMNS
+    assert lines[1:] == [["" if v is None else str(v) for v in row] for row in ROWS]
+
+
+@pytest.mark.parametrize("chunk_rows", [1, 2, 10])
+def test_parquet_round_trip_keeps_decimals_and_nulls(tmp_path, chunk_rows):
+    path = str(tmp_path / "r.parquet")
+    assert export_cursor(ListCursor(COLUMNS, ROWS), "parquet", path, chunk_rows=chunk_rows)[1:] == (4, False)
+    table = pq.read_table(path)
+    assert table.column_names == COLUMNS
+    assert [tuple(row.values()) for row in table.to_pylist()] == ROWS
+
+
+def test_null_only_first_chunk(tmp_path):
+    path = str(tmp_path / "r.parquet")
+    rows = [(None,), (None,), ("x",)]
+    export_cursor(ListCursor(["c"], rows), "parquet", path, chunk_rows=2)
+    assert pq.read_table(path).column("c").to_pylist() == [None, None, "x"]
+
+
+def test_parquet_widens_column_when_later_chunk_does_not_fit(tmp_path):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (id INTEGER, v)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", [(1, 1), (2, 2), (3, "três"), (4, None), (5, 5)])
+    cursor = conn.execute("SELECT id, v FROM t ORDER BY id")
+    path = str(tmp_path / "r.parquet")
+    assert export_cursor(cursor, "parquet", path, chunk_rows=2)[1:] == (5, False)
+    table = pq.read_table(path)
+    assert table.column("id").to_pylist() == [1, 2, 3, 4, 5]
+    assert table.column("v").to_pylist() == ["1", "2", "três", None, "5"]
+    assert not os.path.exists(f"{path}.partial")
+
+
+def test_export_truncates_at_max_rows(tmp_path):
+    path = str(tmp_path / "r.csv")
+    assert export_cursor(ListCursor(COLUMNS, ROWS), "csv", path, chunk_rows=3, max_rows=3)[1:] == (3, True)
+    assert len(read_csv(path)) == 4
+
+
+def test_temporary_file_is_removed_on_error(tmp_path, monkeypatch):
+    monkeypatch.setattr("columnar.EXPORT_DIR", str(tmp_path))
+
+    class FailingCursor(ListCursor):
+        def fetchmany(self, size):
+            raise RuntimeError("conexão perdida")
+
+    with pytest.raises(RuntimeError):
+        export_cursor(FailingCursor(COLUMNS, ROWS), "parquet")
+    assert os.listdir(tmp_path) == []
+
+
+def test_rows_to_dataframe_mixed_column():
+    df = rows_to_dataframe(["v"], [(1,), ("a",), (None,)])
+    assert df["v"].tolist()[:2] == ["1", "a"]
@@ -0,0 +1,116 @@
+import pytest
+
+from followup import LAST_RESULT_TABLE, FollowupBudget, FollowupStore
+from result_fetch import estimate_row_bytes
+
+COLUMNS = ["mes", "total"]
+ROWS = [("2024-01", 10), ("2024-01", 5), ("2024-02", 7)]
+
+
+@pytest.fixture
+def budget():
+    return FollowupBudget(max_bytes=10 ** 9)
+
+
+@pytest.fixture
+def store(budget):
+    store = FollowupStore(max_results=2, budget=budget)
+    yield store
+    store.close()
+
+
+def tables(store):
+    return sorted(store.sql_database().get_usable_table_names())
+
+
+def test_load_and_query_last_result(store):
+    assert store.add_result(COLUMNS, ROWS, "SELECT mes, total FROM vendas", "vendas por mês")
+    columns, rows = store.execute(f"SELECT mes, total FROM {LAST_RESULT_TABLE} ORDER BY total")
+    assert columns == COLUMNS
+    assert rows == [("2024-01", 5), ("2024-02", 7), ("2024-01", 10)]
+    assert store.results[-1]["rows"] == 3
+    assert "vendas por mês" in store.sql_database().get_table_info()
+
+
+def test_refine_and_refine_again(store):
+    store.add_result(COLUMNS, ROWS, "SELECT mes, total FROM vendas")
+    columns, rows = store.execute(f"SELECT mes, SUM(total) AS soma FROM {LAST_RESULT_TABLE} GROUP BY mes ORDER BY mes")
+    assert rows == [("2024-01", 15), ("2024-02", 7)]
+    store.add_result(columns, rows, "SELECT ... GROUP BY mes")
+    assert store.execute(f"SELECT soma FROM {LAST_RESULT_TABLE} WHERE mes = '2024-02'")[1] == [(7,)]
+
+
+def test_only_read_queries_are_executed(store):
+    store.add_result(COLUMNS, ROWS, "SELECT 1")
+    with pytest.raises(ValueError):
+        store.execute(f"DELETE FROM {LAST_RESULT_TABLE}")
+    with pytest.raises(ValueError):
+        store.execute(f"SELECT * INTO copia FROM {LAST_RESULT_TABLE}")
+    assert len(store.execute(f"SELECT * FROM {LAST_RESULT_TABLE}")[1]) == 3
+
+
+def test_rotation_keeps_last_n_results(store):
+    for n in range(1, 4):
+        store.add_result(["n"], [(n,)], f"SELECT {n}")
+    assert tables(store) == ["resultado_2", LAST_RESULT_TABLE]
+    assert [result["sequence"] for result in store.results] == [2, 3]
+    assert store.execute("SELECT n FROM resultado_2")[1] == [(2,)]
+    assert store.execute(f"SELECT n FROM {LAST_RESULT_TABLE}")[1] == [(3,)]
+
+
+def test_chain_is_rebuilt_once_per_version(store):
+    built = []
+
+    def build_chain(db):
+        built.append(tuple(sorted(db.get_usable_table_names())))
+        return object()
+
+    assert store.chain(build_chain) is None
+    assert built == []
+    store.add_result(["n"], [(1,)], "SELECT 1")
+    first = store.chain(build_chain)
+    assert store.chain(build_chain) is first
+    store.add_result(["n"], [(2,)], "SELECT 2")
+    assert store.chain(build_chain) is not first
+    assert built == [(LAST_RESULT_TABLE,), ("resultado_1", LAST_RESULT_TABLE)]
+
+
+def test_column_names_and_values_are_sanitized(store):
+    store.add_result(["total", "total", None], [(1, 2, {"a": 1})], "SELECT 1")
+    columns, rows = store.execute(f"SELECT * FROM {LAST_RESULT_TABLE}")
+    assert len(set(columns)) == 3
+    assert rows == [(1, 2, '{"a": 1}')]
+
+
+def test_store_byte_cap_drops_oldest_and_skips_oversized(budget):
+    row_bytes = estimate_row_bytes(["x" * 100])
+    store = FollowupStore(max_results=5, max_bytes=row_bytes * 2, budget=budget)
+    for n in range(3):
+        assert store.add_result(["v"], [(str(n) * 100,)], f"SELECT {n}")
+    assert [result["sequence"] for result in store.results] == [2, 3]
+    assert store.nbytes <= store.max_bytes
+    assert not store.add_result(["v"], [("x" * 100,)] * 3, "SELECT grande")
+    assert [result["sequence"] for result in store.results] == [2, 3]
+    store.close()
+
+
+def test_budget_evicts_oldest_results_across_sessions():
+    row_bytes = estimate_row_bytes(["x" * 100])
+    budget = FollowupBudget(max_bytes=row_bytes * 3)
+    first = FollowupStore(max_results=5, budget=budget)
+    second = FollowupStore(max_results=5, budget=budget)
+    first.add_result(["v"], [("a" * 100,)], "SELECT 'a'")
+    second.add_result(["v"], [("b" * 100,)], "SELECT 'b'")
+    first.add_result(["v"], [("c" * 100,)], "SELECT 'c'")
+    assert budget.evictions == 0
+    version = first.version
+    second.add_result(["v"], [("d" * 100,)], "SELECT 'd'")
+    assert budget.evictions == 1
+    assert [result["sql"] for result in first.results] == ["SELECT 'c'"]
+    assert [result["sql"] for result in second.results] == ["SELECT 'b'", "SELECT 'd'"]
+    assert first.version == version + 1
+    assert tables(first) == [LAST_RESULT_TABLE]
+    assert budget.nbytes() <= budget.max_bytes
+    first.close()
+    assert budget.nbytes() == second.nbytes
+    second.close()
@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+import generation_cache
+from fake_llm import CannedSQLLLM
+from generation_cache import GenerationCache, make_cache_key, schema_fingerprint
+from text_to_sql_engine import build_text_to_sql_engine, generate_sql
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "generation_cache.db")
+
+
+def test_memory_lru_hit_and_eviction(cache_path):
+    cache = GenerationCache(db_path=None, max_entries=2)
+    cache.set("a", "SELECT 1")
+    cache.set("b", "SELECT 2")
+    assert cache.get("a") == "SELECT 1"  # "a" passa a ser a mais recente.
+    cache.set("c", "SELECT 3")  # Descarta "b", a menos usada.
+    assert cache.get("b") is None
+    assert cache.get("a") == "SELECT 1" and cache.get("c") == "SELECT 3"
+    assert cache.stats()["memory_hits"] == 3 and cache.stats()["memory_entries"] == 2
+
+
+def test_disk_tier_persists_across_instances(cache_path):
+    GenerationCache(db_path=cache_path).set("chave", "SELECT * FROM clientes")
+    cache = GenerationCache(db_path=cache_path)
+    assert cache.get("chave") == "SELECT * FROM clientes"
+    assert cache.get("chave") == "SELECT * FROM clientes"
+    assert (cache.stats()["disk_hits"], cache.stats()["memory_hits"]) == (1, 1)
+
+
+def test_disk_entries_expire(cache_path):
+    GenerationCache(db_path=cache_path).set("chave", "SELECT 1")
+    assert GenerationCache(db_path=cache_path, disk_ttl=-1).get("chave") is None
+
+
+def test_connections_are_closed(cache_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(generation_cache.sqlite3, "connect", tracking_connect)
+    cache = GenerationCache(db_path=cache_path, max_entries=1)
+    cache.set("a", "SELECT 1")
+    cache.set("b", "SELECT 2")
+    cache.get("a")
+    assert len(opened) == 4
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")  # Conexão fechada.
+
+
+def test_cache_key_changes_with_schema_fingerprint():
+    key = make_cache_key("Quais  são os clientes?", "sqlite", 100, schema_fingerprint("CREATE TABLE clientes (id)"))
+    assert key == make_cache_key("Quais são os clientes?", "sqlite", 100, schema_fingerprint("CREATE TABLE clientes (id)"))
+    assert key != make_cache_key("Quais são os clientes?", "sqlite", 100,
+                                 schema_fingerprint("CREATE TABLE clientes (id, nome)"))
+    assert key != make_cache_key("Quais são os clientes?", "postgresql", 100,
+                                 schema_fingerprint("CREATE TABLE clientes (id)"))
+
+
+@pytest.fixture
+def db_uri(tmp_path):
+    path = tmp_path / "loja.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE clientes (id INTEGER PRIMARY KEY, nome TEXT)")
+    conn.commit()
+    conn.close()
+    return f"sqlite:///{path}"
+
+
+@pytest.mark.parametrize("output, reason, cached", [
+    ("SELECT nome FROM clientes;", "semicolon", True),
+    ("SELECT nome FROM clientes\n\nEsta consulta lista os nomes.\n", "balanced", False),
+])
+def test_generate_sql_skips_caching_balanced_stops(db_uri, cache_path, output, reason, cached):
+    llm = CannedSQLLLM(default_sql=output)
+    sql_chain, db, _, schema_fp, schema_index, _ = build_text_to_sql_engine(db_uri, llm)
+    cache = GenerationCache(db_path=cache_path)
+    result = generate_sql(sql_chain, "Quais são os clientes?", db.dialect, schema_index=schema_index,
+                          schema_fp=schema_fp, generation_cache=cache)
+    assert result["stop_reason"] == reason and result["sql"].startswith("SELECT nome")
+    again = generate_sql(sql_chain, "Quais são os clientes?", db.dialect, schema_index=schema_index,
+                         schema_fp=schema_fp, generation_cache=cache)
+    assert again["from_cache"] is cached
@@ -0,0 +1,31 @@
+import uuid
+from types import SimpleNamespace
+
+from metrics import LLMStageCallback, RequestTrace
+
+
+def _stop_early(callback, run_id):
+    callback.on_llm_error(GeneratorExit(), run_id=run_id)
+    return callback.trace.stages[-1]
+
+
+def test_early_stop_estimates_tokens_from_streamed_text():
+    callback, run_id = LLMStageCallback(RequestTrace("generation")), uuid.uuid4()
+    callback.on_llm_start({}, ["x" * 400], run_id=run_id)
+    for token in ("SELECT ", "nome ", "FROM ", "clientes;"):
+        callback.on_llm_new_token(token, run_id=run_id)
+    stage = _stop_early(callback, run_id)
+    assert stage["stopped_early"] and stage["tokens_estimated"]
+    assert stage["prompt_tokens"] == 100
+    assert stage["completion_tokens"] == 7  # 26 caracteres / 4, arredondado para cima.
+
+
+def test_early_stop_uses_usage_reported_in_chunks():
+    callback, run_id = LLMStageCallback(RequestTrace("generation")), uuid.uuid4()
+    callback.on_llm_start({}, ["prompt"], run_id=run_id)
+    for usage in ({"input_tokens": 120, "output_tokens": 2}, {"input_tokens": 0, "output_tokens": 3}):
+        chunk = SimpleNamespace(message=SimpleNamespace(usage_metadata=usage))
+        callback.on_llm_new_token("SELECT ", run_id=run_id, chunk=chunk)
+    stage = _stop_early(callback, run_id)
+    assert (stage["prompt_tokens"], stage["completion_tokens"]) == (120, 5)
+    assert not stage["tokens_estimated"]
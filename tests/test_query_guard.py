@@ -0,0 +1,131 @@
+import sqlite3
+
+import pytest
+
+from connection_pool import reset_session_timeout
+from query_guard import guard_query, rewrite_with_limit, set_statement_timeout
+
+
+class RecordingCursor:
+    def __init__(self, executed, fail=False):
+        self.executed = executed
+        self.fail = fail
+
+    def execute(self, sql):
+        if self.fail:
+            raise RuntimeError("conexão perdida")
+        self.executed.append(sql)
+
+    def close(self):
+        pass
+
+
+class RecordingConnection:
+    def __init__(self, fail=False):
+        self.executed = []
+        self.fail = fail
+
+    def cursor(self):
+        return RecordingCursor(self.executed, self.fail)
+
+
+class RecordingRecord:
+    def __init__(self):
+        self.invalidated = None
+
+    def invalidate(self, e=None):
+        self.invalidated = e
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (30, ["SET SESSION MAX_EXECUTION_TIME = 30000"]),
+    (0, ["SET SESSION MAX_EXECUTION_TIME = 0"]),
+])
+def test_mysql_timeout_is_always_set(seconds, expected):
+    conn = RecordingConnection()
+    set_statement_timeout(conn, "mysql", seconds)
+    assert conn.executed == expected
+
+
+def test_postgres_timeout_is_transaction_local():
+    conn = RecordingConnection()
+    set_statement_timeout(conn, "postgres", 0)
+    set_statement_timeout(conn, "postgres", 1.5)
+    assert conn.executed == ["SET LOCAL statement_timeout = 1500"]
+
+
+def test_checkin_restores_session_timeout():
+    conn, record = RecordingConnection(), RecordingRecord()
+    reset_session_timeout(conn, record)
+    assert conn.executed == ["SET SESSION MAX_EXECUTION_TIME = DEFAULT"]
+    assert record.invalidated is None
+
+
+def test_checkin_invalidates_connection_when_reset_fails():
+    record = RecordingRecord()
+    reset_session_timeout(RecordingConnection(fail=True), record)
+    assert isinstance(record.invalidated, RuntimeError)
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT a, a FROM t", "SELECT a, a FROM t LIMIT 1000"),
+    ("SELECT * FROM t LIMIT 5000;", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t LIMIT 10", "SELECT * FROM t LIMIT 10"),
+    ("SELECT * FROM t LIMIT 20, 5000", "SELECT * FROM t LIMIT 20, 1000"),
+    ("SELECT * FROM t LIMIT ALL", "SELECT * FROM t LIMIT 1000"),
+    ("SELECT * FROM t LIMIT 5000 OFFSET 10", "SELECT * FROM t LIMIT 1000 OFFSET 10"),
+    ("SELECT * FROM t ORDER BY a OFFSET 10", "SELECT * FROM t ORDER BY a LIMIT 1000 OFFSET 10"),
+    ("SELECT * FROM t FOR UPDATE", "SELECT * FROM t LIMIT 1000 FOR UPDATE"),
+    ("SELECT * FROM t FETCH FIRST 5000 ROWS ONLY", "SELECT * FROM t FETCH FIRST 1000 ROWS ONLY"),
+    ("SELECT * FROM t FETCH FIRST ROW ONLY", "SELECT * FROM t FETCH FIRST ROW ONLY"),
+    ("SELECT * FROM (SELECT * FROM x LIMIT 99999) s", "SELECT * FROM (SELECT * FROM x LIMIT 99999) s LIMIT 1000"),
+    ("WITH c AS (SELECT 1 LIMIT 5) SELECT * FROM c UNION SELECT 2",
+     "WITH c AS (SELECT 1 LIMIT 5) SELECT * FROM c UNION SELECT 2 LIMIT 1000"),
+    ("SELECT 'LIMIT 9999', \"LIMIT\" FROM t", "SELECT 'LIMIT 9999', \"LIMIT\" FROM t LIMIT 1000"),
+    ("SELECT * FROM t -- LIMIT 5000", "SELECT * FROM t LIMIT 1000 -- LIMIT 5000"),
+    ("SELECT * FROM t /* fim */", "SELECT * FROM t LIMIT 1000 /* fim */"),
+    ("SELECT a FROM t INTO @x", None),
+])
+def test_rewrite_with_limit(sql, expected):
+    assert rewrite_with_limit(sql, 1000) == expected
+
+
+def test_rewrite_keeps_duplicate_column_names_executable():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (a INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(10)])
+    sql = rewrite_with_limit("SELECT t.a, u.a FROM t JOIN t AS u ON u.a = t.a ORDER BY t.a", 3)
+    assert conn.execute(sql).fetchall() == [(0, 0), (1, 1), (2, 2)]
+
+
+class ExplainConnection:
+    """Conexão que responde ao EXPLAIN com custos fixos por consulta."""
+
+    def __init__(self, costs):
+        self.costs = costs
+        self.explained = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.explained.append(sql[len("EXPLAIN (FORMAT JSON) "):])
+
+    def fetchone(self):
+        cost = self.costs[self.explained[-1]]
+        return ([{"Plan": {"Total Cost": cost, "Plan Rows": cost}}],)
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_guard_rewrites_or_rejects_expensive_reads():
+    conn = ExplainConnection({"SELECT * FROM t": 5000, "SELECT * FROM t LIMIT 100": 50})
+    decision = guard_query(conn, "postgres", "SELECT * FROM t;", max_cost=1000, max_rows=1000, limit=100)
+    assert (decision.action, decision.sql) == ("rewrite", "SELECT * FROM t LIMIT 100")
+    conn = ExplainConnection({"SELECT a FROM t INTO x": 5000})
+    decision = guard_query(conn, "postgres", "SELECT a FROM t INTO x", max_cost=1000, max_rows=1000, limit=100)
+    assert decision.action == "reject"
@@ -0,0 +1,30 @@
+import time
+
+from resource_registry import ResourceRegistry
+
+
+def _acquire_and_release(registry, disposed):
+    registry.acquire("dsn", "sessao-1", lambda: "motor", group="dsn", on_group_evicted=lambda: disposed.append("dsn"))
+    registry.release("sessao-1")
+
+
+def test_touch_evicts_idle_resources():
+    registry, disposed = ResourceRegistry(idle_ttl=0.01), []
+    _acquire_and_release(registry, disposed)
+    time.sleep(0.05)
+    registry.touch("sessao-2")
+    assert disposed == ["dsn"]
+    assert registry.stats()["resources"] == []
+
+
+def test_sweeper_evicts_idle_resources_without_activity():
+    registry, disposed = ResourceRegistry(idle_ttl=0.01), []
+    _acquire_and_release(registry, disposed)
+    registry.start_sweeper(interval=0.01)
+    try:
+        deadline = time.monotonic() + 2
+        while not disposed and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        registry.stop_sweeper()
+    assert disposed == ["dsn"]
@@ -0,0 +1,85 @@
+import pytest
+
+from result_cache import ResultCache, is_volatile, modified_tables, writes_data
+
+
+@pytest.mark.parametrize("sql_query, expected", [
+    ("INSERT INTO clientes (nome) VALUES ('a, b')", {"clientes"}),
+    ("UPDATE vendas SET valor = 1, status = 'ok' WHERE id IN (SELECT id FROM a JOIN b ON a.x = b.x)", {"vendas"}),
+    ("UPDATE vendas SET valor = c.valor FROM cotacoes c, moedas m WHERE vendas.id = c.id", {"vendas"}),
+    ("DELETE FROM clientes WHERE id IN (SELECT id FROM a, b)", {"clientes"}),
+    ("DELETE FROM public.clientes USING cotacoes WHERE clientes.id = cotacoes.id", {"clientes"}),
+    ("WITH x AS (DELETE FROM clientes RETURNING *) SELECT * FROM x JOIN y ON x.id = y.id", {"clientes"}),
+    ("EXPLAIN ANALYZE UPDATE vendas SET valor = 0", {"vendas"}),
+    ("SET search_path = public", set()),
+])
+def test_modified_tables_single_target(sql_query, expected):
+    assert modified_tables(sql_query) == expected
+
+
+@pytest.mark.parametrize("sql_query", [
+    "UPDATE t1 JOIN t2 ON t1.id = t2.id SET t2.x = 1",
+    "UPDATE t1 INNER JOIN t2 USING (id) SET t1.x = t2.x",
+    "UPDATE t1, t2 SET t1.x = t2.x WHERE t1.id = t2.id",
+    "DELETE t1, t2 FROM t1 JOIN t2 ON t1.id = t2.id",
+    "DELETE t1 FROM t1 JOIN t2 ON t1.id = t2.id WHERE t2.x = 1",
+    "DELETE t1 FROM t1, t2 WHERE t1.id = t2.id",
+    "DELETE FROM t1, t2 USING t1 JOIN t2 ON t1.id = t2.id",
+    "DELETE FROM t1 USING t1, t2 WHERE t1.id = t2.id",
+    "WITH x AS (SELECT 1) UPDATE t1 JOIN t2 ON t1.id = t2.id SET t2.x = 1",
+    "EXPLAIN ANALYZE DELETE t1, t2 FROM t1 JOIN t2 ON t1.id = t2.id",
+    "CALL atualiza_saldos()",
+])
+def test_modified_tables_multi_table_invalidates_dsn(sql_query):
+    assert modified_tables(sql_query) is None
+
+
+@pytest.mark.parametrize("sql_query, expected", [
+    ("SELECT a, b INTO nova FROM clientes", {"nova"}),
+    ("SELECT * INTO TEMP copia FROM clientes WHERE id IN (SELECT id FROM pedidos)", {"copia"}),
+    ("SELECT * INTO UNLOGGED TABLE public.copia FROM clientes", {"copia"}),
+    ("WITH x AS (SELECT 1 AS a) SELECT * INTO copia FROM x", {"copia"}),
+    ("EXPLAIN ANALYZE SELECT * INTO copia FROM clientes", {"copia"}),
+])
+def test_select_into_table_is_a_write(sql_query, expected):
+    assert writes_data(sql_query)
+    assert modified_tables(sql_query) == expected
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT nome INTO @nome FROM clientes LIMIT 1",
+    "SELECT nome, id FROM clientes LIMIT 1 INTO @nome, @id",
+    "SELECT 'insert into x' FROM clientes",
+    "SELECT * FROM clientes WHERE id IN (SELECT id FROM pedidos)",
+    "EXPLAIN SELECT * INTO copia FROM clientes",
+])
+def test_select_without_into_table_is_not_a_write(sql_query):
+    assert not writes_data(sql_query)
+
+
+def test_select_into_outfile_is_a_write_without_known_target():
+    sql_query = "SELECT * FROM clientes INTO OUTFILE '/tmp/clientes.csv'"
+    assert writes_data(sql_query)
+    assert modified_tables(sql_query) is None
+
+
+@pytest.mark.parametrize("sql_query, expected", [
+    ("SELECT now()", True),
+    ("SELECT * FROM pedidos WHERE criado_em > CURRENT_DATE - 7", True),
+    ("SELECT * FROM clientes ORDER BY random() LIMIT 5", True),
+    ("SELECT * FROM clientes ORDER BY RAND() LIMIT 5", True),
+    ("SELECT date('now')", True),
+    ("SELECT random, now_total FROM metricas", False),
+    ("SELECT 'now()' AS texto FROM clientes", False),
+    ("SELECT * FROM clientes -- now()", False),
+])
+def test_is_volatile(sql_query, expected):
+    assert is_volatile(sql_query) is expected
+
+
+def test_volatile_results_are_not_cached():
+    cache = ResultCache()
+    assert not cache.put("sqlite://", "SELECT now()", ["now"], [("2026-01-01",)])
+    assert cache.get("sqlite://", "SELECT now()") is None
+    assert cache.put("sqlite://", "SELECT 1", ["1"], [(1,)])
+    assert cache.get("sqlite://", "SELECT 1").rows == [(1,)]
@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from result_fetch import ResultStream, get_result_stream_reaper, is_read_query, open_streaming_cursor
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT * FROM clientes",
+    "-- comentário\n(SELECT 1)",
+    "WITH x AS (SELECT 1) SELECT * FROM x",
+    "SHOW TABLES",
+    "EXPLAIN DELETE FROM clientes",
+    "EXPLAIN ANALYZE SELECT * FROM clientes",
+    "SELECT coalesce(nome, '(delete from x') FROM clientes",
+    "SELECT nome INTO @nome FROM clientes LIMIT 1",
+])
+def test_is_read_query_accepts_reads(sql_query):
+    assert is_read_query(sql_query)
+
+
+@pytest.mark.parametrize("sql_query", [
+    "DELETE FROM clientes",
+    "WITH x AS (DELETE FROM clientes RETURNING *) SELECT * FROM x",
+    "WITH x AS (SELECT 1) INSERT INTO clientes SELECT * FROM x",
+    "EXPLAIN ANALYZE DELETE FROM clientes",
+    "EXPLAIN (ANALYZE, BUFFERS) UPDATE clientes SET nome = 'a'",
+    "WITH x AS (SELECT 1) UPDATE t1 JOIN t2 ON t1.id = t2.id SET t2.x = 1",
+    "CALL atualiza()",
+    "SELECT * INTO copia FROM clientes",
+    "SELECT * FROM clientes INTO OUTFILE '/tmp/clientes.csv'",
+])
+def test_is_read_query_rejects_writes(sql_query):
+    assert not is_read_query(sql_query)
+
+
+class RecordingCursor:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+class RecordingConnection:
+    def cursor(self, **kwargs):
+        return RecordingCursor(**kwargs)
+
+
+@pytest.mark.parametrize("sql_query, named", [
+    ("SELECT 1", True),
+    ("WITH x AS (SELECT 1) SELECT * FROM x", True),
+    ("VALUES (1)", True),
+    ("SHOW search_path", False),
+    ("EXPLAIN SELECT 1", False),
+])
+def test_open_streaming_cursor_uses_named_cursor_only_for_selects(sql_query, named):
+    cursor = open_streaming_cursor(RecordingConnection(), "postgres", sql_query)
+    assert ("name" in cursor.kwargs) is named
+
+
+class PooledConnection:
+    def __init__(self):
+        self.returned = False
+
+    def close(self):
+        self.returned = True
+
+
+class ListCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.description = [("n",)]
+        self.closed = False
+
+    def execute(self, sql_query):
+        pass
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+def _open_stream(idle_timeout):
+    conn, cursor = PooledConnection(), ListCursor([(i,) for i in range(100)])
+    stream = ResultStream(conn, cursor, "SELECT n FROM t", page_size=10, owns_connection=True,
+                          idle_timeout=idle_timeout)
+    stream.execute(stream.sql_query)
+    stream.fetch_page()
+    return stream, conn, cursor
+
+
+def test_idle_stream_is_closed_and_returns_connection():
+    stream, conn, cursor = _open_stream(idle_timeout=60)
+    assert get_result_stream_reaper().sweep(now=time.monotonic() + 61) >= 1
+    assert stream.expired and not stream.has_more
+    assert cursor.closed and conn.returned
+    assert len(stream.page_rows) == 10  # A página atual continua disponível para exibição.
+
+
+def test_active_stream_is_kept_open():
+    stream, conn, _ = _open_stream(idle_timeout=60)
+    stream.fetch_page()
+    get_result_stream_reaper().sweep(now=time.monotonic() + 30)
+    assert stream.has_more and not stream.expired and not conn.returned
+    stream.close()
+    assert conn.returned
@@ -0,0 +1,115 @@
+import os
+import pickle
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+import schema_cache
+from schema_cache import SchemaSnapshotStore, load_sql_database, redact_dsn
+
+SCHEMA = """
+    CREATE TABLE clientes (id INTEGER PRIMARY KEY, nome TEXT);
+    CREATE TABLE pedidos (id INTEGER PRIMARY KEY, cliente_id INTEGER REFERENCES clientes(id), valor REAL);
+    CREATE TABLE produtos (id INTEGER PRIMARY KEY, descricao TEXT);
+    INSERT INTO clientes VALUES (1, 'Ana');
+    INSERT INTO produtos VALUES (1, 'Caneta');
+"""
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "loja.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.close()
+    db_uri = f"sqlite:///{path}"
+    return path, db_uri, create_engine(db_uri), SchemaSnapshotStore(str(tmp_path / "snapshots"))
+
+
+def load(database):
+    _, db_uri, engine, store = database
+    return load_sql_database(db_uri, engine=engine, store=store)
+
+
+def test_full_then_snapshot_then_incremental(database):
+    path = database[0]
+    db, table_info, info = load(database)
+    assert info["source"] == "full"
+    assert sorted(info["refreshed_tables"]) == ["clientes", "pedidos", "produtos"]
+    assert "Caneta" in table_info["produtos"]
+
+    db, snapshot_info, info = load(database)
+    assert info["source"] == "snapshot" and info["refreshed_tables"] == []
+    assert snapshot_info == table_info
+    assert db.get_table_info(["produtos"]) == table_info["produtos"]
+
+    conn = sqlite3.connect(path)
+    conn.execute("ALTER TABLE produtos ADD COLUMN preco REAL")
+    conn.commit()
+    conn.close()
+    db, incremental_info, info = load(database)
+    assert info["source"] == "incremental" and info["refreshed_tables"] == ["produtos"]
+    assert "preco" in incremental_info["produtos"]
+    assert incremental_info["clientes"] == table_info["clientes"]
+
+    assert load(database)[2]["source"] == "snapshot"
+
+
+def test_change_in_referenced_table_refreshes_dependents(database):
+    path = database[0]
+    load(database)
+    conn = sqlite3.connect(path)
+    conn.execute("ALTER TABLE clientes ADD COLUMN email TEXT")
+    conn.commit()
+    conn.close()
+    _, table_info, info = load(database)
+    assert info["source"] == "incremental"
+    assert sorted(info["refreshed_tables"]) == ["clientes", "pedidos"]  # pedidos tem FK para clientes.
+    assert "email" in table_info["clientes"]
+
+
+def test_dropped_table_is_removed(database):
+    path = database[0]
+    load(database)
+    conn = sqlite3.connect(path)
+    conn.execute("DROP TABLE produtos")
+    conn.commit()
+    conn.close()
+    db, table_info, info = load(database)
+    assert info["source"] == "incremental" and "produtos" not in table_info
+    assert "produtos" not in db.get_usable_table_names()
+
+
+@pytest.mark.parametrize("content", [
+    b"isto nao e um pickle",
+    b"",
+    pickle.dumps(["lista", "em vez de dicionario"]),
+    pickle.dumps({"version": -1}),
+])
+def test_corrupt_snapshot_falls_back_to_full_reflection(database, content):
+    _, db_uri, _, store = database
+    load(database)
+    with open(store._path(redact_dsn(db_uri)), "wb") as f:
+        f.write(content)
+    _, table_info, info = load(database)
+    assert info["source"] == "full" and sorted(table_info) == ["clientes", "pedidos", "produtos"]
+    assert load(database)[2]["source"] == "snapshot"  # O snapshot foi regravado.
+
+
+def test_unpicklable_snapshot_is_not_saved(database, monkeypatch):
+    _, _, _, store = database
+
+    def failing_dump(*args, **kwargs):
+        raise pickle.PicklingError("objeto não serializável")
+
+    monkeypatch.setattr(schema_cache.pickle, "dump", failing_dump)
+    _, table_info, info = load(database)
+    assert info["source"] == "full" and sorted(table_info) == ["clientes", "pedidos", "produtos"]
+    assert os.listdir(store.cache_dir) == []  # Sem snapshot nem arquivo temporário.
+    monkeypatch.undo()
+    assert load(database)[2]["source"] == "full"
+
+
+def test_redact_dsn_removes_password():
+    assert redact_dsn("postgresql+psycopg2://ana:segredo@db:5432/loja") == "postgresql+psycopg2://ana@db:5432/loja"
@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+
+from fake_llm import CannedSQLLLM
+from schema_index import SchemaIndex, tokenize
+from text_to_sql_engine import build_text_to_sql_engine, stream_sql_chain
+
+SCHEMA = """
+    CREATE TABLE clientes (id INTEGER PRIMARY KEY, nome TEXT, email TEXT);
+    CREATE TABLE pedidos (id INTEGER PRIMARY KEY, cliente_id INTEGER REFERENCES clientes(id), data TEXT);
+    CREATE TABLE produtos (id INTEGER PRIMARY KEY, descricao TEXT, preco REAL);
+    CREATE TABLE itens_pedido (pedido_id INTEGER REFERENCES pedidos(id), produto_id INTEGER REFERENCES produtos(id),
+                               quantidade INTEGER);
+    CREATE TABLE departamentos (id INTEGER PRIMARY KEY, sigla TEXT);
+    CREATE TABLE funcionarios (id INTEGER PRIMARY KEY, salario REAL,
+                               departamento_id INTEGER REFERENCES departamentos(id));
+    CREATE TABLE fornecedores (id INTEGER PRIMARY KEY, cnpj TEXT);
+"""
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    path = tmp_path_factory.mktemp("schema_index") / "loja.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.close()
+    return build_text_to_sql_engine(f"sqlite:///{path}", CannedSQLLLM())
+
+
+@pytest.fixture(scope="module")
+def index(engine):
+    return engine[4]
+
+
+def test_tokenize_normalizes_plural_accents_and_case():
+    assert tokenize("Funcionários clienteId itens_pedido") == ["funcionario", "client", "id", "iten", "pedido"]
+
+
+def test_bm25_ranks_matching_table_first(index):
+    scores = dict(zip(index.tables, index.score("qual o salário dos funcionários?")))
+    assert max(scores, key=scores.get) == "funcionarios"
+    assert index.select_tables("salário dos funcionários", top_n=1, include_neighbours=False) == ["funcionarios"]
+    assert index.select_tables("preço do produto", top_n=1, include_neighbours=False) == ["produtos"]
+
+
+def test_fk_neighbours_are_added(index):
+    assert index.select_tables("salário dos funcionários", top_n=1) == ["departamentos", "funcionarios"]
+    assert index.select_tables("data dos pedidos", top_n=1) == ["clientes", "itens_pedido", "pedidos"]
+
+
+@pytest.mark.parametrize("question, top_n", [
+    ("salário dos funcionários", 0),  # Poda desativada.
+    ("salário dos funcionários", 7),  # Banco com top_n tabelas ou menos.
+    ("xyzzy plugh", 2),  # Nenhum termo em comum com o schema.
+])
+def test_falls_back_to_full_schema(index, question, top_n):
+    assert index.select_tables(question, top_n=top_n) is None
+    assert index.prompt_reduction(None)["reduction"] == 0.0
+
+
+def test_prompt_reduction(index):
+    selected = index.select_tables("salário dos funcionários", top_n=1)
+    reduction = index.prompt_reduction(selected)
+    assert reduction["full_chars"] == len(index.render_table_info())
+    assert 0 < reduction["selected_chars"] < reduction["full_chars"]
+    assert reduction["reduction"] == pytest.approx(1 - reduction["selected_chars"] / reduction["full_chars"])
+
+
+class PromptCapture(BaseCallbackHandler):
+    def __init__(self):
+        self.prompts = []
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.prompts.extend(prompts)
+
+
+def test_rendered_table_info_matches_chain_input(engine, index):
+    sql_chain, db = engine[0], engine[1]
+    selected = index.select_tables("salário dos funcionários", top_n=1)
+    capture = PromptCapture()
+    chain_input = {"question": "salário dos funcionários", "input": "salário dos funcionários",
+                   "dialect": db.dialect, "top_k": 10, "table_names_to_use": selected}
+    list(stream_sql_chain(sql_chain, chain_input, config={"callbacks": [capture]}))
+    rendered = index.render_table_info(selected)
+    assert rendered == db.get_table_info(selected)
+    assert rendered in capture.prompts[0]
+    assert "CREATE TABLE clientes" not in capture.prompts[0]
+
+
+def test_index_from_documents_without_database():
+    index = SchemaIndex({"a": "vendas valor", "b": "clientes nome", "c": "estoque"}, {"a": {"b"}, "b": {"a"}},
+                        {"a": "CREATE TABLE a", "b": "CREATE TABLE b", "c": "CREATE TABLE c"})
+    assert index.select_tables("valor das vendas", top_n=1) == ["a", "b"]
+    assert index.render_table_info(["b", "a"]) == "CREATE TABLE a\n\nCREATE TABLE b"
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import service
+from connection_pool import pool_stats
+from fake_llm import CannedSQLLLM
+
+
+class UnreadResultFound(Exception):
+    pass
+
+
+class UnbufferedCursor:
+    """
+    Cursor SQLite que imita o cursor não bufferizado do mysql-connector: fechar com linhas
+    não lidas falha, a menos que a conexão tenha consumido o restante (consume_results).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.raw.cursor()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def execute(self, sql):
+        self.cursor.execute(sql)
+        self.conn.unread = self.cursor.description is not None
+
+    def fetchmany(self, size):
+        rows = self.cursor.fetchmany(size)
+        if len(rows) < size:
+            self.conn.unread = False
+        return rows
+
+    def close(self):
+        if self.conn.unread:
+            raise UnreadResultFound("Unread result found")
+        self.cursor.close()
+
+
+class UnbufferedConnection:
+    def __init__(self, raw):
+        self.raw = raw
+        self.unread = False
+
+    def cursor(self, *args, **kwargs):
+        return UnbufferedCursor(self)
+
+    def consume_results(self):
+        self.unread = False
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def _create_database(path, rows=20):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE clientes (id INTEGER PRIMARY KEY, nome TEXT)")
+    conn.executemany("INSERT INTO clientes (nome) VALUES (?)", [(f"cliente {i}",) for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+
+def _run(db_uri, monkeypatch, requests, llm=None, **options):
+    checkout = service.checkout_connection
+    monkeypatch.setattr(service, "checkout_connection", lambda uri: UnbufferedConnection(checkout(uri)))
+    options.setdefault("max_rows", 1000)
+
+    async def scenario():
+        app = service.create_app(db_uri, llm or CannedSQLLLM(responses={}), **options)
+        async with TestClient(TestServer(app)) as client:
+            return [await request(client) for request in requests]
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def db_uri(tmp_path):
+    path = tmp_path / "banco.db"
+    _create_database(path)
+    return f"sqlite:///{path}"
+
+
+def _count_rows(db_uri):
+    conn = sqlite3.connect(db_uri[len("sqlite:///"):])
+    try:
+        return conn.execute("SELECT COUNT(*) FROM clientes").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_execute_truncated_json_releases_unbuffered_cursor(tmp_path, monkeypatch):
+    path = tmp_path / "banco.db"
+    _create_database(path)
+    db_uri = f"sqlite:///{path}"
+
+    async def execute(client):
+        response = await client.post("/execute", json={"sql": "SELECT * FROM clientes", "max_rows": 5})
+        return response.status, await response.json()
+
+    [(status, body)] = _run(db_uri, monkeypatch, [execute])
+    assert status == 200
+    assert body["row_count"] == 5
+    assert body["truncated"] is True
+    assert pool_stats(db_uri)["checked_out"] == 0
+
+
+def test_execute_truncated_ndjson_ends_stream(tmp_path, monkeypatch):
+    path = tmp_path / "banco.db"
+    _create_database(path)
+    db_uri = f"sqlite:///{path}"
+
+    async def execute(client):
+        response = await client.post(
+            "/execute", json={"sql": "SELECT * FROM clientes", "max_rows": 7, "batch_rows": 3, "format": "ndjson"}
+        )
+        return response.status, [json.loads(line) for line in (await response.text()).splitlines()]
+
+    [(status, lines)] = _run(db_uri, monkeypatch, [execute])
+    assert status == 200
+    assert lines[0]["columns"] == ["id", "nome"]
+    assert [len(line["rows"]) for line in lines[1:-1]] == [3, 3, 1]
+    assert lines[-1] == {"done": True, "row_count": 7, "truncated": True}
+    assert pool_stats(db_uri)["checked_out"] == 0
+
+
+RESPONSES = {
+    "Liste os clientes": "SELECT nome FROM clientes ORDER BY id LIMIT 3;",
+    "Apague os clientes": "DELETE FROM clientes;",
+}
+
+
+def test_generate_uses_llm_and_schema_pruning(db_uri, monkeypatch):
+    async def generate(client):
+        response = await client.post("/generate", json={"question": "Liste os clientes"})
+        return response.status, await response.json()
+
+    async def missing_question(client):
+        response = await client.post("/generate", json={"question": " "})
+        return response.status, await response.json()
+
+    [(status, body), (missing_status, missing)] = _run(
+        db_uri, monkeypatch, [generate, missing_question], llm=CannedSQLLLM(responses=RESPONSES)
+    )
+    assert status == 200
+    assert body["sql"].split() == ["SELECT", "nome", "FROM", "clientes", "ORDER", "BY", "id", "LIMIT", "3;"]
+    # Uma única tabela: a poda do schema não se aplica e o schema completo é enviado.
+    assert body["selected_tables"] is None
+    assert body["from_cache"] is False
+    assert [stage["stage"] for stage in body["stages"]][0] == "schema_pruning"
+    assert missing_status == 400
+    assert "question" in missing["error"]
+
+
+def test_schema_lists_tables_and_rejects_unknown(db_uri, monkeypatch):
+    async def schema(client):
+        response = await client.get("/schema")
+        return response.status, await response.json()
+
+    async def unknown(client):
+        response = await client.get("/schema", params={"tables": "clientes,nao_existe"})
+        return response.status, await response.json()
+
+    [(status, body), (unknown_status, error)] = _run(db_uri, monkeypatch, [schema, unknown])
+    assert status == 200
+    assert body["dialect"] == "sqlite"
+    assert body["tables"] == ["clientes"]
+    assert "CREATE TABLE clientes" in body["table_info"]
+    assert body["schema_fingerprint"]
+    assert unknown_status == 404
+    assert "nao_existe" in error["error"]
+
+
+def test_health_and_metrics(db_uri, monkeypatch):
+    async def health(client):
+        response = await client.get("/health")
+        return response.status, await response.json()
+
+    async def generate(client):
+        response = await client.post("/generate", json={"question": "Liste os clientes"})
+        return response.status
+
+    async def metrics(client):
+        response = await client.get("/metrics")
+        return response.status, response.content_type, await response.text()
+
+    [(status, body), generated, (metrics_status, content_type, text)] = _run(
+        db_uri, monkeypatch, [health, generate, metrics], llm=CannedSQLLLM(responses=RESPONSES), concurrency=2
+    )
+    assert status == 200
+    assert body["status"] == "ok"
+    assert body["database"] == "ok"
+    assert body["requests"] == {"active": 0, "waiting": 0, "rejected": 0, "limit": 2}
+    assert body["pool"]["checked_out"] == 0
+    assert generated == 200
+    assert metrics_status == 200
+    assert content_type == "text/plain"
+    assert 'text_to_sql_stage_duration_seconds_count{kind="generation",stage="llm"}' in text
+
+
+def test_concurrency_limiter_queues_then_rejects(db_uri, monkeypatch):
+    llm = CannedSQLLLM(responses=RESPONSES, latency=0.3)
+
+    def concurrent(n):
+        async def requests(client):
+            responses = await asyncio.gather(*[
+                client.post("/generate", json={"question": "Liste os clientes"}) for _ in range(n)
+            ])
+            health = await (await client.get("/health")).json()
+            return sorted(response.status for response in responses), health["requests"]
+        return requests
+
+    # Com espera suficiente, as requisições além do limite aguardam na fila e são atendidas.
+    [(statuses, requests)] = _run(db_uri, monkeypatch, [concurrent(3)], llm=llm, concurrency=1, queue_timeout=5)
+    assert statuses == [200, 200, 200]
+    assert requests["rejected"] == 0
+    # Sem espera suficiente, quem não obtém uma vaga recebe 503.
+    [(statuses, requests)] = _run(db_uri, monkeypatch, [concurrent(3)], llm=llm, concurrency=1, queue_timeout=0.05)
+    assert statuses == [200, 503, 503]
+    assert requests == {"active": 0, "waiting": 0, "rejected": 2, "limit": 1}
+
+
+@pytest.mark.parametrize("payload", [
+    {"sql": "DELETE FROM clientes"},
+    {"sql": "WITH x AS (DELETE FROM clientes RETURNING *) SELECT * FROM x"},
+    {"sql": "SELECT * INTO copia FROM clientes"},
+    {"question": "Apague os clientes"},
+])
+def test_execute_rejects_non_read_sql(db_uri, monkeypatch, payload):
+    async def execute(client):
+        response = await client.post("/execute", json=payload)
+        return response.status, await response.json()
+
+    [(status, body)] = _run(db_uri, monkeypatch, [execute], llm=CannedSQLLLM(responses=RESPONSES))
+    assert status == 403
+    assert "leitura" in body["error"]
+    assert body["sql"].rstrip(";").split() == payload.get("sql", "DELETE FROM clientes").split()
+    assert _count_rows(db_uri) == 20
+    assert pool_stats(db_uri)["checked_out"] == 0
+
+
+def test_execute_question_runs_generated_sql(db_uri, monkeypatch):
+    async def execute(client):
+        response = await client.post("/execute", json={"question": "Liste os clientes"})
+        return response.status, await response.json()
+
+    [(status, body)] = _run(db_uri, monkeypatch, [execute], llm=CannedSQLLLM(responses=RESPONSES))
+    assert status == 200
+    assert body["columns"] == ["nome"]
+    assert body["rows"] == [["cliente 0"], ["cliente 1"], ["cliente 2"]]
+    assert body["generated"]["from_cache"] is False
@@ -0,0 +1,64 @@
+import pytest
+
+from sql_stream import SQLStatementExtractor
+
+# Tamanhos de trecho usados para simular o streaming (None = saída inteira de uma vez).
+CHUNK_SIZES = (None, 1, 2, 3, 7)
+
+
+def extract(text, chunk_size):
+    extractor = SQLStatementExtractor()
+    chunks = [text] if chunk_size is None else [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    for chunk in chunks:
+        if extractor.feed(chunk):
+            break
+    return extractor.finish(), extractor.reason
+
+
+CASES = [
+    # Aspas, escapes e ';' dentro de strings.
+    ("SELECT 'a;b' FROM t; depois", "SELECT 'a;b' FROM t;", "semicolon"),
+    ("SELECT 'it''s; ok' FROM t;", "SELECT 'it''s; ok' FROM t;", "semicolon"),
+    ("SELECT 'a\\';b' FROM t;", "SELECT 'a\\';b' FROM t;", "semicolon"),
+    ('SELECT "col;x" FROM t;', 'SELECT "col;x" FROM t;', "semicolon"),
+    ("SELECT `a;b` FROM t;", "SELECT `a;b` FROM t;", "semicolon"),
+    # ';' dentro de comentários.
+    ("SELECT 1 -- fim; não\nFROM t;", "SELECT 1 -- fim; não\nFROM t;", "semicolon"),
+    ("SELECT /* ; */ 1 FROM t;", "SELECT /* ; */ 1 FROM t;", "semicolon"),
+    ("SELECT a\n# filtro; it's\nFROM t;", "SELECT a\n# filtro; it's\nFROM t;", "semicolon"),
+    # Cercas Markdown.
+    ("```sql\nSELECT 1\n```\nExplicação", "SELECT 1", "fence"),
+    ("Aqui está a consulta:\n```sql\nSELECT a\n\nFROM t\n```", "SELECT a\n\nFROM t", "fence"),
+    # Linha em branco seguida de comentário ou palavra-chave: o comando continua.
+    ("DELETE FROM pedidos\n\n-- apenas os antigos\nWHERE data < '2020-01-01';",
+     "DELETE FROM pedidos\n\n-- apenas os antigos\nWHERE data < '2020-01-01';", "semicolon"),
+    ("SELECT a\nFROM t\n\n/* filtro */\nWHERE x = 1", "SELECT a\nFROM t\n\n/* filtro */\nWHERE x = 1", "end"),
+    ("SELECT a\nFROM t\n\n# filtro\nWHERE x = 1\n", "SELECT a\nFROM t\n\n# filtro\nWHERE x = 1", "end"),
+    ("SELECT a FROM t\n\nUNION ALL\nSELECT b FROM u;", "SELECT a FROM t\n\nUNION ALL\nSELECT b FROM u;", "semicolon"),
+    ("SELECT a,\n\nb FROM t", "SELECT a,\n\nb FROM t", "end"),
+    ("SELECT a FROM t WHERE x IN (\n\n1, 2)", "SELECT a FROM t WHERE x IN (\n\n1, 2)", "end"),
+    # Prosa após uma linha em branco encerra leituras.
+    ("SELECT a\nFROM t\n\nEsta consulta retorna a coluna a.\n", "SELECT a\nFROM t", "balanced"),
+    ("SELECT a FROM t\n\n**Explicação:** retorna a.\n", "SELECT a FROM t", "balanced"),
+    ("SELECT a FROM t\n\n# Explicação\n\nA consulta retorna a.\n", "SELECT a FROM t", "balanced"),
+    # Comandos de escrita nunca são encerrados pela heurística da linha em branco.
+    ("UPDATE t SET a = 1\n\nEsta consulta atualiza t.\n", "UPDATE t SET a = 1\n\nEsta consulta atualiza t.", "end"),
+    ("WITH x AS (DELETE FROM t RETURNING *)\nSELECT * FROM x\n\nIsso apaga t.\n",
+     "WITH x AS (DELETE FROM t RETURNING *)\nSELECT * FROM x\n\nIsso apaga t.", "end"),
+    # Fim da geração.
+    ("SELECT 1", "SELECT 1", "end"),
+]
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("text, expected_sql, expected_reason", CASES)
+def test_extractor(text, expected_sql, expected_reason, chunk_size):
+    assert extract(text, chunk_size) == (expected_sql, expected_reason)
+
+
+def test_extractor_waits_for_first_complete_word():
+    extractor = SQLStatementExtractor()
+    assert not extractor.feed("SEL")
+    assert extractor.sql == ""
+    assert extractor.feed("ECT 1;")
+    assert extractor.sql == "SELECT 1;"
@@ -1,123 +1,443 @@
 import streamlit as st
-import mysql.connector
-import psycopg2
-# Usado pela biblioteca LangChain para se conectar com o banco de dados.
-from sqlalchemy import create_engine
-# Ferramenta da LangChain que se conecta ao banco de dados e extrai informações sobre schema (tabelas, colunas).
-from langchain_community.utilities import SQLDatabase
-# Classe da LangChain para interagir com os modelos de linguagem da Google, como o Gemini.
-from langchain_google_genai import ChatGoogleGenerativeAI
-# Função da LangChain que constrói a "cadeia" responsável por converter texto em SQL.
-from langchain.chains import create_sql_query_chain
-# Lógica de Prompt
-from langchain_core.prompts import PromptTemplate
-# Biblioteca para manipulação de dados, usada para exibir os resultados em uma tabela formatada.
-import pandas as pd
+# Os drivers (mysql-connector, psycopg2) não são importados aqui: o SQLAlchemy carrega apenas o
+# driver da DSN selecionada ao criar o pool. A LangChain/Gemini e o pandas também são importados
+# sob demanda (na inicialização do motor e na exibição de resultados), reduzindo a partida a frio.
+# Usado para montar a URI de conexão do SQLAlchemy (a mesma usada pela LangChain).
+from sqlalchemy.engine import URL
 # Módulo do Python para interagir com o sistema operacional, usado para buscar a chave da API do ambiente.
 import os
-# Módulo de expressões regulares, essencial para limpar e formatar a saída de texto da IA.
-import re
+# Usado para medir a duração das etapas instrumentadas.
+import time
+# Identificador da sessão no registro de recursos compartilhados.
+import uuid
+# Cache de geração NL -> SQL (memória + SQLite), compartilhado entre sessões.
+from generation_cache import get_generation_cache
+# Número padrão de tabelas enviadas ao LLM pela poda do schema (índice BM25).
+from schema_index import DEFAULT_TOP_N
+# Motor Text-to-SQL sem Streamlit (prompt, cadeia, geração em streaming e limpeza do SQL), compartilhado com
+# o modo headless e o serviço HTTP.
+from text_to_sql_engine import build_sql_chain, build_text_to_sql_engine, chain_llm, generate_sql
+# Leitura de resultados em streaming (cursores do lado do servidor, fetchmany e paginação).
+from result_fetch import (
+    DEFAULT_MAX_ROWS, DEFAULT_PAGE_SIZE, ResultStream, estimate_row_bytes, is_read_query, open_streaming_cursor
+)
+# Pool de conexões por DSN, compartilhado pela LangChain e pela execução das consultas.
+from connection_pool import checkout_connection, dispose_engine, get_engine, pool_stats, pooled_connection
+# Conversão colunar (Arrow) dos resultados e exportação em CSV/Parquet.
+from columnar import EXPORT_FORMATS, export_cursor, rows_to_dataframe
+# Refinamento local (SQLite em memória) sobre os últimos resultados da sessão.
+from followup import FollowupStore
+# Registro de recursos compartilhados entre sessões, com referências por sessão e descarte por ociosidade.
+from resource_registry import get_resource_registry, resource_key
+# Cache de resultados de leitura por SQL normalizado e DSN, invalidado por escritas confirmadas.
+from result_cache import CachedRowsCursor, get_result_cache, modified_tables, normalize_sql
+# Instrumentação de latência por etapa (traces, histogramas Prometheus e log JSONL).
+from metrics import RequestTrace, get_metrics_registry, start_metrics_server
+# Estimativa de custo (EXPLAIN), timeout no servidor e cancelamento das consultas em execução.
+from query_guard import (
+    DEFAULT_GUARD_ACTION, DEFAULT_GUARD_LIMIT, DEFAULT_MAX_COST, DEFAULT_MAX_ESTIMATED_ROWS, DEFAULT_STATEMENT_TIMEOUT,
+    QUERY_GUARD_MEMO_SIZE, GuardDecision, QueryCancelled, db_type_from_uri, get_active_queries, guard_query,
+    run_cancellable, set_statement_timeout,
+)
 
 # Funções de Conexão com o Banco de Dados 
-def connect_to_mysql(host, user, password, database):
+def build_db_uri(db_type, host, user, password, database, port=None):
     """
-    Tenta estabelecer uma conexão com um banco de dados MySQL.
-    Retorna o objeto de conexão se bem-sucedido, ou None em caso de falha.
+    Monta a URI SQLAlchemy do banco de dados, escapando usuário e senha.
     """
-    try:
-        conn = mysql.connector.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database
-        )
-        return conn
-    except mysql.connector.Error as err:
-        # Exibe uma mensagem de erro no Streamlit se a conexão falhar.
-        st.error(f"Falha ao conectar ao MySQL: {err}")
-        return None
+    drivername = "mysql+mysqlconnector" if db_type == "mysql" else "postgresql+psycopg2"
+    url = URL.create(drivername, username=user, password=password, host=host,
+                     port=int(port) if port else None, database=database)
+    return url.render_as_string(hide_password=False)
 
-def connect_to_postgresql(host, user, password, database, port=5432):
+def db_errors(db_uri):
     """
-    Tenta estabelecer uma conexão com um banco de dados PostgreSQL.
-    Retorna o objeto de conexão se bem-sucedido, ou None em caso de falha.
+    Classe base de erros (DB-API) do driver da DSN, importado pelo SQLAlchemy ao criar o pool.
+    """
+    return get_engine(db_uri).dialect.loaded_dbapi.Error
+
+def connect_to_database(db_uri, db_type):
+    """
+    Valida a conexão emprestando (e devolvendo) uma conexão do pool compartilhado da DSN.
+    Retorna True se bem-sucedido, ou False em caso de falha.
     """
     try:
-        conn = psycopg2.connect(
-            host=host,
-            user=user,
-            password=password,
-            database=database,
-            port=port
-        )
-        return conn
-    except psycopg2.Error as err:
+        with pooled_connection(db_uri):
+            pass
+        return True
+    except Exception as err:
         # Exibe uma mensagem de erro no Streamlit se a conexão falhar.
-        st.error(f"Falha ao conectar ao PostgreSQL: {err}")
-        return None
+        nome = "MySQL" if db_type == "mysql" else "PostgreSQL"
+        st.error(f"Falha ao conectar ao {nome}: {getattr(err, 'orig', None) or err}")
+        return False
 
 # Inicialização do Motor Text-to-SQL
-@st.cache_resource(show_spinner="Inicializando LLM...")
-def initialize_text_to_sql_gemini(_db_uri, google_api_key, db_dialect):
+def initialize_text_to_sql_gemini(db_uri, google_api_key, owner):
     """
     Prepara e inicializa a cadeia Text-to-SQL usando a API do Google Gemini.
-    Esta função é cacheada pelo Streamlit para evitar recargas desnecessárias do modelo.
+    O motor fica no registro de recursos compartilhado, indexado pela DSN (sem senha) e pelo hash da
+    API key: sessões conectadas ao mesmo banco com a mesma chave reaproveitam o mesmo motor já carregado,
+    e owner (a sessão) mantém uma referência a ele até desconectar.
     """
-    try:
-        # Cria um objeto SQLDatabase da LangChain a partir da URI do banco de dados.
-        # sample_rows_in_table_info=5 ajuda o LLM a entender o conteúdo das tabelas.
-        db = SQLDatabase.from_uri(_db_uri, sample_rows_in_table_info=5)
-        
+    def build_engine():
+        # Classe da LangChain para interagir com os modelos de linguagem da Google, como o Gemini.
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
         # Inicializa o modelo Gemini-1.5-flash-latest com a chave da API.
         # temperature=0.0 é usado para tornar as respostas do LLM mais determinísticas e menos criativas.
         llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", google_api_key=google_api_key, temperature=0.0)
+        return build_text_to_sql_engine(db_uri, llm)
+
+    try:
+        with st.spinner("Inicializando LLM..."):
+            return get_resource_registry().acquire(
+                resource_key(db_uri, google_api_key), owner, build_engine,
+                size_of=lambda engine: engine[4].estimated_bytes(),
+                # O pool da DSN é fechado quando nenhum motor que o usa permanece no registro.
+                group=db_uri, on_group_evicted=lambda: dispose_engine(db_uri),
+            )
+    except Exception as e:
+        # Em caso de erro na inicialização, exibe mensagens de erro e retorna None.
+        st.error(f"ERRO FATAL: Ao inicializar Text-to-SQL: {e}")
+        st.error("Verifique se sua GOOGLE_API_KEY está correta e se a URI do banco está acessível.")
+        return None, None, [], None, None, None
 
-        # INÍCIO DA LÓGICA DE PROMPT
-        PROMPT_TEMPLATE = """Você é um tradutor de linguagem natural para SQL. Sua tarefa é gerar uma consulta SQL para responder a uma pergunta do usuário, com base no schema do banco de dados fornecido.
+# Fecha o resultado em streaming da sessão, liberando o cursor no servidor.
+def close_result_stream():
+    """
+    Fecha e remove do estado da sessão o resultado paginado ativo, se houver.
+    """
+    stream = st.session_state.get("result_stream")
+    if stream is not None:
+        stream.close()
+        del st.session_state["result_stream"]
 
-**Instruções Cruciais:**
-1.  Gere a consulta SQL no dialeto **{dialect}**.
-2.  A consulta DEVE ser funcional e sintaticamente correta para o dialeto especificado.
-3.  **Certifique-se de que todas as condições de JOIN sejam válidas e baseadas em colunas existentes em AMBAS as tabelas unidas.**
-4.  **Sempre utilize aliases (AS) para colunas de mesmo nome que venham de tabelas diferentes, para evitar duplicidade no resultado (ex: SELECT t1.nome AS nome_tabela1, t2.nome AS nome_tabela2).**
-5.  **NÃO** inclua explicações, comentários, formatação markdown (como ```sql) ou qualquer texto além da consulta SQL pura. Responda **APENAS** com a consulta SQL.
-6.  Para consultas que retornam várias linhas (SELECT), inclua sempre a cláusula LIMIT {top_k} para limitar o número de resultados.
-7.  Certifique-se de que todas as tabelas e colunas referenciadas existam no schema fornecido.
+# Função de Cancelamento de Consultas
+def cancel_query_st(query_id, sql_query=None):
+    """
+    Cancela no servidor a consulta em execução e, se sql_query for informado, marca o SQL para
+    não ser reexecutado automaticamente na próxima reexecução do script.
+    """
+    get_active_queries().cancel(query_id)
+    if sql_query is not None:
+        st.session_state.cancelled_sql = sql_query
 
-**Schema da Tabela:**
-{table_info}
+def run_cancellable_query_st(conn, db_type, db_uri, sql_query, run, on_wait=None, mark_cancelled=True):
+    """
+    Executa run() em segundo plano enquanto exibe o tempo decorrido e um botão para cancelar a consulta.
+    O clique (ou qualquer outra interação que reexecute o script) interrompe a espera e cancela a consulta
+    no servidor. on_wait(), se informado, é chamado a cada verificação durante a espera.
+    Com mark_cancelled, a consulta cancelada pelo botão não é reexecutada automaticamente.
+    """
+    registry = get_active_queries()
+    query_id = registry.register(conn, db_type, db_uri, sql_query)
+    status = st.empty()
+    cancel_slot = st.empty()
+    shown = []
 
-**Pergunta do Usuário:**
-{input}
+    def show_progress(elapsed):
+        if on_wait is not None:
+            on_wait()
+        status.caption(f"Executando consulta... {elapsed:.1f}s")
+        if not shown:
+            cancel_slot.button("Cancelar consulta", key=f"cancel_query_{query_id}",
+                               on_click=cancel_query_st, args=(query_id, sql_query if mark_cancelled else None))
+            shown.append(True)
 
-**Consulta SQL:**
-"""
-        
-        # Cria um objeto PromptTemplate a partir do template definido, especificando as variáveis de entrada.
-        prompt = PromptTemplate(
-            input_variables=["input", "table_info", "dialect", "top_k"], 
-            template=PROMPT_TEMPLATE
-        )
-        # FIM DA LÓGICA DE PROMPT
-        
-        # Obtém os nomes das tabelas que o LLM pode usar, a partir do objeto SQLDatabase.
-        usable_tables = db.get_usable_table_names()
-        
-        # Cria a cadeia de Text-to-SQL usando o LLM, o objeto SQLDatabase e o prompt customizado.
-        sql_query_chain = create_sql_query_chain(llm, db, prompt=prompt)
-        
-        return sql_query_chain, db, usable_tables
+    try:
+        return run_cancellable(registry, query_id, run, on_wait=show_progress)
+    finally:
+        registry.unregister(query_id)
+        status.empty()
+        cancel_slot.empty()
+
+# Função de Verificação de Custo
+def evaluate_query_guard_st(db_uri, db_type, sql_query, trace=None, memo_only=False):
+    """
+    Estima o custo da consulta com EXPLAIN e decide se ela será executada como está, reescrita com
+    LIMIT ou bloqueada, conforme os limites configurados na barra lateral.
+    As decisões ficam memorizadas na sessão por consulta e limites (as QUERY_GUARD_MEMO_SIZE mais recentes).
+    Com memo_only, apenas consulta a memória (sem EXPLAIN) e retorna None se a decisão não estiver lá.
+    """
+    sql_query = sql_query.strip().rstrip(";").rstrip()
+    limits = (
+        st.session_state.get("guard_max_cost", DEFAULT_MAX_COST),
+        st.session_state.get("guard_max_rows", DEFAULT_MAX_ESTIMATED_ROWS),
+        st.session_state.get("guard_action", DEFAULT_GUARD_ACTION),
+        st.session_state.get("guard_limit", DEFAULT_GUARD_LIMIT),
+    )
+    memo_key = (db_uri, sql_query, limits)
+    memo = st.session_state.setdefault("query_guard_memo", {})
+    if memo_key in memo or memo_only:
+        return memo.get(memo_key)
+
+    started = time.perf_counter()
+    try:
+        with pooled_connection(db_uri) as conn:
+            decision = guard_query(conn, db_type or db_type_from_uri(db_uri), sql_query, *limits)
     except Exception as e:
-        # Em caso de erro na inicialização, exibe mensagens de erro e retorna None.
-        st.error(f"ERRO FATAL: Ao inicializar Text-to-SQL: {e}")
-        st.error("Verifique se sua GOOGLE_API_KEY está correta e se a URI do banco está acessível.")
-        return None, None, []
+        decision = GuardDecision("skip", sql_query, reason=f"Não foi possível estimar o custo: {e}")
+    if trace is not None:
+        trace.add_stage("cost_guard", time.perf_counter() - started, action=decision.action)
+    memo[memo_key] = decision
+    while len(memo) > QUERY_GUARD_MEMO_SIZE:
+        memo.pop(next(iter(memo)))  # Descarta a decisão mais antiga.
+    return decision
+
+def _format_estimate(estimate):
+    cost = f"custo {estimate.total_cost:,.1f}" if estimate.total_cost is not None else "custo indisponível"
+    rows = f"{estimate.rows:,.0f} linha(s)" if estimate.rows is not None else "linhas indisponíveis"
+    return f"{cost}, {rows}"
+
+def display_cost_estimate_st(decision):
+    """
+    Exibe a estimativa do otimizador para o SQL gerado e o que acontecerá na execução.
+    """
+    if decision.estimate is None:
+        st.caption(decision.reason)
+        return
+    st.caption(f"Estimativa do otimizador: {_format_estimate(decision.estimate)}.")
+    if decision.action == "rewrite":
+        st.warning(f"Acima dos limites de execução ({decision.reason}). A consulta será executada com "
+                   f"LIMIT {st.session_state.get('guard_limit', DEFAULT_GUARD_LIMIT)} "
+                   f"({_format_estimate(decision.rewritten_estimate)}).")
+    elif decision.action == "reject":
+        st.error(f"Acima dos limites de execução ({decision.reason}). A execução será bloqueada.")
+
+# Função de Exibição de Resultados em Streaming
+def display_streamed_results_st(db_uri, db_type, sql_query, trace=None):
+    """
+    Executa uma consulta de leitura com cursor em streaming e exibe os resultados página a página.
+    A primeira página é renderizada assim que o primeiro lote chega; as páginas seguintes
+    são buscadas sob demanda, mantendo em memória apenas a página atual.
+    A conexão é emprestada do pool e devolvida quando o resultado é esgotado ou fechado.
+    Resultados completos ficam no cache de resultados compartilhado; uma consulta já armazenada
+    é paginada a partir da memória, sem acessar o banco. Também são guardados no motor de
+    refinamento local da sessão, quando existe.
+    As etapas de uma nova execução são registradas no trace informado.
+    """
+    trace = trace if trace is not None else RequestTrace("execution")
+    stream = st.session_state.get("result_stream")
+    placeholder = st.empty()
+    fresh_execution = False
+    cached = None
+    result_cache = get_result_cache()
+    # Resultados lidos por completo também ficam disponíveis para refinamento local.
+    followup_store = st.session_state.get("followup_store")
+    question = st.session_state.get("generated_question")
+
+    # Reaproveita o resultado paginado da mesma consulta entre reexecuções do script.
+    if stream is None or stream.sql_query != sql_query:
+        close_result_stream()
+        fresh_execution = True
+        with trace.stage("result_cache") as stage:
+            cached = result_cache.get(db_uri, sql_query)
+            stage["hit"] = cached is not None
+    if fresh_execution and cached is not None:
+        stream = ResultStream(
+            None, CachedRowsCursor(cached), sql_query,
+            page_size=st.session_state.get("page_size", DEFAULT_PAGE_SIZE),
+            max_rows=st.session_state.get("max_rows", DEFAULT_MAX_ROWS),
+            from_cache=True,
+        )
+        st.session_state.result_stream = stream
+        if followup_store is not None:
+            followup_store.add_result(cached.columns, cached.rows, sql_query, question)
+        with trace.stage("db_fetch") as stage:
+            stream.fetch_page()
+            stage.update(rows=len(stream.page_rows), bytes=stream.page_bytes)
+    elif fresh_execution:
+        # Lido antes da execução: uma escrita confirmada durante a leitura impede o armazenamento.
+        cache_epoch = result_cache.epoch(db_uri)
+        with trace.stage("pool_checkout"):
+            conn = checkout_connection(db_uri)
+        stream = None
+        first_batch = {}
+
+        # Chamada pela thread da consulta: usa apenas objetos obtidos antes, sem acessar st.session_state.
+        def on_complete(columns, rows):
+            result_cache.put(db_uri, sql_query, columns, rows, epoch=cache_epoch)
+            if followup_store is not None:
+                followup_store.add_result(columns, rows, sql_query, question)
+
+        # Executada em segundo plano: o primeiro lote é guardado e exibido pela espera na thread do script.
+        def run_query():
+            with trace.stage("db_execute"):
+                stream.execute(sql_query)
+            with trace.stage("db_fetch") as stage:
+                stream.fetch_page(on_first_batch=lambda columns, rows: first_batch.update(columns=columns, rows=rows))
+                stage.update(rows=len(stream.page_rows), bytes=stream.page_bytes)
+
+        def show_first_batch():
+            if "rows" in first_batch and not first_batch.get("shown"):
+                placeholder.dataframe(rows_to_dataframe(first_batch["columns"], first_batch["rows"]))
+                first_batch["shown"] = True
+
+        try:
+            set_statement_timeout(conn, db_type, st.session_state.get("statement_timeout", DEFAULT_STATEMENT_TIMEOUT))
+            stream = ResultStream(
+                conn, open_streaming_cursor(conn, db_type, sql_query), sql_query,
+                page_size=st.session_state.get("page_size", DEFAULT_PAGE_SIZE),
+                max_rows=st.session_state.get("max_rows", DEFAULT_MAX_ROWS),
+                owns_connection=True,
+                capture_bytes=result_cache.max_entry_bytes,
+                on_complete=on_complete,
+            )
+            run_cancellable_query_st(conn, db_type, db_uri, sql_query, run_query, on_wait=show_first_batch)
+            st.session_state.result_stream = stream
+        except QueryCancelled:
+            placeholder.empty()
+            st.warning("Consulta cancelada.")
+            stream.close() # Descarta o cursor e devolve a conexão ao pool.
+            return
+        except db_errors(db_uri) as err:
+            st.error(f"ERRO ao executar a consulta SQL: {err}")
+            st.error(f"SQL com problema: {sql_query}")
+            try:
+                conn.rollback()
+                st.warning("A transação foi revertida (rollback) devido ao erro.")
+            except db_errors(db_uri) as rb_err:
+                st.error(f"Falha adicional ao tentar reverter a transação: {rb_err}")
+            # Devolve a conexão ao pool.
+            if stream is not None:
+                stream.close()
+            else:
+                conn.close()
+            return
+        except BaseException:
+            # Script interrompido durante a execução (ex: reexecução do Streamlit): libera a conexão.
+            if stream is not None:
+                stream.close()
+            else:
+                conn.close()
+            raise
+
+    if not stream.page_rows:
+        placeholder.empty()
+        if stream.page_number <= 1:
+            st.info("A consulta foi executada com sucesso, mas não retornou resultados.")
+        else:
+            st.info("Fim do resultado: não há mais linhas.")
+        return
+
+    st.success("Resultados da Consulta:")
+    started = time.perf_counter()
+    df = rows_to_dataframe(stream.columns, stream.page_rows)
+    if fresh_execution:
+        trace.add_stage("dataframe", time.perf_counter() - started,
+                        rows=len(df), bytes=int(df.memory_usage(deep=False).sum()))
+    placeholder.dataframe(df)
+    first_row = stream.page_start + 1
+    last_row = stream.page_start + len(stream.page_rows)
+    st.caption(f"Página {stream.page_number}: linhas {first_row} a {last_row}."
+               + (" Resultado obtido do cache de resultados." if stream.from_cache else ""))
+    if stream.truncated:
+        st.warning(f"Limite de {stream.max_rows} linhas atingido; a leitura do resultado foi interrompida.")
+    if stream.expired:
+        st.info(f"Resultado sem leitura por mais de {stream.idle_timeout:.0f} s: o cursor foi fechado e a conexão "
+                "devolvida ao pool. Volte à primeira página para executar a consulta novamente.")
+
+    # Controles de paginação: a próxima página é lida do cursor aberto; a primeira exige reexecutar.
+    col_first, col_next = st.columns(2)
+    with col_first:
+        st.button("Primeira página", on_click=close_result_stream, disabled=stream.page_number <= 1 and not stream.expired,
+                  key="first_page_button")
+    with col_next:
+        st.button("Próxima página", on_click=stream.fetch_page, disabled=not stream.has_more,
+                  key="next_page_button")
+
+    # Exportação do resultado completo (não apenas da página exibida), lido novamente do banco.
+    col_format, col_export = st.columns(2)
+    with col_format:
+        export_format = st.selectbox("Formato", list(EXPORT_FORMATS), format_func=str.upper, key="export_format")
+    with col_export:
+        if st.button("Exportar resultado completo", key="export_button"):
+            export_results_st(db_uri, db_type, sql_query, export_format)
+    display_export_download_st(sql_query)
+
+# Função de Exportação de Resultados
+def remove_export_file():
+    """
+    Apaga o arquivo exportado da sessão, se houver.
+    """
+    export = st.session_state.pop("export_file", None)
+    if export is not None:
+        try:
+            os.remove(export["path"])
+        except OSError:
+            pass
+
+def export_results_st(db_uri, db_type, sql_query, fmt):
+    """
+    Executa a consulta em uma conexão emprestada do pool, com cursor em streaming, e grava o resultado
+    completo em um arquivo temporário (CSV ou Parquet) lote a lote, sem mantê-lo em memória.
+    """
+    remove_export_file()
+    conn = checkout_connection(db_uri)
+    cursor = None
+    try:
+        set_statement_timeout(conn, db_type, st.session_state.get("statement_timeout", DEFAULT_STATEMENT_TIMEOUT))
+        cursor = open_streaming_cursor(conn, db_type, sql_query)
+
+        def run_export():
+            cursor.execute(sql_query)
+            return export_cursor(cursor, fmt)
+
+        path, rows, truncated = run_cancellable_query_st(conn, db_type, db_uri, sql_query, run_export,
+                                                         mark_cancelled=False)
+        st.session_state.export_file = {"sql": sql_query, "format": fmt, "path": path, "rows": rows,
+                                        "truncated": truncated}
+    except QueryCancelled:
+        st.warning("Exportação cancelada.")
+    except (db_errors(db_uri), OSError, ValueError) as err:
+        st.error(f"ERRO ao exportar o resultado: {err}")
+    finally:
+        try:
+            # Cursores não bufferizados do MySQL exigem consumir as linhas não lidas antes de fechar.
+            consume_results = getattr(conn, "consume_results", None)
+            if consume_results is not None:
+                consume_results()
+            if cursor is not None:
+                cursor.close()
+            conn.rollback()
+        except Exception:
+            pass
+        conn.close() # Devolve a conexão ao pool.
+
+def display_export_download_st(sql_query):
+    """
+    Oferece o download do arquivo exportado para a consulta atual.
+    O arquivo só é lido quando o usuário clica no botão (não a cada rerun), mas o Streamlit
+    ainda o carrega inteiro na memória do servidor para servir o download.
+    """
+    export = st.session_state.get("export_file")
+    if export is None or export["sql"] != sql_query or not os.path.exists(export["path"]):
+        return
+    extension, mime = EXPORT_FORMATS[export["format"]]
+    path = export["path"]
+
+    def read_export():
+        with open(path, "rb") as f:
+            return f.read()
+
+    st.download_button(f"Baixar {export['format'].upper()}", data=read_export, file_name=f"resultado.{extension}",
+                       mime=mime, key="download_export_button")
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    st.caption(f"{export['rows']} linha(s) exportada(s), {size_mb:.1f} MB."
+               + (" Limite de linhas da exportação atingido." if export["truncated"] else "")
+               + " O download é carregado inteiro na memória do servidor"
+               " (limite de linhas: TEXT_TO_SQL_EXPORT_MAX_ROWS).")
 
 # Função de Execução e Exibição de Resultados
-def execute_and_display_results_st(cursor, sql_query):
+def execute_and_display_results_st(db_uri, sql_query, db_type=None):
     """
     Executa a consulta SQL fornecida no banco de dados e exibe os resultados no Streamlit.
     Lida com consultas SELECT (exibindo dados em DataFrame) e outras consultas (informando sucesso/linhas afetadas).
+    Consultas de leitura são lidas em streaming e paginadas; os demais comandos usam uma conexão
+    emprestada do pool apenas durante a execução (e o commit, quando há modificação).
+    Antes da execução, a estimativa de custo (EXPLAIN) pode bloquear a consulta ou reescrevê-la com LIMIT,
+    e toda execução recebe um timeout no servidor e pode ser cancelada.
+    As etapas de cada execução são registradas nas métricas e em st.session_state.execution_trace.
     """
     if not sql_query or not sql_query.strip():
         st.warning("Nenhuma consulta SQL para executar.")
@@ -125,102 +445,225 @@ def execute_and_display_results_st(cursor, sql_query):
     
     # Remove o ponto e vírgula
     sql_query = sql_query.rstrip(';')
-    
+    db_type = db_type or db_type_from_uri(db_uri)
+
+    trace = RequestTrace("execution")
     try:
-        cursor.execute(sql_query) # Executa a consulta SQL.
-        if cursor.description: # Verifica se a consulta retornou resultados (geralmente SELECT).
-            column_names = [desc[0] for desc in cursor.description] # Obtém os nomes das colunas.
-            results = cursor.fetchall() # Busca todos os resultados.
-            if results:
-                st.success("Resultados da Consulta:")
-                df = pd.DataFrame(results, columns=column_names) # Cria um dataframe do pandas para exibição formatada.
-                st.dataframe(df) # Exibe o dataframe.
-            else:
-                st.info("A consulta foi executada com sucesso, mas não retornou resultados.")
-        else: # Se não houver descrição, geralmente é uma consulta de modificação (INSERT, UPDATE, DELETE).
-            if hasattr(cursor, 'rowcount') and cursor.rowcount is not None and cursor.rowcount > -1:
-                 st.success(f"Comando SQL executado com sucesso. {cursor.rowcount} linha(s) afetada(s).")
+        decision = evaluate_query_guard_st(db_uri, db_type, sql_query, trace=trace)
+        if decision.action == "reject":
+            st.error(f"Execução bloqueada pelos limites de custo: {decision.reason}")
+            return
+        if decision.action == "rewrite":
+            st.warning(f"Executando a consulta reescrita com LIMIT: {decision.sql}")
+            sql_query = decision.sql
+        # Uma consulta cancelada não é reexecutada automaticamente nas reexecuções do script.
+        if st.session_state.get("cancelled_sql") == sql_query:
+            st.warning("Consulta cancelada. Desmarque e marque a confirmação para executá-la novamente.")
+            return
+
+        if is_read_query(sql_query):
+            display_streamed_results_st(db_uri, db_type, sql_query, trace=trace)
+        else:
+            # Memoização por sessão: uma reexecução do script não executa de novo o mesmo comando.
+            memo_key = (db_uri, normalize_sql(sql_query))
+            memo = st.session_state.get("statement_memo")
+            if memo is not None and memo["key"] == memo_key:
+                _display_statement_outcome_st(memo["outcome"])
             else:
-                st.success("Comando SQL executado com sucesso (sem resultados para exibir ou número de linhas afetadas indisponível).")
-    except (mysql.connector.Error, psycopg2.Error) as err:
-        # Captura erros específicos do banco de dados.
-        st.error(f"ERRO ao executar a consulta SQL: {err}")
-        st.error(f"SQL com problema: {sql_query}")
+                outcome = _execute_statement_st(db_uri, db_type, sql_query, trace)
+                st.session_state.statement_memo = {"key": memo_key, "outcome": outcome}
+    finally:
+        # Reexecuções do script que apenas reexibem um resultado não geram etapas novas.
+        if trace.stages:
+            get_metrics_registry().observe(trace)
+            st.session_state.execution_trace = trace
+
+def _display_statement_outcome_st(outcome):
+    """
+    Reexibe o resultado de um comando já executado nesta sessão, sem executá-lo novamente.
+    """
+    if outcome.get("error"):
+        st.error(f"ERRO ao executar a consulta SQL: {outcome['error']}")
+    elif outcome.get("rows"):
+        st.success("Resultados da Consulta:")
+        st.dataframe(rows_to_dataframe(outcome["columns"], outcome["rows"]))
+    elif outcome.get("rowcount") is not None:
+        st.success(f"Comando SQL executado com sucesso. {outcome['rowcount']} linha(s) afetada(s).")
+    else:
+        st.success("Comando SQL executado com sucesso.")
+    st.info("Este comando já foi executado nesta sessão. Desmarque a confirmação para executá-lo novamente.")
+
+def _execute_statement_st(db_uri, db_type, sql_query, trace):
+    """
+    Executa um comando que não é de leitura em uma conexão emprestada do pool e exibe o resultado.
+    Após o commit, invalida no cache de resultados as consultas que leem as tabelas alteradas.
+    Retorna um resumo do resultado (linhas retornadas, linhas afetadas ou erro) para memoização.
+    """
+    # Libera a conexão do resultado paginado anterior antes de executar um novo comando.
+    close_result_stream()
+    outcome = {"columns": None, "rows": None, "rowcount": None, "error": None}
+
+    # Tabelas alteradas pelo comando: vazio para comandos de sessão (SET, BEGIN...) e None quando
+    # não é possível determiná-las (ex: CALL), caso em que todo o cache da DSN é invalidado.
+    tables_to_invalidate = modified_tables(sql_query)
+    is_modifying_query = tables_to_invalidate is None or bool(tables_to_invalidate)
+
+    try:
+        with trace.stage("pool_checkout"):
+            conn = checkout_connection(db_uri)
         try:
-            # Tenta fazer rollback da transação em caso de erro para manter a consistência.
-            if 'conn' in st.session_state and st.session_state.conn:
-                st.session_state.conn.rollback()
-                st.warning("A transação foi revertida (rollback) devido ao erro.")
-        except (mysql.connector.Error, psycopg2.Error) as rb_err:
-            st.error(f"Falha adicional ao tentar reverter a transação: {rb_err}")
+            cursor = conn.cursor()
+            try:
+                set_statement_timeout(conn, db_type, st.session_state.get("statement_timeout", DEFAULT_STATEMENT_TIMEOUT))
+                with trace.stage("db_execute"):
+                    # Executa a consulta SQL em segundo plano, permitindo cancelá-la.
+                    run_cancellable_query_st(conn, db_type, db_uri, sql_query, lambda: cursor.execute(sql_query))
+                if cursor.description: # Verifica se a consulta retornou resultados (geralmente SELECT).
+                    column_names = [desc[0] for desc in cursor.description] # Obtém os nomes das colunas.
+                    with trace.stage("db_fetch") as stage:
+                        results = cursor.fetchall() # Busca todos os resultados.
+                        stage.update(rows=len(results), bytes=sum(estimate_row_bytes(row) for row in results))
+                    if results:
+                        outcome.update(columns=column_names, rows=[list(row) for row in results])
+                        st.success("Resultados da Consulta:")
+                        with trace.stage("dataframe") as stage:
+                            df = rows_to_dataframe(column_names, results) # Cria um dataframe colunar (tipado) para exibição formatada.
+                            stage.update(rows=len(df), bytes=int(df.memory_usage(deep=False).sum()))
+                        st.dataframe(df) # Exibe o dataframe.
+                    else:
+                        st.info("A consulta foi executada com sucesso, mas não retornou resultados.")
+                else: # Se não houver descrição, geralmente é uma consulta de modificação (INSERT, UPDATE, DELETE).
+                    if hasattr(cursor, 'rowcount') and cursor.rowcount is not None and cursor.rowcount > -1:
+                         outcome["rowcount"] = cursor.rowcount
+                         st.success(f"Comando SQL executado com sucesso. {cursor.rowcount} linha(s) afetada(s).")
+                    else:
+                        st.success("Comando SQL executado com sucesso (sem resultados para exibir ou número de linhas afetadas indisponível).")
+            except QueryCancelled:
+                st.warning("Consulta cancelada.")
+                conn.rollback()
+                outcome["error"] = "Consulta cancelada."
+                return outcome
+            except db_errors(db_uri) as err:
+                # Captura erros específicos do banco de dados.
+                st.error(f"ERRO ao executar a consulta SQL: {err}")
+                st.error(f"SQL com problema: {sql_query}")
+                try:
+                    # Tenta fazer rollback da transação em caso de erro para manter a consistência.
+                    conn.rollback()
+                    st.warning("A transação foi revertida (rollback) devido ao erro.")
+                except db_errors(db_uri) as rb_err:
+                    st.error(f"Falha adicional ao tentar reverter a transação: {rb_err}")
+                outcome["error"] = str(err)
+                return outcome
+            finally:
+                cursor.close()
+
+            if is_modifying_query:
+                try:
+                    with trace.stage("commit"):
+                        conn.commit() # Realiza commit para salvar as alterações no banco.
+                    st.success("Alterações foram enviadas para o banco de dados.")
+                    with trace.stage("result_cache_invalidation") as stage:
+                        stage["entries"] = get_result_cache().invalidate_tables(db_uri, tables_to_invalidate)
+                except db_errors(db_uri) as commit_err:
+                    outcome["error"] = str(commit_err)
+                    st.error(f"ERRO ao enviar alterações: {commit_err}")
+                    try:
+                        conn.rollback() # Realiza rollback em caso de erro no commit.
+                        st.warning("Rollback realizado devido a erro no envio.")
+                    except Exception as rb_err:
+                        st.error(f"Erro também ao tentar rollback: {rb_err}")
+        finally:
+            conn.close() # Devolve a conexão ao pool.
     except Exception as e:
-        # Captura outros erros inesperados.
+        # Captura outros erros inesperados (incluindo falhas ao obter conexão do pool).
         st.error(f"ERRO inesperado durante a execução da query: {e}")
         st.error(f"SQL com problema: {sql_query}")
+        outcome["error"] = str(e)
+    return outcome
 
-# Função de formatação de SQL
-def format_sql_with_regex(sql_query: str) -> str:
+# Função de Refinamento Local de Resultados
+def execute_followup_st(store, sql_query):
     """
-    Formata uma query SQL usando expressões regulares para melhorar a legibilidade básica,
-    adicionando quebras de linha antes de cláusulas SQL comuns.
+    Executa o SQL de refinamento sobre os resultados anteriores da sessão (SQLite em memória),
+    sem acessar o banco de origem, e o guarda como o novo último resultado.
+    Reexecuções do script reexibem o mesmo resultado sem executá-lo novamente.
     """
-    if not sql_query:
-        return ""
-    
-    # Adiciona quebra de linha antes das principais cláusulas SQL.
-    # A flag re.IGNORECASE torna a busca insensível a maiúsculas/minúsculas.
-    # O \b garante que estamos buscando palavras inteiras (ex: não vai quebrar a linha em 'GROUPING').
-    formatted_query = re.sub(r'\b(FROM|WHERE|GROUP BY|ORDER BY|LEFT JOIN|RIGHT JOIN|INNER JOIN|ON|HAVING|LIMIT)\b', 
-                             r'\n\1', 
-                             sql_query, 
-                             flags=re.IGNORECASE)
-    
-    # Remove múltiplos espaços em branco e limpa as linhas para um resultado final limpo.
-    lines = [line.strip() for line in formatted_query.split('\n')]
-    return '\n'.join(filter(None, lines))
+    sql_query = sql_query.strip().rstrip(";")
+    memo = st.session_state.get("followup_memo")
+    if memo is None or memo["sql"] != sql_query:
+        trace = RequestTrace("execution")
+        try:
+            with trace.stage("followup_execute") as stage:
+                columns, rows = store.execute(sql_query)
+                stage["rows"] = len(rows)
+        except Exception as e:
+            st.error(f"ERRO ao executar a consulta sobre os resultados anteriores: {e}")
+            st.error(f"SQL com problema: {sql_query}")
+            return
+        finally:
+            get_metrics_registry().observe(trace)
+            st.session_state.execution_trace = trace
+        store.add_result(columns, rows, sql_query, st.session_state.get("generated_question"))
+        memo = {"sql": sql_query, "columns": columns, "rows": rows, "seconds": trace.total_seconds()}
+        st.session_state.followup_memo = memo
+
+    if memo["rows"]:
+        st.success("Resultados da Consulta:")
+        st.dataframe(rows_to_dataframe(memo["columns"], memo["rows"]))
+    else:
+        st.info("A consulta foi executada com sucesso, mas não retornou resultados.")
+    st.caption(f"Executado localmente sobre resultados anteriores em {memo['seconds'] * 1000:.1f} ms, "
+               "sem acessar o banco de origem.")
 
-# Função de Limpeza de SQL
-def clean_sql_query(full_llm_output: str) -> str:
+# Função de Exibição dos Tempos por Etapa
+def display_trace_st(trace, title):
     """
-    Limpa e extrai a consulta SQL da resposta bruta do LLM.
-    Remove blocos de código Markdown (```sql) e espaços em branco extras.
+    Exibe uma tabela com a duração (em ms) e os atributos de cada etapa de um trace.
     """
-    if not isinstance(full_llm_output, str) or not full_llm_output.strip():
-        return ""
-    query = full_llm_output.strip()
-    # Procura por um bloco de código SQL delimitado por ```sql.
-    sql_block_match = re.search(r"```sql\s*(.*?)\s*```", query, re.DOTALL | re.IGNORECASE)
-    if sql_block_match:
-        # Se encontrado, extrai apenas o conteúdo dentro do bloco.
-        query = sql_block_match.group(1).strip()
-
-    # Retorna a query limpa, removendo quaisquer espaços em branco restantes nas extremidades.
-    return query.strip()
+    if trace is None or not trace.stages:
+        return
+    st.markdown(f"**{title}** — total `{trace.total_seconds() * 1000:.1f} ms`")
+    rows = []
+    for stage in trace.stages:
+        attrs = {k: v for k, v in stage.items() if k not in ("stage", "seconds") and v is not None}
+        if "ttft_seconds" in attrs:
+            attrs["ttft_ms"] = round(attrs.pop("ttft_seconds") * 1000, 1)
+        rows.append({
+            "etapa": stage["stage"],
+            "ms": round(stage["seconds"] * 1000, 2),
+            "detalhes": ", ".join(f"{k}={v}" for k, v in attrs.items()),
+        })
+    import pandas as pd
+    st.dataframe(pd.DataFrame(rows), hide_index=True)
 
 # Função de Limpeza de Estado e Cache
 def full_disconnect():
     """
-    Fecha a conexão ativa com o banco de dados e limpa completamente
-    todo o estado da sessão do Streamlit e o cache de recursos,
-    garantindo um reset completo da aplicação.
+    Devolve ao pool a conexão em uso pela sessão e limpa completamente
+    todo o estado da sessão do Streamlit, garantindo um reset completo da aplicação.
+    O motor Text-to-SQL e o pool da DSN são compartilhados pelo processo: apenas a referência
+    desta sessão é liberada, e eles permanecem disponíveis para outras sessões.
     """
-    if 'conn' in st.session_state and st.session_state.conn:
-        try:
-            st.session_state.conn.close() # Tenta fechar a conexão do banco de dados.
-        except Exception as e:
-            st.warning(f"Erro ao fechar conexão: {e}")
+    close_result_stream() # Libera o cursor do resultado paginado e devolve sua conexão ao pool.
+    remove_export_file() # Apaga o arquivo exportado da sessão.
+    if st.session_state.get("followup_store") is not None:
+        st.session_state.followup_store.close() # Descarta os resultados guardados para refinamento.
     # Lista de chaves a serem removidas do estado da sessão.
     keys_to_delete = [
-        'db_connected', 'conn', 'cursor', 'sql_chain', 'db_langchain',
-        'db_uri', 'usable_tables', 'generated_sql', 'db_type', 'db_host',
+        'db_connected', 'sql_chain', 'db_langchain',
+        'db_uri', 'usable_tables', 'schema_fp', 'schema_index', 'schema_load_info', 'selected_tables', 'generated_sql',
+        'generation_trace', 'execution_trace', 'statement_memo', 'query_guard_memo', 'cancelled_sql',
+        'followup_store', 'followup_memo', 'generated_question', 'generated_target', 'db_type', 'db_host',
         'db_user', 'db_name', 'db_port', 'db_password'
     ]
     # Itera sobre as chaves e as remove do estado da sessão se existirem.
     for key in keys_to_delete:
         if key in st.session_state:
             del st.session_state[key]
-    # Limpa o cache de recursos do streamlit, que armazena funções como initialize_text_to_sql_gemini.
-    st.cache_resource.clear()
+    # Libera a referência da sessão ao motor Text-to-SQL (os demais usuários não são afetados).
+    if "resource_owner" in st.session_state:
+        get_resource_registry().release(st.session_state.resource_owner)
 
 # Interface Gráfica do Streamlit
 def run_streamlit_app():
@@ -232,10 +675,18 @@ def run_streamlit_app():
     st.set_page_config(page_title="Text-to-SQL", layout="wide")
     st.title("Text-to-SQL")
 
+    # Expõe /metrics para o Prometheus quando uma porta é configurada (uma vez por processo).
+    if os.getenv("TEXT_TO_SQL_METRICS_PORT"):
+        start_metrics_server(os.getenv("TEXT_TO_SQL_METRICS_PORT"))
+
     # Inicializa o estado da sessão se ainda não estiver definido.
     if 'db_connected' not in st.session_state:
         st.session_state.db_connected = False
         st.session_state.google_api_key = os.getenv("GOOGLE_API_KEY", "") # Carrega a API Key do ambiente.
+    # Identifica a sessão como dona das referências no registro de recursos e as renova a cada execução.
+    if 'resource_owner' not in st.session_state:
+        st.session_state.resource_owner = uuid.uuid4().hex
+    get_resource_registry().touch(st.session_state.resource_owner)
 
     with st.sidebar: # Conteúdo da barra lateral.
         st.header("Configurações")
@@ -273,22 +724,10 @@ def run_streamlit_app():
                     full_disconnect() # Desconecta se já houver uma conexão ativa.
                     st.info("Conexão anterior fechada. Tentando nova conexão...")
                 
-                conn_attempt = None
-                db_uri_attempt = ""
-                # Tenta conectar ao banco de dados com base no tipo selecionado.
-                if db_type == "mysql":
-                    conn_attempt = connect_to_mysql(host, user, password_input, dbname)
-                    if conn_attempt:
-                        db_uri_attempt = f"mysql+mysqlconnector://{user}:{password_input}@{host}/{dbname}"
-                elif db_type == "postgres":
-                    conn_attempt = connect_to_postgresql(host, user, password_input, dbname, port_val)
-                    if conn_attempt:
-                        db_uri_attempt = f"postgresql+psycopg2://{user}:{password_input}@{host}:{port_val}/{dbname}"
-                
-                if conn_attempt:
+                # Tenta conectar ao banco de dados com base no tipo selecionado, usando o pool da DSN.
+                db_uri_attempt = build_db_uri(db_type, host, user, password_input, dbname, port_val)
+                if connect_to_database(db_uri_attempt, db_type):
                     # Armazena os detalhes da conexão no estado da sessão.
-                    st.session_state.conn = conn_attempt
-                    st.session_state.cursor = conn_attempt.cursor()
                     st.session_state.db_uri = db_uri_attempt
                     st.session_state.db_connected = True
                     st.session_state.db_type = db_type
@@ -301,8 +740,8 @@ def run_streamlit_app():
                     st.success(f"Conectado ao {db_type.capitalize()} com sucesso")
                     
                     # Inicializa o motor text-to-SQL após a conexão bem-sucedida.
-                    sql_chain_init, db_langchain_init, usable_tables_init = initialize_text_to_sql_gemini(
-                        st.session_state.db_uri, st.session_state.google_api_key, db_type
+                    sql_chain_init, db_langchain_init, usable_tables_init, schema_fp_init, schema_index_init, schema_load_info_init = initialize_text_to_sql_gemini(
+                        st.session_state.db_uri, st.session_state.google_api_key, st.session_state.resource_owner
                     )
                     
                     if sql_chain_init and db_langchain_init:
@@ -310,6 +749,9 @@ def run_streamlit_app():
                         st.session_state.sql_chain = sql_chain_init
                         st.session_state.db_langchain = db_langchain_init
                         st.session_state.usable_tables = usable_tables_init
+                        st.session_state.schema_fp = schema_fp_init
+                        st.session_state.schema_index = schema_index_init
+                        st.session_state.schema_load_info = schema_load_info_init
                     else:
                         st.error("Falha ao inicializar o motor Text-to-SQL. Desconectando.")
                         full_disconnect() # Desconecta se o motor LLM não puder ser inicializado.
@@ -329,6 +771,117 @@ def run_streamlit_app():
                         st.markdown(f"- `{table_name}`")
                 else:
                     st.markdown("Nenhuma tabela encontrada ou schema não carregado.")
+                # Informa se o schema veio do snapshot em disco ou foi refletido novamente.
+                schema_load_info = st.session_state.get("schema_load_info")
+                if schema_load_info:
+                    origem = {"snapshot": "snapshot em disco", "incremental": "snapshot atualizado", "full": "reflexão completa"}
+                    st.caption(
+                        f"Schema carregado via {origem[schema_load_info['source']]} em "
+                        f"{schema_load_info['elapsed']:.2f}s ({len(schema_load_info['refreshed_tables'])} tabela(s) refletida(s))."
+                    )
+
+        # Número de tabelas relevantes enviadas ao LLM por pergunta (0 envia o schema completo).
+        st.session_state.schema_top_n = st.number_input(
+            "Tabelas relevantes por pergunta (0 = schema completo)",
+            min_value=0, step=1, value=st.session_state.get("schema_top_n", DEFAULT_TOP_N),
+        )
+
+        # Paginação e orçamento de linhas da leitura de resultados em streaming.
+        with st.expander("Leitura de Resultados", expanded=False):
+            st.session_state.page_size = st.number_input(
+                "Linhas por página", min_value=10, step=50,
+                value=st.session_state.get("page_size", DEFAULT_PAGE_SIZE),
+            )
+            st.session_state.max_rows = st.number_input(
+                "Limite total de linhas lidas", min_value=100, step=1000,
+                value=st.session_state.get("max_rows", DEFAULT_MAX_ROWS),
+            )
+
+        # Limites aplicados antes (estimativa do EXPLAIN) e durante (timeout no servidor) a execução.
+        with st.expander("Limites de Execução", expanded=False):
+            st.session_state.guard_max_cost = st.number_input(
+                "Custo estimado máximo (0 = sem limite)", min_value=0.0, step=100000.0,
+                value=float(st.session_state.get("guard_max_cost", DEFAULT_MAX_COST)),
+            )
+            st.session_state.guard_max_rows = st.number_input(
+                "Linhas estimadas máximas (0 = sem limite)", min_value=0.0, step=100000.0,
+                value=float(st.session_state.get("guard_max_rows", DEFAULT_MAX_ESTIMATED_ROWS)),
+            )
+            guard_actions = {"limit": "Reescrever com LIMIT", "reject": "Bloquear a execução"}
+            st.session_state.guard_action = st.radio(
+                "Ao ultrapassar os limites", list(guard_actions), format_func=guard_actions.get,
+                index=list(guard_actions).index(st.session_state.get("guard_action", DEFAULT_GUARD_ACTION)),
+            )
+            st.session_state.guard_limit = st.number_input(
+                "LIMIT da consulta reescrita", min_value=1, step=100,
+                value=st.session_state.get("guard_limit", DEFAULT_GUARD_LIMIT),
+            )
+            st.session_state.statement_timeout = st.number_input(
+                "Timeout no servidor (segundos, 0 = sem timeout)", min_value=0.0, step=5.0,
+                value=float(st.session_state.get("statement_timeout", DEFAULT_STATEMENT_TIMEOUT)),
+            )
+            st.caption("A estimativa de custo usa EXPLAIN no PostgreSQL e no MySQL.")
+
+        # Exibe a ocupação e o tempo de espera do pool de conexões da DSN.
+        if st.session_state.db_connected and st.session_state.get("db_uri"):
+            with st.expander("Pool de Conexões", expanded=False):
+                stats = pool_stats(st.session_state.db_uri)
+                if stats:
+                    st.markdown(f"- Em uso / ociosas: `{stats['checked_out']}` / `{stats['idle']}` (tamanho `{stats['size']}`, excedentes `{stats['overflow']}`)")
+                    st.markdown(f"- Empréstimos: `{stats['checkouts']}` · conexões abertas: `{stats['connects']}`")
+                    st.markdown(f"- Espera média / máxima: `{stats['avg_wait'] * 1000:.1f} ms` / `{stats['max_wait'] * 1000:.1f} ms`")
+
+        # Motores Text-to-SQL mantidos pelo processo e quantas sessões usam cada um.
+        with st.expander("Motores Compartilhados", expanded=False):
+            resource_stats = get_resource_registry().stats()
+            if resource_stats["resources"]:
+                import pandas as pd
+                st.dataframe(pd.DataFrame([
+                    {"dsn": row["dsn"], "sessões": row["refs"], "KB": round(row["bytes"] / 1024, 1),
+                     "ocioso (s)": round(row["idle_seconds"])}
+                    for row in resource_stats["resources"]
+                ]), hide_index=True)
+            else:
+                st.markdown("Nenhum motor carregado.")
+            st.markdown(f"- Reaproveitados / criados / descartados: `{resource_stats['hits']}` / "
+                        f"`{resource_stats['misses']}` / `{resource_stats['evictions']}`")
+
+        # Percentis de latência por etapa e exportação das métricas no formato do Prometheus.
+        with st.expander("Métricas de Latência", expanded=False):
+            registry = get_metrics_registry()
+            summary = registry.summary()
+            if summary:
+                import pandas as pd
+                st.dataframe(pd.DataFrame([
+                    {"tipo": row["kind"], "etapa": row["stage"], "n": row["count"],
+                     "p50 (ms)": round(row["p50"] * 1000, 1), "p95 (ms)": round(row["p95"] * 1000, 1)}
+                    for row in summary
+                ]), hide_index=True)
+            else:
+                st.markdown("Nenhuma requisição instrumentada ainda.")
+            st.download_button("Baixar métricas (Prometheus)", registry.to_prometheus(),
+                               file_name="text_to_sql_metrics.prom", mime="text/plain")
+
+        # Exibe os contadores do cache de geração compartilhado.
+        with st.expander("Cache de Geração", expanded=False):
+            cache_stats = get_generation_cache().stats()
+            st.markdown(f"- Acertos (memória): `{cache_stats['memory_hits']}`")
+            st.markdown(f"- Acertos (disco): `{cache_stats['disk_hits']}`")
+            st.markdown(f"- Faltas: `{cache_stats['misses']}`")
+            st.markdown(f"- Taxa de acerto: `{cache_stats['hit_rate']:.0%}`")
+
+        # Exibe a ocupação e os contadores do cache de resultados compartilhado.
+        with st.expander("Cache de Resultados", expanded=False):
+            result_stats = get_result_cache().stats()
+            st.markdown(f"- Entradas: `{result_stats['entries']}`")
+            st.markdown(
+                f"- Memória: `{result_stats['bytes'] / 1024 / 1024:.1f}` de `{result_stats['max_bytes'] / 1024 / 1024:.0f}` MB"
+            )
+            st.markdown(f"- Acertos: `{result_stats['hits']}` — Faltas: `{result_stats['misses']}`")
+            st.markdown(f"- Taxa de acerto: `{result_stats['hit_rate']:.0%}`")
+            st.markdown(f"- Removidas por LRU: `{result_stats['evictions']}`")
+            st.markdown(f"- Invalidadas por escrita: `{result_stats['invalidations']}`")
+            st.button("Limpar cache de resultados", on_click=get_result_cache().clear, key="clear_result_cache_button")
 
     # Lógica principal da aplicação.
     if not st.session_state.google_api_key:
@@ -337,76 +890,128 @@ def run_streamlit_app():
         st.info("Conecte-se a um banco de dados.")
     else:
         st.subheader("Faça sua pergunta")
+        # Motor de refinamento local da sessão, com os últimos resultados lidos por completo.
+        if st.session_state.get("followup_store") is None:
+            st.session_state.followup_store = FollowupStore()
+        followup_store = st.session_state.followup_store
+        target = "source"
+        if followup_store.results:
+            targets = {"source": "Consultar fonte", "followup": "Refinar último resultado"}
+            target = st.radio("Destino da pergunta", list(targets), format_func=targets.get,
+                              horizontal=True, key="query_target")
+            if target == "followup":
+                st.caption("Resultados disponíveis: " + "; ".join(
+                    f"`{r['table']}` ({r['rows']} linha(s)) — {r['question'] or r['sql']}"
+                    for r in reversed(followup_store.results)
+                ))
         natural_query = st.text_area("Sua pergunta:", height=100, key="natural_query_input") # Campo de entrada para a pergunta em linguagem natural.
         if st.button("Gerar SQL", key="generate_sql_button"):
             if natural_query:
                 with st.spinner("Gerando consulta SQL..."):
+                    generation_trace = RequestTrace("generation")
+                    # Exibe o SQL à medida que o LLM o gera; ao final, o bloco "SQL Gerado" abaixo o substitui.
+                    live_sql = st.empty()
+
+                    def show_partial_sql(partial_sql):
+                        with live_sql.container():
+                            st.subheader("SQL Gerado")
+                            st.code(partial_sql, language="sql")
+
                     try:
-                        
-                        # Prepara o dicionário de entrada para a cadeia da LangChain.
-                        chain_input = {
-                            "question": natural_query,
-                            "input": natural_query,
-                            "dialect": st.session_state.db_langchain.dialect,
-                            "top_k": 100
-                        }
-                        
-                        # Invoca a cadeia text-to-SQL para gerar a consulta.
-                        response_from_llm = st.session_state.sql_chain.invoke(chain_input)
-                        
-                        raw_output_for_cleaning = ""
-                        # Extrai a string de resposta do LLM, que pode vir em diferentes formatos.
-                        if isinstance(response_from_llm, dict) and 'result' in response_from_llm:
-                            raw_output_for_cleaning = response_from_llm['result']
-                        elif isinstance(response_from_llm, str):
-                            raw_output_for_cleaning = response_from_llm
+                        if target == "followup":
+                            # Refinamento: a cadeia vê apenas as tabelas com os resultados anteriores (SQLite).
+                            result = generate_sql(
+                                followup_store.chain(lambda db: build_sql_chain(chain_llm(st.session_state.sql_chain), db)),
+                                natural_query,
+                                "sqlite",
+                                schema_fp=followup_store.schema_fingerprint(),
+                                generation_cache=get_generation_cache(),
+                                trace=generation_trace,
+                                on_token=show_partial_sql,
+                            )
                         else:
-                            st.warning(f"Resposta inesperada do LLM: {type(response_from_llm)}")
-                            st.session_state.generated_sql = ""
-                            st.stop()
-                        
-                        # Limpa e formata a consulta SQL gerada.
-                        cleaned_sql = clean_sql_query(raw_output_for_cleaning)
-                        formatted_sql = format_sql_with_regex(cleaned_sql)
-                        
-                        st.session_state.generated_sql = formatted_sql # Armazena o SQL gerado no estado da sessão.
+                            # Gera o SQL: poda do schema, cache de geração, chamada ao LLM em streaming, limpeza e formatação.
+                            result = generate_sql(
+                                st.session_state.sql_chain,
+                                natural_query,
+                                st.session_state.db_langchain.dialect,
+                                schema_index=st.session_state.get("schema_index"),
+                                schema_top_n=st.session_state.get("schema_top_n", DEFAULT_TOP_N),
+                                schema_fp=st.session_state.get("schema_fp"),
+                                generation_cache=get_generation_cache(),
+                                trace=generation_trace,
+                                on_token=show_partial_sql,
+                            )
+                        st.session_state.generated_sql = result["sql"] # Armazena o SQL gerado no estado da sessão.
+                        st.session_state.selected_tables = result["selected_tables"]
+                        st.session_state.generated_question = natural_query
+                        st.session_state.generated_target = target
+                        if result["from_cache"]:
+                            st.caption("SQL recuperado do cache de geração.")
                         
                     except Exception as e:
                         st.error(f"ERRO GERAL durante o processamento da pergunta: {e}")
                         st.session_state.generated_sql = ""
+                    finally:
+                        live_sql.empty()
+                        get_metrics_registry().observe(generation_trace)
+                        st.session_state.generation_trace = generation_trace
+                        st.session_state.pop("execution_trace", None)
             else:
                 st.warning("Por favor, insira uma pergunta.")
 
         # Exibe o SQL gerado e oferece a opção de executá-lo.
         if st.session_state.get("generated_sql"):
             st.subheader("SQL Gerado")
+            # Informa as tabelas escolhidas pela poda do schema e a redução do prompt.
+            if st.session_state.get("selected_tables") and st.session_state.get("schema_index") is not None:
+                reduction = st.session_state.schema_index.prompt_reduction(st.session_state.selected_tables)
+                st.caption(
+                    f"Tabelas enviadas ao LLM: {', '.join(st.session_state.selected_tables)} — "
+                    f"schema reduzido de {reduction['full_chars']} para {reduction['selected_chars']} caracteres "
+                    f"({reduction['reduction']:.0%} menor)."
+                )
             st.code(st.session_state.generated_sql, language="sql") # Exibe o SQL em um bloco de código.
+            refining = st.session_state.get("generated_target") == "followup"
+            if refining:
+                st.caption("Refinamento: o SQL será executado localmente sobre os resultados anteriores.")
+            else:
+                # Estimativa de custo do otimizador (EXPLAIN): calculada só ao confirmar a execução ou a pedido,
+                # e memorizada por SQL; antes disso, nenhum EXPLAIN chega ao banco a cada rerun.
+                estimate_requested = (st.session_state.get("confirm_execute_sql")
+                                      or st.button("Estimar custo (EXPLAIN)", key="estimate_cost_button"))
+                decision = evaluate_query_guard_st(
+                    st.session_state.db_uri, st.session_state.db_type, st.session_state.generated_sql,
+                    memo_only=not estimate_requested,
+                )
+                if decision is not None:
+                    display_cost_estimate_st(decision)
+                else:
+                    st.caption("A estimativa de custo (EXPLAIN) é calculada ao confirmar a execução.")
             if st.checkbox("Confirmar e Executar SQL", key="confirm_execute_sql"):
-                if st.session_state.generated_sql: 
+                if st.session_state.generated_sql and refining:
+                    execute_followup_st(followup_store, st.session_state.generated_sql)
+                elif st.session_state.generated_sql: 
                     # Executa e exibe os resultados da consulta SQL.
-                    execute_and_display_results_st(st.session_state.cursor, st.session_state.generated_sql)
-                    
-                    # Verifica se a query é de modificação (INSERT, UPDATE, DELETE, etc.) para realizar commit.
-                    is_modifying_query = any(
-                        keyword in st.session_state.generated_sql.upper() 
-                        for keyword in ["INSERT", "UPDATE", "DELETE", "CREATE", "DROP", "ALTER"]
+                    # O commit de comandos de modificação ocorre dentro da execução, antes de a conexão voltar ao pool.
+                    execute_and_display_results_st(
+                        st.session_state.db_uri, st.session_state.generated_sql, db_type=st.session_state.db_type
                     )
-                    if is_modifying_query:
-                        try:
-                            st.session_state.conn.commit() # Realiza commit para salvar as alterações no banco.
-                            st.success("Alterações foram enviadas para o banco de dados.")
-                        except (mysql.connector.Error, psycopg2.Error) as commit_err:
-                            st.error(f"ERRO ao enviar alterações: {commit_err}")
-                            if st.session_state.conn: 
-                                try:
-                                    st.session_state.conn.rollback() # Realiza rollback em caso de erro no commit.
-                                    st.warning("Rollback realizado devido a erro no envio.")
-                                except Exception as rb_err:
-                                    st.error(f"Erro também ao tentar rollback: {rb_err}")
                 else:
                     st.warning("Nenhum SQL válido para executar.")
+            else:
+                # Desmarcar a confirmação permite executar novamente o mesmo comando (ou a consulta cancelada).
+                st.session_state.pop("statement_memo", None)
+                st.session_state.pop("cancelled_sql", None)
+                st.session_state.pop("followup_memo", None)
         elif st.session_state.get("generated_sql") == "": 
             pass
+
+        # Painel com a duração de cada etapa da última geração e da última execução.
+        if st.session_state.get("generation_trace") or st.session_state.get("execution_trace"):
+            with st.expander("Tempos por etapa", expanded=False):
+                display_trace_st(st.session_state.get("generation_trace"), "Geração do SQL")
+                display_trace_st(st.session_state.get("execution_trace"), "Execução da consulta")
         
     st.markdown("---")
 
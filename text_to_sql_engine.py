@@ -0,0 +1,232 @@
+# Motor Text-to-SQL sem dependência do Streamlit: prompt, montagem da cadeia da LangChain,
+# geração de SQL em streaming e limpeza/formatação da saída do LLM.
+# Usado pela interface (text_to_sql.py), pelo modo headless (batch.py) e pelo serviço HTTP (service.py),
+# que assim não importam o Streamlit na partida. A LangChain só é importada ao montar ou executar a cadeia.
+import re
+
+from connection_pool import get_engine
+from generation_cache import make_cache_key, schema_fingerprint
+from metrics import RequestTrace
+from schema_cache import load_sql_database
+from schema_index import DEFAULT_TOP_N, SchemaIndex
+from sql_stream import SQLStatementExtractor
+
+# Lógica de Prompt
+PROMPT_TEMPLATE = """Você é um tradutor de linguagem natural para SQL. Sua tarefa é gerar uma consulta SQL para responder a uma pergunta do usuário, com base no schema do banco de dados fornecido.
+
+**Instruções Cruciais:**
+1.  Gere a consulta SQL no dialeto **{dialect}**.
+2.  A consulta DEVE ser funcional e sintaticamente correta para o dialeto especificado.
+3.  **Certifique-se de que todas as condições de JOIN sejam válidas e baseadas em colunas existentes em AMBAS as tabelas unidas.**
+4.  **Sempre utilize aliases (AS) para colunas de mesmo nome que venham de tabelas diferentes, para evitar duplicidade no resultado (ex: SELECT t1.nome AS nome_tabela1, t2.nome AS nome_tabela2).**
+5.  **NÃO** inclua explicações, comentários, formatação markdown (como ```sql) ou qualquer texto além da consulta SQL pura. Responda **APENAS** com a consulta SQL.
+6.  Para consultas que retornam várias linhas (SELECT), inclua sempre a cláusula LIMIT {top_k} para limitar o número de resultados.
+7.  Certifique-se de que todas as tabelas e colunas referenciadas existam no schema fornecido.
+
+**Schema da Tabela:**
+{table_info}
+
+**Pergunta do Usuário:**
+{input}
+
+**Consulta SQL:**
+"""
+
+# Construção da Cadeia Text-to-SQL
+def build_sql_chain(llm, db):
+    """
+    Cria a cadeia de Text-to-SQL com o prompt customizado para qualquer LLM compatível com a LangChain.
+    """
+    # Lógica de Prompt e função da LangChain que constrói a "cadeia" responsável por converter texto em SQL.
+    from langchain.chains import create_sql_query_chain
+    from langchain_core.prompts import PromptTemplate
+
+    # Cria um objeto PromptTemplate a partir do template definido, especificando as variáveis de entrada.
+    prompt = PromptTemplate(
+        input_variables=["input", "table_info", "dialect", "top_k"], 
+        template=PROMPT_TEMPLATE
+    )
+    return create_sql_query_chain(llm, db, prompt=prompt)
+
+def build_text_to_sql_engine(db_uri, llm):
+    """
+    Monta o motor Text-to-SQL (cadeia, SQLDatabase, índice do schema) para uma DSN e um LLM.
+    Não depende do Streamlit, podendo ser usada pelo modo headless.
+    Retorna (cadeia, db, tabelas utilizáveis, impressão digital do schema, índice, info de carga do schema).
+    """
+    # Cria um objeto SQLDatabase da LangChain a partir da URI do banco de dados, reaproveitando
+    # o snapshot do schema em disco e re-refletindo apenas as tabelas que mudaram.
+    # sample_rows_in_table_info=5 ajuda o LLM a entender o conteúdo das tabelas.
+    # O SQLDatabase usa o Engine do pool compartilhado da DSN.
+    db, table_info_by_table, schema_load_info = load_sql_database(
+        db_uri, sample_rows_in_table_info=5, engine=get_engine(db_uri)
+    )
+
+    # Obtém os nomes das tabelas que o LLM pode usar, a partir do objeto SQLDatabase.
+    usable_tables = db.get_usable_table_names()
+    
+    # Cria a cadeia de Text-to-SQL usando o LLM, o objeto SQLDatabase e o prompt customizado.
+    sql_query_chain = build_sql_chain(llm, db)
+
+    # O table_info de cada tabela vem do snapshot. A junção ordenada dos blocos
+    # equivale a db.get_table_info() e permite medir o prompt de qualquer subconjunto.
+    schema_index = SchemaIndex.from_sql_database(db, table_info_by_table)
+
+    # Impressão digital do table_info completo, usada na chave do cache de geração.
+    schema_fp = schema_fingerprint(schema_index.render_table_info())
+
+    return sql_query_chain, db, usable_tables, schema_fp, schema_index, schema_load_info
+
+# Localiza o LLM na cadeia Text-to-SQL
+def _llm_step_index(steps):
+    from langchain_core.language_models import BaseLanguageModel
+    return next(
+        (i for i, step in enumerate(steps) if isinstance(getattr(step, "bound", step), BaseLanguageModel)), None
+    )
+
+def chain_llm(sql_chain):
+    """
+    Retorna o LLM usado pela cadeia (sem os parâmetros de parada adicionados por create_sql_query_chain),
+    permitindo montar outras cadeias com o mesmo modelo.
+    """
+    steps = getattr(sql_chain, "steps", None) or []
+    llm_index = _llm_step_index(steps)
+    if llm_index is None:
+        raise ValueError("LLM não encontrado na cadeia Text-to-SQL.")
+    return getattr(steps[llm_index], "bound", steps[llm_index])
+
+# Streaming da saída da cadeia Text-to-SQL
+def stream_sql_chain(sql_chain, chain_input, config=None):
+    """
+    Itera sobre os trechos de texto gerados pelo LLM, à medida que chegam.
+    As etapas anteriores ao LLM (table_info e prompt) são executadas normalmente e o LLM é
+    transmitido diretamente: as etapas seguintes de create_sql_query_chain (parser e strip)
+    consumiriam o restante da geração ao interromper o streaming.
+    Fechar o iterador encerra a geração no LLM.
+    """
+    steps = getattr(sql_chain, "steps", None) or []
+    llm_index = _llm_step_index(steps)
+    if llm_index:
+        from langchain_core.runnables import RunnableSequence
+        prepare_prompt = steps[0] if llm_index == 1 else RunnableSequence(*steps[:llm_index])
+        stream = steps[llm_index].stream(prepare_prompt.invoke(chain_input, config=config), config=config)
+    else:
+        stream = sql_chain.stream(chain_input, config=config)
+    try:
+        for chunk in stream:
+            # Modelos de chat emitem mensagens; LLMs de texto, strings.
+            text = getattr(chunk, "content", chunk)
+            if not isinstance(text, str):
+                raise ValueError(f"Resposta inesperada do LLM: {type(chunk)}")
+            yield text
+    finally:
+        stream.close()
+
+# Geração de SQL a partir de uma pergunta
+def generate_sql(sql_chain, question, dialect, schema_index=None, schema_top_n=DEFAULT_TOP_N,
+                 schema_fp=None, top_k=100, generation_cache=None, trace=None, on_token=None):
+    """
+    Gera o SQL para uma pergunta: poda o schema, consulta o cache de geração, transmite a saída
+    da cadeia em streaming até o comando SQL estar completo, e limpa/formata o resultado.
+    Não depende do Streamlit. on_token(sql_parcial) é chamado a cada trecho recebido do LLM.
+    Quando um RequestTrace é informado, a duração de cada etapa é registrada nele.
+    Retorna um dicionário com 'sql', 'selected_tables', 'from_cache' e 'stop_reason'.
+    """
+    trace = trace if trace is not None else RequestTrace("generation")
+    # Prepara o dicionário de entrada para a cadeia da LangChain.
+    chain_input = {
+        "question": question,
+        "input": question,
+        "dialect": dialect,
+        "top_k": top_k
+    }
+
+    # Poda do schema: envia apenas as tabelas relevantes e suas vizinhas por FK.
+    # Sem tabelas selecionadas, a cadeia recebe o schema completo.
+    selected_tables = None
+    with trace.stage("schema_pruning") as stage:
+        if schema_index is not None:
+            selected_tables = schema_index.select_tables(question, schema_top_n)
+            if selected_tables:
+                chain_input["table_names_to_use"] = selected_tables
+                schema_fp = schema_fingerprint(schema_index.render_table_info(selected_tables))
+        stage["tables"] = len(selected_tables) if selected_tables else None
+
+    # Consulta o cache de geração antes de chamar o LLM.
+    cache_key = make_cache_key(question, dialect, top_k, schema_fp)
+    if generation_cache is not None:
+        with trace.stage("cache_lookup") as stage:
+            cached_sql = generation_cache.get(cache_key)
+            stage["hit"] = bool(cached_sql)
+        if cached_sql:
+            return {"sql": cached_sql, "selected_tables": selected_tables, "from_cache": True, "stop_reason": None}
+
+    # Transmite a saída da cadeia text-to-SQL em streaming. O callback registra as etapas internas
+    # da cadeia (table_info, prompt e chamada ao LLM). Assim que o comando SQL está completo,
+    # a geração é interrompida, sem esperar pelo texto que o modelo acrescenta depois.
+    extractor = SQLStatementExtractor()
+    # A cadeia já carregou a LangChain; o callback só é importado aqui.
+    from metrics import LLMStageCallback
+    chunks = stream_sql_chain(sql_chain, chain_input, config={"callbacks": [LLMStageCallback(trace)]})
+    try:
+        for chunk in chunks:
+            complete = extractor.feed(chunk)
+            if on_token is not None:
+                on_token(extractor.sql)
+            if complete:
+                break
+    finally:
+        chunks.close()
+    raw_output_for_cleaning = extractor.finish()
+
+    # Limpa e formata a consulta SQL gerada.
+    with trace.stage("clean_sql"):
+        cleaned_sql = clean_sql_query(raw_output_for_cleaning)
+    with trace.stage("format_sql"):
+        formatted_sql = format_sql_with_regex(cleaned_sql)
+
+    # O encerramento por linha em branco ('balanced') é heurístico: um comando cortado indevidamente
+    # não deve ficar no cache (que persiste em disco), então só os demais critérios são armazenados.
+    if generation_cache is not None and extractor.reason != "balanced":
+        generation_cache.set(cache_key, formatted_sql)
+    return {"sql": formatted_sql, "selected_tables": selected_tables, "from_cache": False,
+            "stop_reason": extractor.reason}
+
+# Função de formatação de SQL
+def format_sql_with_regex(sql_query: str) -> str:
+    """
+    Formata uma query SQL usando expressões regulares para melhorar a legibilidade básica,
+    adicionando quebras de linha antes de cláusulas SQL comuns.
+    """
+    if not sql_query:
+        return ""
+    
+    # Adiciona quebra de linha antes das principais cláusulas SQL.
+    # A flag re.IGNORECASE torna a busca insensível a maiúsculas/minúsculas.
+    # O \b garante que estamos buscando palavras inteiras (ex: não vai quebrar a linha em 'GROUPING').
+    formatted_query = re.sub(r'\b(FROM|WHERE|GROUP BY|ORDER BY|LEFT JOIN|RIGHT JOIN|INNER JOIN|ON|HAVING|LIMIT)\b', 
+                             r'\n\1', 
+                             sql_query, 
+                             flags=re.IGNORECASE)
+    
+    # Remove múltiplos espaços em branco e limpa as linhas para um resultado final limpo.
+    lines = [line.strip() for line in formatted_query.split('\n')]
+    return '\n'.join(filter(None, lines))
+
+# Função de Limpeza de SQL
+def clean_sql_query(full_llm_output: str) -> str:
+    """
+    Limpa e extrai a consulta SQL da resposta bruta do LLM.
+    Remove blocos de código Markdown (```sql) e espaços em branco extras.
+    """
+    if not isinstance(full_llm_output, str) or not full_llm_output.strip():
+        return ""
+    query = full_llm_output.strip()
+    # Procura por um bloco de código SQL delimitado por ```sql.
+    sql_block_match = re.search(r"```sql\s*(.*?)\s*```", query, re.DOTALL | re.IGNORECASE)
+    if sql_block_match:
+        # Se encontrado, extrai apenas o conteúdo dentro do bloco.
+        query = sql_block_match.group(1).strip()
+
+    # Retorna a query limpa, removendo quaisquer espaços em branco restantes nas extremidades.
+    return query.strip()